@@ -1,6 +1,5 @@
 import logging
 import os
-import faiss
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
@@ -20,6 +19,10 @@ def ConfigValues(pdfname="HNMU", service="Categories"):
     serviceMapDataPath = f"{serviceEmbeddingPath}_MapData.json"
     serviceMapChunkPath = f"{serviceEmbeddingPath}_MapChunk.json"
     serviceMetaPath = f"{serviceEmbeddingPath}_Meta.json"
+    serviceMapStorePath = f"{serviceEmbeddingPath}_MapStore"
+    serviceVersionsPath = f"{serviceEmbeddingPath}_Versions"
+    serviceLexicalPath = f"{serviceEmbeddingPath}_Lexical"
+    servicePassagesPath = f"{serviceEmbeddingPath}_Passages"
     serviceSegmentPath = f"{servicePath}_Segment.json"
     
     exceptPath = f"{assetsFolder}/ex.exceptions.json"
@@ -46,18 +49,28 @@ def ConfigValues(pdfname="HNMU", service="Categories"):
     MapDataPath = f"{EmbeddingPath}_MapData.json"
     MapChunkPath = f"{EmbeddingPath}_MapChunk.json"
     MetaPath = f"{EmbeddingPath}_Meta.json"
+    MapStorePath = f"{EmbeddingPath}_MapStore"
+    VersionsPath = f"{EmbeddingPath}_Versions"
+    LexicalPath = f"{EmbeddingPath}_Lexical"     # inverted index BM25 (cùng MapData với FAISS)
+    PassagesPath = f"{EmbeddingPath}_Passages"   # token passage dựng sẵn cho CrossEncoder (memmap)
+    CascadePath = f"{EmbeddingPath}_Cascade.json"   # ngưỡng cascade rerank (python -m Libraries.Faiss_Cascade)
 
     # Keys
     DATA_KEY = "contents"
     EMBE_KEY = "embeddings"
 
     # Models
-    SEARCH_EGINE = faiss.IndexFlatIP
+    SEARCH_EGINE = "flat"   # "flat" | "ivf_flat" | "hnsw_flat" | "ivf_pq" | "opq"
+    SEARCH_STORE = "float32"    # "float32" | "fp16" | "int8" (ScalarQuantizer)
+    SEARCH_REDUCE = None    # None | "pca" | "opq": giảm chiều vector trước khi index
+    SEARCH_REDUCE_DIM = None    # số chiều sau khi giảm (vd. 256); đo recall bằng Faiss_Benchmark --reduce-dims
+    SEARCH_HYBRID = "rrf"   # None | "rrf" | "weighted": hợp nhất BM25 + dense trước rerank
     RERANK_MODEL = "BAAI/bge-reranker-base"
     CHUNKS_MODEL = "paraphrase-multilingual-MiniLM-L12-v2"
     EMBEDD_MODEL = "VoVanPhuc/sup-SimCSE-VietNamese-phobert-base"
     RESPON_MODEL = "gpt-3.5-turbo"
     SUMARY_MODEL = "LongK171/bartpho-syllable-vnexpress"
+    SUMARY_DRAFT = None     # Draft model (cùng tokenizer) cho assisted decoding, ví dụ bản distill từ SummarizationTrainer
 
     WORD_LIMIT = 1000
 
@@ -76,19 +89,33 @@ def ConfigValues(pdfname="HNMU", service="Categories"):
         "MapDataPath": MapDataPath,
         "MapChunkPath": MapChunkPath,
         "MetaPath": MetaPath,
+        "MapStorePath": MapStorePath,
+        "VersionsPath": VersionsPath,
+        "LexicalPath": LexicalPath,
+        "PassagesPath": PassagesPath,
+        "CascadePath": CascadePath,
         "serviceSegmentPath": serviceSegmentPath,
         "serviceFaissPath": serviceFaissPath,
         "serviceMappingPath": serviceMappingPath,
         "serviceMapDataPath": serviceMapDataPath,
         "serviceMapChunkPath": serviceMapChunkPath,
         "serviceMetaPath": serviceMetaPath,
+        "serviceMapStorePath": serviceMapStorePath,
+        "serviceVersionsPath": serviceVersionsPath,
+        "serviceLexicalPath": serviceLexicalPath,
+        "servicePassagesPath": servicePassagesPath,
         "DATA_KEY": DATA_KEY,
         "EMBE_KEY": EMBE_KEY,
         "SEARCH_EGINE": SEARCH_EGINE,
+        "SEARCH_STORE": SEARCH_STORE,
+        "SEARCH_REDUCE": SEARCH_REDUCE,
+        "SEARCH_REDUCE_DIM": SEARCH_REDUCE_DIM,
+        "SEARCH_HYBRID": SEARCH_HYBRID,
         "RERANK_MODEL": RERANK_MODEL,
         "RESPON_MODEL": RESPON_MODEL,        
         "CHUNKS_MODEL": CHUNKS_MODEL,
         "EMBEDD_MODEL": EMBEDD_MODEL,
         "SUMARY_MODEL": SUMARY_MODEL,
+        "SUMARY_DRAFT": SUMARY_DRAFT,
         "WORD_LIMIT": WORD_LIMIT
     }
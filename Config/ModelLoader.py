@@ -4,14 +4,24 @@
 # - Auto-download to local cache when missing
 # - GPU/CPU selection with CUDA checks
 # - Consistent class-based API
+# - Optional int8 dynamic quantization for CPU serving
+# - Optional ONNX Runtime backend (encoder / reranker / summarizer)
 # ============================================================
 
 import os
+import contextlib
 import torch
-from typing import List, Tuple, Optional, Dict, Any
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 
-from sentence_transformers import SentenceTransformer
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from sentence_transformers import SentenceTransformer, CrossEncoder
+from transformers import AutoConfig, AutoModel, AutoTokenizer, AutoModelForSeq2SeqLM
+from accelerate import init_empty_weights
+
+from . import OnnxBackend
+
+
+QUANTIZE_MODES = (None, "int8-dynamic")
+BACKENDS = ("torch", "onnx")
 
 
 class ModelLoader:
@@ -19,11 +29,14 @@ class ModelLoader:
     Unified model manager:
       - Encoder (SentenceTransformer)
       - Chunker (SentenceTransformer)
+      - Reranker (CrossEncoder)
       - Summarizer (Seq2Seq: T5/BART/vit5)
     Provides:
-      - load_encoder(name, cache)
-      - load_chunker(name, cache)
-      - load_summarizer(name, cache)
+      - load_encoder(name, cache, quantize, backend)
+      - load_chunker(name, cache, backend)
+      - load_reranker(name, cache, backend)
+      - load_summarizer(name, cache, quantize, backend)
+      - load_draft_summarizer(name, cache)
       - summarize(text, max_len, min_len)
       - summarize_batch(texts, max_len, min_len)
       - print_devices()
@@ -32,11 +45,16 @@ class ModelLoader:
     # -----------------------------
     # Construction / State
     # -----------------------------
-    def __init__(self, prefer_cuda: bool = True) -> None:
+    def __init__(self,
+                 prefer_cuda: bool = True,
+                 onnx_intra_threads: Optional[int] = None,
+                 onnx_inter_threads: int = 1) -> None:
         self.models: Dict[str, Any] = {}
         self.tokenizers: Dict[str, Any] = {}
         self.devices: Dict[str, torch.device] = {}
         self.prefer_cuda = prefer_cuda
+        self.onnx_intra_threads = onnx_intra_threads
+        self.onnx_inter_threads = onnx_inter_threads
 
     # -----------------------------
     # Device helpers
@@ -63,6 +81,110 @@ class ModelLoader:
         if path:
             os.makedirs(path, exist_ok=True)
 
+    # -----------------------------
+    # Quantization helpers (CPU only)
+    # -----------------------------
+    @staticmethod
+    def _check_quantize(quantize: Optional[str]) -> None:
+        if quantize not in QUANTIZE_MODES:
+            raise ValueError(f"❌ Unsupported quantize mode: {quantize!r}. Expected one of {QUANTIZE_MODES}.")
+
+    @staticmethod
+    def _check_backend(backend: str, cache: Optional[str], quantize: Optional[str] = None) -> None:
+        if backend not in BACKENDS:
+            raise ValueError(f"❌ Unsupported backend: {backend!r}. Expected one of {BACKENDS}.")
+        if backend == "onnx" and not cache:
+            raise ValueError("❌ ONNX backend needs a local cache dir to export into.")
+        if backend == "onnx" and quantize:
+            raise ValueError("❌ quantize is a PyTorch-only option; do not combine with backend='onnx'.")
+
+    def _onnx_session_options(self):
+        return OnnxBackend.make_session_options(self.onnx_intra_threads, self.onnx_inter_threads)
+
+    @staticmethod
+    def _quantized_path(cache_path: Optional[str], quantize: str) -> Optional[str]:
+        """
+        Quantized state dict lives next to the fp32 cache:
+        Models/Summarizer/<name>  ->  Models/Summarizer/<name>.int8-dynamic.pt
+        """
+        if not cache_path:
+            return None
+        return f"{cache_path.rstrip('/')}.{quantize}.pt"
+
+    @staticmethod
+    def _quantize_dynamic(model: torch.nn.Module) -> torch.nn.Module:
+        """
+        Dynamic int8 quantization of every nn.Linear (weights int8, activations quantized on the fly).
+        """
+        model = model.to("cpu").eval()
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _skeleton_only() -> Iterator[None]:
+        """
+        Build model structure without fp32 weights: parameters are created on the meta device
+        (buffers stay real), and AutoModel.from_pretrained (used by SentenceTransformer's
+        Transformer module) builds from config instead of reading the checkpoint.
+        """
+        own = AutoModel.__dict__.get("from_pretrained")
+
+        def from_config(model_name_or_path, *args, config=None, **kwargs):
+            return AutoModel.from_config(config or AutoConfig.from_pretrained(model_name_or_path))
+
+        AutoModel.from_pretrained = staticmethod(from_config)
+        try:
+            with init_empty_weights(include_buffers=False):
+                yield
+        finally:
+            if own is None:
+                del AutoModel.from_pretrained
+            else:
+                AutoModel.from_pretrained = own
+
+    @staticmethod
+    def _quantized_skeleton(model: torch.nn.Module) -> torch.nn.Module:
+        """
+        Same module tree quantize_dynamic produces: every nn.Linear → dynamic int8 Linear (empty),
+        without running the fp32 → int8 conversion.
+        """
+        qlinear = torch.ao.nn.quantized.dynamic.Linear
+        for parent in list(model.modules()):
+            for name, child in list(parent.named_children()):
+                if type(child) is torch.nn.Linear:
+                    setattr(parent, name, qlinear(child.in_features, child.out_features,
+                                                  bias_=child.bias is not None, dtype=torch.qint8))
+        return model.eval()
+
+    def _apply_quantize(self,
+                        build_fp32: Callable[[], torch.nn.Module],
+                        build_skeleton: Optional[Callable[[], torch.nn.Module]],
+                        qpath: Optional[str]) -> torch.nn.Module:
+        """
+        Cached int8 state dict → skeleton (meta params) + int8 Linear shells, load the cache
+        with assign=True: fp32 weights are never read nor materialized.
+        No cache (or unusable) → load fp32, quantize, write the cache.
+        """
+        if build_skeleton is not None and qpath and os.path.exists(qpath):
+            try:
+                with self._skeleton_only():
+                    skeleton = build_skeleton()
+                qmodel = self._quantized_skeleton(skeleton)
+                qmodel.load_state_dict(torch.load(qpath, map_location="cpu"), assign=True)
+                missing = [n for n, p in qmodel.named_parameters() if p.is_meta]
+                if missing:
+                    raise RuntimeError(f"{len(missing)} params not in cache (e.g. {missing[0]})")
+                print(f"📂 Loaded quantized weights: {qpath}")
+                return qmodel
+            except Exception as e:
+                print(f"⚠️ Cached quantized weights unusable ({e}) — re-quantizing from fp32.")
+
+        qmodel = self._quantize_dynamic(build_fp32())
+        if qpath:
+            torch.save(qmodel.state_dict(), qpath)
+            print(f"💾 Cached quantized weights: {qpath}")
+        return qmodel
+
     # -----------------------------
     # SentenceTransformer (Encoder/Chunker)
     # -----------------------------
@@ -102,18 +224,92 @@ class ModelLoader:
         return model, device
 
     # Public APIs for SentenceTransformer
-    def load_encoder(self, name: str, cache: Optional[str] = None) -> Tuple[SentenceTransformer, torch.device]:
-        model, device = self._load_sentence_model(name, cache)
+    def _load_onnx_sentence_model(self, model_name: str, cache_path: str) -> Tuple[Any, torch.device]:
+        print(f"\n🔍 Loading SentenceTransformer ({model_name}) on ONNX Runtime (CPU) ...")
+        self._ensure_dir(cache_path)
+        self._ensure_cached_sentence_model(model_name, cache_path)
+        model = OnnxBackend.OnnxSentenceEncoder(cache_path, self._onnx_session_options())
+        print("✅ ONNX encoder ready.")
+        return model, torch.device("cpu")
+
+    def load_encoder(self,
+                     name: str,
+                     cache: Optional[str] = None,
+                     quantize: Optional[str] = None,
+                     backend: str = "torch") -> Tuple[SentenceTransformer, torch.device]:
+        """
+        quantize="int8-dynamic" → CPU-only int8 Linear layers, cached next to `cache`.
+        backend="onnx" → OnnxSentenceEncoder exported once to `<cache>-onnx`.
+        """
+        self._check_quantize(quantize)
+        self._check_backend(backend, cache, quantize)
+        if backend == "onnx":
+            model, device = self._load_onnx_sentence_model(name, cache)
+            self.models["encoder"] = model
+            self.devices["encoder"] = device
+            return model, device
+
+        if quantize:
+            print(f"⚙️ Quantizing encoder ({quantize}) — forcing CPU.")
+            model = self._apply_quantize(
+                lambda: self._load_sentence_model(name, cache)[0],
+                (lambda: SentenceTransformer(cache, device="cpu")) if cache else None,
+                self._quantized_path(cache, quantize),
+            )
+            device = torch.device("cpu")
+        else:
+            model, device = self._load_sentence_model(name, cache)
         self.models["encoder"] = model
         self.devices["encoder"] = device
         return model, device
 
-    def load_chunker(self, name: str, cache: Optional[str] = None) -> Tuple[SentenceTransformer, torch.device]:
-        model, device = self._load_sentence_model(name, cache)
+    def load_chunker(self,
+                     name: str,
+                     cache: Optional[str] = None,
+                     backend: str = "torch") -> Tuple[SentenceTransformer, torch.device]:
+        self._check_backend(backend, cache)
+        if backend == "onnx":
+            model, device = self._load_onnx_sentence_model(name, cache)
+        else:
+            model, device = self._load_sentence_model(name, cache)
         self.models["chunker"] = model
         self.devices["chunker"] = device
         return model, device
 
+    # -----------------------------
+    # Reranker (CrossEncoder)
+    # -----------------------------
+    def load_reranker(self,
+                      name: str,
+                      cache: Optional[str] = None,
+                      backend: str = "torch") -> Tuple[CrossEncoder, torch.device]:
+        """
+        Load CrossEncoder; cache it under `cache` when provided.
+        backend="onnx" → OnnxCrossEncoder exported once to `<cache>-onnx`.
+        """
+        self._check_backend(backend, cache)
+        device = torch.device("cpu") if backend == "onnx" else self._get_device()
+        print(f"\n🔍 Loading CrossEncoder ({name}) on {device} [{backend}] ...")
+
+        if cache:
+            self._ensure_dir(cache)
+            if not self._has_hf_config(cache):
+                print(f"📥 Downloading CrossEncoder to: {cache}")
+                CrossEncoder(name).save(cache)
+            source = cache
+        else:
+            source = name
+
+        if backend == "onnx":
+            model = OnnxBackend.OnnxCrossEncoder(source, self._onnx_session_options())
+        else:
+            model = CrossEncoder(source, device=str(device))
+
+        self.models["reranker"] = model
+        self.devices["reranker"] = device
+        print("✅ CrossEncoder ready.")
+        return model, device
+
     # -----------------------------
     # Summarizer (Seq2Seq: T5/BART/vit5)
     # -----------------------------
@@ -139,11 +335,31 @@ class ModelLoader:
         model = AutoModelForSeq2SeqLM.from_pretrained(model_or_dir).to(device)
         return tokenizer, model
 
-    def load_summarizer(self, name: str, cache: Optional[str] = None) -> Tuple[AutoTokenizer, AutoModelForSeq2SeqLM, torch.device]:
+    def _load_summarizer_quantized(self, model_or_dir: str, qpath: Optional[str]) -> Tuple[AutoTokenizer, AutoModelForSeq2SeqLM]:
+        """
+        Cached int8 weights → skeleton from config only (no fp32 weight read or allocation).
+        """
+        tokenizer = AutoTokenizer.from_pretrained(model_or_dir)
+        model = self._apply_quantize(
+            lambda: AutoModelForSeq2SeqLM.from_pretrained(model_or_dir),
+            lambda: AutoModelForSeq2SeqLM.from_config(AutoConfig.from_pretrained(model_or_dir)),
+            qpath,
+        )
+        return tokenizer, model
+
+    def load_summarizer(self,
+                        name: str,
+                        cache: Optional[str] = None,
+                        quantize: Optional[str] = None,
+                        backend: str = "torch") -> Tuple[AutoTokenizer, AutoModelForSeq2SeqLM, torch.device]:
         """
         Load Seq2Seq model; auto-download if cache dir missing or invalid.
+        quantize="int8-dynamic" → CPU-only int8 Linear layers, cached next to `cache`.
+        backend="onnx" → ORTModelForSeq2SeqLM exported once to `<cache>-onnx`.
         """
-        device = self._get_device()
+        self._check_quantize(quantize)
+        self._check_backend(backend, cache, quantize)
+        device = torch.device("cpu") if (quantize or backend == "onnx") else self._get_device()
         print(f"\n🔍 Initializing summarizer ({name}) on {device} ...")
         self._cuda_check()
 
@@ -152,7 +368,17 @@ class ModelLoader:
             if not self._has_hf_config(cache):
                 self._download_and_cache_summarizer(name, cache)
             print("📂 Loading summarizer from local cache...")
-            tok, mdl = self._load_summarizer_core(cache, device)
+            if backend == "onnx":
+                print("⚙️ Using ONNX Runtime backend ...")
+                tok, mdl = OnnxBackend.load_onnx_summarizer(cache, self._onnx_session_options())
+            elif quantize:
+                print(f"⚙️ Quantizing summarizer ({quantize}) ...")
+                tok, mdl = self._load_summarizer_quantized(cache, self._quantized_path(cache, quantize))
+            else:
+                tok, mdl = self._load_summarizer_core(cache, device)
+        elif quantize:
+            print(f"🌐 Loading summarizer from Hugging Face and quantizing ({quantize}) ...")
+            tok, mdl = self._load_summarizer_quantized(name, None)
         else:
             print("🌐 Loading summarizer directly from Hugging Face (no cache dir provided)...")
             tok, mdl = self._load_summarizer_core(name, device)
@@ -164,6 +390,35 @@ class ModelLoader:
         print(f"✅ Summarizer ready on {device}")
         return tok, mdl, device
 
+    def load_draft_summarizer(self, name: str, cache: Optional[str] = None) -> Tuple[AutoModelForSeq2SeqLM, torch.device]:
+        """
+        Load a small draft Seq2Seq model for assisted generation.
+        Must share the main summarizer's tokenizer/vocab (e.g. distilled with SummarizationTrainer).
+        """
+        if "summarizer" not in self.models:
+            raise RuntimeError("❌ Summarizer not loaded. Call load_summarizer() first.")
+        device = self.devices["summarizer"]
+        print(f"\n🔍 Initializing draft summarizer ({name}) on {device} ...")
+
+        if cache:
+            self._ensure_dir(cache)
+            if not self._has_hf_config(cache):
+                self._download_and_cache_summarizer(name, cache)
+            _, draft = self._load_summarizer_core(cache, device)
+        else:
+            _, draft = self._load_summarizer_core(name, device)
+
+        main_vocab = self.models["summarizer"].config.vocab_size
+        if draft.config.vocab_size != main_vocab:
+            raise ValueError(
+                f"❌ Draft vocab ({draft.config.vocab_size}) != summarizer vocab ({main_vocab}); assisted decoding needs a shared tokenizer."
+            )
+
+        self.models["draft"] = draft
+        self.devices["draft"] = device
+        print(f"✅ Draft summarizer ready on {device}")
+        return draft, device
+
     # -----------------------------
     # Summarization helpers
     # -----------------------------
@@ -0,0 +1,281 @@
+# ============================================================
+# Config/OnnxBackend.py  —  ONNX Runtime backend for ModelLoader
+# - Export once into the local Models/ cache (optimum)
+# - Tuned intra/inter-op threads for CPU serving
+# - Drop-in encode / predict / generate interfaces
+# ============================================================
+
+import os
+import json
+import time
+import numpy as np
+import torch
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+def onnx_cache_path(cache_path: str) -> str:
+    """
+    ONNX export lives next to the PyTorch cache:
+    Models/Summarizer/<name>  ->  Models/Summarizer/<name>-onnx
+    """
+    return f"{cache_path.rstrip('/')}-onnx"
+
+
+def make_session_options(intra_threads: Optional[int] = None, inter_threads: int = 1):
+    """
+    SessionOptions for CPU serving:
+      - intra_op: threads inside one operator (GEMM) → physical cores
+      - inter_op: parallel graph branches → 1 is best for transformer graphs
+    """
+    import onnxruntime as ort
+
+    opts = ort.SessionOptions()
+    opts.intra_op_num_threads = int(intra_threads or os.cpu_count() or 1)
+    opts.inter_op_num_threads = int(inter_threads)
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return opts
+
+
+def _load_or_export(ort_cls, source_dir: str, export_dir: str, session_options) -> Any:
+    """Export source_dir → export_dir on first use, then load from export_dir."""
+    if os.path.exists(os.path.join(export_dir, "config.json")):
+        print(f"📂 Loading ONNX model from cache: {export_dir}")
+        return ort_cls.from_pretrained(export_dir, session_options=session_options)
+
+    print(f"⚙️ Exporting ONNX model: {source_dir} → {export_dir}")
+    model = ort_cls.from_pretrained(source_dir, export=True, session_options=session_options)
+    os.makedirs(export_dir, exist_ok=True)
+    model.save_pretrained(export_dir)
+    print(f"✅ ONNX model cached at: {export_dir}")
+    return model
+
+
+def _as_output(embs: np.ndarray, convert_to_tensor: bool) -> Any:
+    return torch.from_numpy(embs) if convert_to_tensor else embs
+
+
+# ============================================================
+# 1️⃣ Encoder (SentenceTransformer-compatible)
+# ============================================================
+class OnnxSentenceEncoder:
+    """
+    ONNX replacement for SentenceTransformer.encode().
+    Reads pooling / normalize / max_seq_length from the SentenceTransformer cache.
+    """
+
+    def __init__(self, cache_path: str, session_options=None) -> None:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.cache_path = cache_path
+        self.export_path = onnx_cache_path(cache_path)
+        self.model = _load_or_export(ORTModelForFeatureExtraction, cache_path, self.export_path, session_options)
+        self.tokenizer = AutoTokenizer.from_pretrained(cache_path)
+
+        self.max_seq_length = self._read_max_seq_length(cache_path)
+        self.pooling, self.normalize_output = self._read_modules(cache_path)
+
+    # --- SentenceTransformer cache helpers ---
+    @staticmethod
+    def _read_max_seq_length(cache_path: str) -> int:
+        cfg = os.path.join(cache_path, "sentence_bert_config.json")
+        if os.path.exists(cfg):
+            with open(cfg, "r", encoding="utf-8") as f:
+                return int(json.load(f).get("max_seq_length") or 256)
+        return 256
+
+    @staticmethod
+    def _read_modules(cache_path: str) -> Tuple[str, bool]:
+        pooling, normalize = "mean", False
+        modules_path = os.path.join(cache_path, "modules.json")
+        if not os.path.exists(modules_path):
+            return pooling, normalize
+        with open(modules_path, "r", encoding="utf-8") as f:
+            modules = json.load(f)
+        for m in modules:
+            typ = m.get("type", "")
+            if typ.endswith("Pooling"):
+                cfg = os.path.join(cache_path, m.get("path", ""), "config.json")
+                if os.path.exists(cfg):
+                    with open(cfg, "r", encoding="utf-8") as f:
+                        pcfg = json.load(f)
+                    if pcfg.get("pooling_mode_cls_token"):
+                        pooling = "cls"
+                    elif pcfg.get("pooling_mode_max_tokens"):
+                        pooling = "max"
+            elif typ.endswith("Normalize"):
+                normalize = True
+        return pooling, normalize
+
+    # --- Pooling ---
+    def _pool(self, hidden: np.ndarray, mask: np.ndarray) -> np.ndarray:
+        if self.pooling == "cls":
+            return hidden[:, 0]
+        m = mask[..., None].astype(hidden.dtype)
+        if self.pooling == "max":
+            return np.where(m > 0, hidden, -1e9).max(axis=1)
+        return (hidden * m).sum(axis=1) / np.maximum(m.sum(axis=1), 1e-9)
+
+    # --- Public API ---
+    def to(self, device: Any) -> "OnnxSentenceEncoder":
+        return self
+
+    def encode(
+        self,
+        sentences: Any,
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        convert_to_tensor: bool = False,
+        device: Optional[str] = None,
+        normalize_embeddings: bool = False,
+    ) -> Any:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        if not texts:
+            return _as_output(np.zeros((0, 0), dtype="float32"), convert_to_tensor)
+
+        outs: List[np.ndarray] = []
+        for start in range(0, len(texts), batch_size):
+            batch = texts[start:start + batch_size]
+            enc = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=self.max_seq_length, return_tensors="np"
+            )
+            feeds = {k: v for k, v in enc.items() if k in ("input_ids", "attention_mask", "token_type_ids")}
+            hidden = self.model(**feeds).last_hidden_state
+            outs.append(self._pool(np.asarray(hidden), enc["attention_mask"]))
+
+        embs = np.concatenate(outs, axis=0).astype("float32")
+        if self.normalize_output or normalize_embeddings:
+            embs /= np.maximum(np.linalg.norm(embs, axis=1, keepdims=True), 1e-12)
+        if single:
+            embs = embs[0]
+        return _as_output(embs, convert_to_tensor)
+
+
+# ============================================================
+# 2️⃣ Reranker (CrossEncoder-compatible)
+# ============================================================
+class OnnxCrossEncoder:
+    """ONNX replacement for CrossEncoder.predict() (sigmoid when num_labels == 1)."""
+
+    def __init__(self, cache_path: str, session_options=None, max_length: int = 512) -> None:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        from transformers import AutoTokenizer
+
+        self.cache_path = cache_path
+        self.export_path = onnx_cache_path(cache_path)
+        self.model = _load_or_export(ORTModelForSequenceClassification, cache_path, self.export_path, session_options)
+        self.tokenizer = AutoTokenizer.from_pretrained(cache_path)
+        self.max_length = max_length
+        self.num_labels = int(getattr(self.model.config, "num_labels", 1))
+
+    def to(self, device: Any) -> "OnnxCrossEncoder":
+        return self
+
+    def predict(
+        self,
+        sentences: Sequence[Sequence[str]],
+        batch_size: int = 16,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+    ) -> np.ndarray:
+        pairs = list(sentences)
+        if not pairs:
+            return np.zeros((0,), dtype="float32")
+
+        scores: List[np.ndarray] = []
+        for start in range(0, len(pairs), batch_size):
+            batch = pairs[start:start + batch_size]
+            enc = self.tokenizer(
+                [p[0] for p in batch], [p[1] for p in batch],
+                padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+            )
+            feeds = {k: v for k, v in enc.items() if k in ("input_ids", "attention_mask", "token_type_ids")}
+            logits = np.asarray(self.model(**feeds).logits, dtype="float32")
+            if self.num_labels == 1:
+                logits = 1.0 / (1.0 + np.exp(-logits[:, 0]))
+            scores.append(logits)
+        return np.concatenate(scores, axis=0)
+
+
+# ============================================================
+# 3️⃣ Summarizer (Seq2Seq generate-compatible)
+# ============================================================
+def load_onnx_summarizer(cache_path: str, session_options=None) -> Tuple[Any, Any]:
+    """ORTModelForSeq2SeqLM exposes the same .generate() as AutoModelForSeq2SeqLM."""
+    from optimum.onnxruntime import ORTModelForSeq2SeqLM
+    from transformers import AutoTokenizer
+
+    export_path = onnx_cache_path(cache_path)
+    model = _load_or_export(ORTModelForSeq2SeqLM, cache_path, export_path, session_options)
+    tokenizer = AutoTokenizer.from_pretrained(cache_path)
+    return tokenizer, model
+
+
+# ============================================================
+# 4️⃣ Parity check & CPU latency benchmark
+# ============================================================
+def _timed(fn: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    fn()  # warm-up
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000.0)
+    arr = np.asarray(times)
+    return {
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p95_ms": round(float(np.percentile(arr, 95)), 3),
+        "mean_ms": round(float(arr.mean()), 3),
+    }
+
+
+def check_encoder_parity(torch_model, onnx_model, texts: List[str], atol: float = 1e-3) -> Dict[str, Any]:
+    """Cosine / max-abs diff between SentenceTransformer and OnnxSentenceEncoder embeddings."""
+    a = np.asarray(torch_model.encode(texts, convert_to_numpy=True, show_progress_bar=False), dtype="float32")
+    b = np.asarray(onnx_model.encode(texts, convert_to_numpy=True), dtype="float32")
+    cos = (a * b).sum(axis=1) / np.maximum(np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1), 1e-12)
+    max_abs = float(np.abs(a - b).max())
+    return {"min_cosine": float(cos.min()), "max_abs_diff": max_abs, "ok": max_abs <= atol}
+
+
+def check_reranker_parity(torch_model, onnx_model, pairs: List[List[str]], atol: float = 1e-3) -> Dict[str, Any]:
+    """Score diff + top-1 agreement between CrossEncoder and OnnxCrossEncoder."""
+    a = np.asarray(torch_model.predict(pairs, show_progress_bar=False), dtype="float32").reshape(-1)
+    b = np.asarray(onnx_model.predict(pairs), dtype="float32").reshape(-1)
+    max_abs = float(np.abs(a - b).max()) if len(a) else 0.0
+    same_order = bool(np.array_equal(np.argsort(-a), np.argsort(-b)))
+    return {"max_abs_diff": max_abs, "same_ranking": same_order, "ok": max_abs <= atol}
+
+
+def check_summarizer_parity(tokenizer, torch_model, onnx_model, texts: List[str], max_length: int = 128) -> Dict[str, Any]:
+    """Greedy outputs must be token-identical between PyTorch and ONNX."""
+    mismatches = 0
+    for text in texts:
+        enc = tokenizer(text, return_tensors="pt", truncation=True, max_length=1024)
+        with torch.no_grad():
+            a = torch_model.generate(**enc, max_length=max_length, num_beams=1, do_sample=False)
+        b = onnx_model.generate(**enc, max_length=max_length, num_beams=1, do_sample=False)
+        if a[0].tolist() != b[0].tolist():
+            mismatches += 1
+    return {"samples": len(texts), "mismatches": mismatches, "ok": mismatches == 0}
+
+
+def benchmark_cpu_latency(
+    torch_fn: Callable[[], Any],
+    onnx_fn: Callable[[], Any],
+    repeats: int = 20,
+) -> Dict[str, Any]:
+    """
+    Latency of the same call on both backends, e.g.:
+        benchmark_cpu_latency(lambda: st.encode(texts), lambda: ort.encode(texts))
+    """
+    t = _timed(torch_fn, repeats)
+    o = _timed(onnx_fn, repeats)
+    return {
+        "torch": t,
+        "onnx": o,
+        "speedup_p50": round(t["p50_ms"] / o["p50_ms"], 3) if o["p50_ms"] else None,
+    }
@@ -179,6 +179,51 @@ document.addEventListener("DOMContentLoaded", () => {
         }
     }
 
+    // --- Đọc luồng Server-Sent Events từ fetch (POST) ---
+    async function readSSE(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder("utf-8");
+        let buffer = "";
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let sep;
+            while ((sep = buffer.indexOf("\n\n")) !== -1) {
+                const frame = buffer.slice(0, sep);
+                buffer = buffer.slice(sep + 2);
+                const dataLine = frame.split("\n").find(line => line.startsWith("data: "));
+                if (dataLine) {
+                    onEvent(JSON.parse(dataLine.slice(6)));
+                }
+            }
+        }
+    }
+
+    function appendLiveMessage() {
+        activateChatLayout();
+        const messageRow = document.createElement("div");
+        const avatar = document.createElement("div");
+        const messageBubble = document.createElement("div");
+
+        messageRow.classList.add("message-row", "bot-row");
+        avatar.classList.add("avatar");
+        messageBubble.classList.add("bot-msg");
+
+        messageRow.appendChild(avatar);
+        messageRow.appendChild(messageBubble);
+        chatBody.appendChild(messageRow);
+        return messageBubble;
+    }
+
+    const STAGE_LABELS = {
+        extract: "Đang trích xuất PDF...",
+        summarize: "Đang tóm tắt...",
+        classify: "Đang phân loại..."
+    };
+
     async function sendFile(file) {
         activateChatLayout(); // Kích hoạt layout
         appendMessage("user", `Đã đính kèm: ${file.name}`);
@@ -192,23 +237,59 @@ document.addEventListener("DOMContentLoaded", () => {
         }
 
         try {
-            const response = await fetch(`${API_BASE_URL}/process_pdf`, {
+            const response = await fetch(`${API_BASE_URL}/process_pdf_stream`, {
                 method: "POST",
                 headers: headers,
                 body: formData
             });
-            const data = await response.json();
-            typing.remove();
 
-            if (response.ok && data.status === "success") {
-                if (data.checkstatus === "ok") {
-                    appendMessage("bot", `✨**Phân tích PDF thành công!**\nChủ đề: **${data.category}**.\n\n**Tóm tắt:**\n${data.summary}`, true);
-                } else {
-                    appendMessage("bot", `⚠️**Không thể xử lý PDF**\nLý do: ${data.category}`, true);
-                }  
-            } else {
+            if (!response.ok) {
+                const data = await response.json();
+                typing.remove();
                 appendMessage("bot", `❌ **Lỗi:** ${data.detail || "Không rõ"}`, true);
+                return;
             }
+
+            // Hiển thị dần: tóm tắt từng chunk của level hiện tại + token đang sinh (chỉ level cuối)
+            let live = null;
+            let chunks = new Map();  // index chunk → text (token đang sinh, thay bằng summary khi chunk xong)
+            const render = (status) => {
+                if (!live) {
+                    typing.remove();
+                    live = appendLiveMessage();
+                }
+                const partial = [...chunks.values()].filter(Boolean).join("\n");
+                const body = `${status ? `*${status}*\n\n` : ""}${partial}`;
+                live.innerHTML = body.replace(/\*\*(.*?)\*\*/g, '<strong>$1</strong>').replace(/\n/g, '<br>');
+                chatBody.scrollTop = chatBody.scrollHeight;
+            };
+
+            await readSSE(response, (ev) => {
+                if (ev.event === "stage") {
+                    render(STAGE_LABELS[ev.stage] || ev.stage);
+                } else if (ev.event === "level") {
+                    chunks = new Map();  // level mới tóm tắt lại từ bản gộp → bỏ chunk của level trước
+                    render(`Level ${ev.level}`);
+                } else if (ev.event === "chunk") {
+                    chunks.set(ev.index, ev.summary || "");
+                    render(`Level ${ev.level} · chunk ${ev.index}`);
+                } else if (ev.event === "token") {
+                    chunks.set(ev.index, (chunks.get(ev.index) || "") + ev.text);
+                    render(`Level ${ev.level} · đang sinh...`);
+                } else if (ev.event === "result") {
+                    if (live) live.parentElement.remove();
+                    else typing.remove();
+                    if (ev.checkstatus === "ok") {
+                        appendMessage("bot", `✨**Phân tích PDF thành công!**\nChủ đề: **${ev.category}**.\n\n**Tóm tắt:**\n${ev.summary}`, false);
+                    } else {
+                        appendMessage("bot", `⚠️**Không thể xử lý PDF**\nLý do: ${ev.category}`, false);
+                    }
+                } else if (ev.event === "error") {
+                    if (live) live.parentElement.remove();
+                    else typing.remove();
+                    appendMessage("bot", `❌ **Lỗi:** ${ev.detail || "Không rõ"}`, true);
+                }
+            });
         } catch (err) {
             typing.remove();
             appendMessage("bot", "⚠️ **Lỗi kết nối:** Không thể kết nối tới API!", true);
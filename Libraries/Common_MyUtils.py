@@ -3,7 +3,7 @@ import re, os
 import pandas as pd
 import json, csv, openpyxl
 
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List, Any, Tuple, Iterator
 from collections import Counter
 
 
@@ -69,6 +69,29 @@ def insert_jsonl(data: List[dict], path: str):
             f.write(json.dumps(item, ensure_ascii=False) + '\n')
 
 
+def iter_json_items(path: str) -> Iterator[Any]:
+    """
+    Duyệt lần lượt từng phần tử mà không nạp cả file:
+    - .jsonl → mỗi dòng 1 phần tử
+    - .json (mảng gốc) → dùng ijson nếu có; không có thì đọc cả file
+    """
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    try:
+        import ijson
+    except ImportError:
+        logging.warning("⚠️ Chưa cài ijson → đọc cả file JSON vào bộ nhớ.")
+        data = read_json(path)
+        yield from (data if isinstance(data, list) else [data])
+        return
+    with open(path, "rb") as f:
+        yield from ijson.items(f, "item", use_float=True)
+
+
 # ===============================
 # 3. CSV
 # ===============================
@@ -155,6 +178,7 @@ def most_common(values):
     return Counter(values).most_common(1)[0][0]
 
 DEFAULT_NON_KEEP_PATTERN = re.compile(r"[^\w\s\(\)\.\,\;\:\-–]", flags=re.UNICODE)
+MULTI_SPACE_PATTERN = re.compile(r"[ ]{2,}")
 
 def preprocess_text(
     text: Any,
@@ -171,7 +195,7 @@ def preprocess_text(
     if isinstance(text, str):
         s = text.strip()  # <-- sửa từ s = strip()
         s = non_keep_pattern.sub("", s)
-        s = re.sub(r"[ ]{2,}", " ", s)
+        s = MULTI_SPACE_PATTERN.sub(" ", s)
         if max_chars_per_text is not None and len(s) > max_chars_per_text:
             s = s[: max_chars_per_text]
         return s
@@ -0,0 +1,657 @@
+import time
+import argparse
+import faiss
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import Common_MyUtils as MyUtils
+from . import Faiss_Embedding
+from . import Faiss_Searching
+from . import Faiss_MapStore
+from . import Faiss_Lexical
+from . import Faiss_Cache
+from . import Faiss_PassageTokens
+
+
+# ===============================
+# 1. Dữ liệu benchmark
+# ===============================
+def load_vectors(FaissPath: str) -> np.ndarray:
+    """Đọc lại toàn bộ vector từ index Flat (kể cả IDMap2 bọc Flat)."""
+    index = faiss.read_index(FaissPath)
+    base = faiss.downcast_index(index.index) if isinstance(index, faiss.IndexIDMap) else index
+    return base.reconstruct_n(0, base.ntotal).astype("float32")
+
+
+def sample_queries(vectors: np.ndarray, n_queries: int = 200, noise: float = 0.05, seed: int = 42) -> np.ndarray:
+    """
+    Query giả lập = vector corpus + nhiễu Gauss (rồi chuẩn hoá lại),
+    dùng khi chưa có tập query thật đã encode.
+    """
+    rng = np.random.default_rng(seed)
+    pick = rng.choice(vectors.shape[0], size=min(n_queries, vectors.shape[0]), replace=False)
+    q = vectors[pick] + noise * rng.standard_normal((len(pick), vectors.shape[1])).astype("float32")
+    q /= np.maximum(np.linalg.norm(q, axis=1, keepdims=True), 1e-12)
+    return q.astype("float32")
+
+
+def ground_truth(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Top-k chính xác (IndexFlatIP) làm chuẩn để tính recall."""
+    flat = faiss.IndexFlatIP(vectors.shape[1])
+    flat.add(vectors)
+    _, ids = flat.search(queries, k)
+    return ids
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    hits = sum(len(set(f[f >= 0].tolist()) & set(t.tolist())) for f, t in zip(found, truth))
+    return round(hits / (len(truth) * k), 4)
+
+
+def index_memory_bytes(index: faiss.Index) -> int:
+    """Kích thước index khi serialize (≈ RAM của dữ liệu index)."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def _timed_search(index: faiss.Index, queries: np.ndarray, k: int, params: Any = None) -> Dict[str, Any]:
+    start = time.perf_counter()
+    if params is not None:
+        _, ids = index.search(queries, k, params=params)
+    else:
+        _, ids = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    return {"ids": ids, "seconds": elapsed, "qps": round(len(queries) / elapsed, 1) if elapsed else 0.0}
+
+
+# ===============================
+# 2. So sánh loại index
+# ===============================
+def benchmark_index_types(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    index_types: Sequence[str] = Faiss_Embedding.INDEX_TYPES,
+    nprobes: Sequence[int] = (1, 4, 16, 64),
+    ef_searches: Sequence[int] = (16, 64, 128, 256),
+    indexer_kwargs: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Với mỗi index_type: build (train trên sample), đo build time, bộ nhớ,
+    rồi quét knob search (nprobe / efSearch) → recall@k so với Flat + QPS.
+    """
+    truth = ground_truth(vectors, queries, k)
+    rows: List[Dict[str, Any]] = []
+
+    for index_type in index_types:
+        indexer = Faiss_Embedding.DirectFaissIndexer(
+            indexer=None, index_type=index_type, **(indexer_kwargs or {})
+        )
+        start = time.perf_counter()
+        index = indexer._create_faiss_index(vectors)
+        build_sec = round(time.perf_counter() - start, 3)
+        memory = index_memory_bytes(index)
+
+        if Faiss_Embedding.ivf_of(index) is not None:
+            sweep = [("nprobe", v, Faiss_Embedding.search_params(index, nprobe=v)) for v in nprobes]
+        elif Faiss_Embedding.hnsw_of(index) is not None:
+            sweep = [("efSearch", v, Faiss_Embedding.search_params(index, efSearch=v)) for v in ef_searches]
+        else:
+            sweep = [(None, None, None)]
+
+        for knob, value, params in sweep:
+            timed = _timed_search(index, queries, k, params)
+            rows.append({
+                "index_type": index_type,
+                "knob": knob,
+                "value": value,
+                f"recall@{k}": recall_at_k(timed["ids"], truth),
+                "qps": timed["qps"],
+                "build_sec": build_sec,
+                "memory_mb": round(memory / 2 ** 20, 3),
+            })
+    return rows
+
+
+def benchmark_reduction(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    dims: Sequence[int] = (64, 128, 256, 384),
+    methods: Sequence[str] = ("pca", "opq"),
+    index_type: str = "flat",
+    indexer_kwargs: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Quét số chiều sau giảm (PCA / OPQ) cho một index_type:
+    recall@k so với Flat đủ chiều, QPS, bộ nhớ, thời gian build. Dòng đầu = không giảm chiều.
+    """
+    truth = ground_truth(vectors, queries, k)
+    dim = int(vectors.shape[1])
+    configs = [(None, dim)] + [(m, int(d)) for m in methods for d in dims if int(d) < dim]
+    rows: List[Dict[str, Any]] = []
+    for method, d in configs:
+        indexer = Faiss_Embedding.DirectFaissIndexer(
+            indexer=None, index_type=index_type, reduce=method, reduce_dim=d, **(indexer_kwargs or {})
+        )
+        start = time.perf_counter()
+        index = indexer._create_faiss_index(vectors)
+        build_sec = round(time.perf_counter() - start, 3)
+        timed = _timed_search(index, queries, k)
+        rows.append({
+            "reduce": method or "none",
+            "dim": d,
+            f"recall@{k}": recall_at_k(timed["ids"], truth),
+            "qps": timed["qps"],
+            "ms_per_query": round(1000 * timed["seconds"] / len(queries), 4),
+            "memory_mb": round(index_memory_bytes(index) / 2 ** 20, 3),
+            "build_sec": build_sec,
+        })
+    return rows
+
+
+# ===============================
+# 3. Lưu trữ fp16 / int8 (ScalarQuantizer) + đề xuất
+# ===============================
+def _load_seconds(index: faiss.Index) -> float:
+    """Thời gian deserialize index (xấp xỉ thời gian read_index từ page cache)."""
+    blob = faiss.serialize_index(index)
+    start = time.perf_counter()
+    faiss.deserialize_index(blob)
+    return round(time.perf_counter() - start, 4)
+
+
+def recommend_storage(
+    vectors: np.ndarray,
+    queries: np.ndarray,
+    k: int = 10,
+    min_recall: float = 0.98,
+    index_types: Sequence[str] = ("flat", "ivf_flat"),
+    storages: Sequence[str] = Faiss_Embedding.STORAGE_TYPES,
+    nprobe: int = 16,
+    indexer_kwargs: Optional[Dict[str, Any]] = None,
+) -> Dict[str, Any]:
+    """
+    Đo recall@k (so với Flat float32 chính xác), bộ nhớ, thời gian load cho từng
+    (index_type, storage) trên tập query held-out; đề xuất cấu hình nhỏ nhất đạt min_recall.
+    """
+    truth = ground_truth(vectors, queries, k)
+    rows: List[Dict[str, Any]] = []
+    for index_type in index_types:
+        for storage in storages:
+            indexer = Faiss_Embedding.DirectFaissIndexer(
+                indexer=None, index_type=index_type, storage=storage, nprobe=nprobe, **(indexer_kwargs or {})
+            )
+            index = indexer._create_faiss_index(vectors)
+            timed = _timed_search(index, queries, k)
+            rows.append({
+                "index_type": index_type,
+                "storage": storage,
+                f"recall@{k}": recall_at_k(timed["ids"], truth),
+                "qps": timed["qps"],
+                "memory_mb": round(index_memory_bytes(index) / 2 ** 20, 3),
+                "load_sec": _load_seconds(index),
+            })
+
+    ok = [r for r in rows if r[f"recall@{k}"] >= min_recall]
+    best = min(ok, key=lambda r: (r["memory_mb"], -r[f"recall@{k}"])) if ok else None
+    return {"min_recall": min_recall, "rows": rows, "recommended": best}
+
+
+# ===============================
+# 4. Thông lượng encode (lập lịch theo token ↔ batch cố định)
+# ===============================
+def segment_texts(faissIndexer: "Faiss_Embedding.DirectFaissIndexer", SegmentPath: str, SchemaDict: Optional[Dict[str, str]] = None) -> List[str]:
+    """Các text (đã flatten + lọc trùng) mà build_from_json sẽ encode."""
+    data_obj = MyUtils.read_json(SegmentPath)
+    data_list = data_obj if isinstance(data_obj, list) else [data_obj]
+    pairs, chunk_map, base_keys = faissIndexer._pairs_from_items(enumerate(data_list, start=1), SchemaDict)
+    pairs, _ = faissIndexer.deduplicates_with_mask(pairs, chunk_map, base_keys)
+    return [t for _, t in pairs]
+
+
+def _legacy_pairs(
+    faissIndexer: "Faiss_Embedding.DirectFaissIndexer",
+    data_list: List[Any],
+    SchemaDict: Optional[Dict[str, str]],
+) -> Tuple[List[Tuple[str, str]], List[int]]:
+    """Đường cũ: preprocess_data → _merge_lists → flatten_json → regex base_key cho từng key."""
+    pairs: List[Tuple[str, str]] = []
+    chunk_map: List[int] = []
+    for cid, item in enumerate(data_list, start=1):
+        flat = faissIndexer._flatten_json(faissIndexer._preprocess_data(item))
+        for k, v in flat.items():
+            if faissIndexer._eligible_by_schema(k, SchemaDict) and isinstance(v, str) and v.strip():
+                pairs.append((k, v.strip()))
+                chunk_map.append(cid)
+    return pairs, chunk_map
+
+
+def profile_flatten(
+    faissIndexer: "Faiss_Embedding.DirectFaissIndexer",
+    SegmentPath: str,
+    SchemaDict: Optional[Dict[str, str]] = None,
+    repeats: int = 5,
+) -> Dict[str, Any]:
+    """
+    So sánh flatten + lọc trùng: đường cũ (3 lượt đệ quy + regex) ↔ _walk_item (1 lượt).
+    Kiểm tra hai đường cho cùng (key, text) và chunk_groups.
+    """
+    data_obj = MyUtils.read_json(SegmentPath)
+    data_list = data_obj if isinstance(data_obj, list) else [data_obj]
+    items = list(enumerate(data_list, start=1))
+
+    def _legacy():
+        pairs, chunk_map = _legacy_pairs(faissIndexer, data_list, SchemaDict)
+        return faissIndexer.deduplicates_with_mask(pairs, chunk_map)
+
+    def _walker():
+        pairs, chunk_map, base_keys = faissIndexer._pairs_from_items(items, SchemaDict)
+        return faissIndexer.deduplicates_with_mask(pairs, chunk_map, base_keys)
+
+    row: Dict[str, Any] = {"segments": len(data_list)}
+    outputs = {}
+    for name, fn in (("legacy", _legacy), ("single_pass", _walker)):
+        best = float("inf")
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            outputs[name] = fn()
+            best = min(best, time.perf_counter() - start)
+        row[f"{name}_ms"] = round(best * 1000, 3)
+    row["pairs"] = len(outputs["single_pass"][0])
+    row["speedup"] = round(row["legacy_ms"] / row["single_pass_ms"], 2) if row["single_pass_ms"] else None
+    row["identical"] = outputs["legacy"] == outputs["single_pass"]
+    return row
+
+
+def benchmark_encoding(
+    faissIndexer: "Faiss_Embedding.DirectFaissIndexer",
+    texts: List[str],
+    repeats: int = 1,
+) -> Dict[str, Any]:
+    """
+    So sánh:
+      - baseline: encode theo thứ tự gốc, batch_size cố định, tensor → cpu → numpy
+      - scheduled: DirectFaissIndexer._encode_texts (sort theo token, budget token, numpy trực tiếp)
+    Báo cáo texts/sec, tỷ lệ token thật / token sau padding, sai khác embedding.
+    """
+    model = faissIndexer.indexer
+    lengths = faissIndexer._token_lengths(texts)
+
+    def _padding_efficiency(batches: List[np.ndarray]) -> float:
+        padded = sum(int(lengths[b].max()) * len(b) for b in batches if len(b))
+        return round(float(lengths.sum()) / padded, 4) if padded else 0.0
+
+    fixed = [np.arange(i, min(i + faissIndexer.batch_size, len(texts))) for i in range(0, len(texts), faissIndexer.batch_size)]
+    planned = faissIndexer._plan_batches(lengths)
+
+    def _baseline() -> np.ndarray:
+        embs = model.encode(
+            texts, batch_size=faissIndexer.batch_size, convert_to_tensor=True,
+            device=faissIndexer.device, show_progress_bar=False,
+        )
+        return embs.detach().cpu().numpy()
+
+    def _run(fn) -> Tuple[float, np.ndarray]:
+        best, out = float("inf"), None
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            out = fn()
+            best = min(best, time.perf_counter() - start)
+        return best, out
+
+    base_sec, base_embs = _run(_baseline)
+    sched_sec, sched_embs = _run(lambda: faissIndexer._encode_texts(texts))
+
+    return {
+        "texts": len(texts),
+        "baseline": {
+            "seconds": round(base_sec, 3),
+            "texts_per_sec": round(len(texts) / base_sec, 1) if base_sec else 0.0,
+            "batches": len(fixed),
+            "padding_efficiency": _padding_efficiency(fixed),
+        },
+        "scheduled": {
+            "seconds": round(sched_sec, 3),
+            "texts_per_sec": round(len(texts) / sched_sec, 1) if sched_sec else 0.0,
+            "batches": len(planned),
+            "padding_efficiency": _padding_efficiency(planned),
+        },
+        "speedup": round(base_sec / sched_sec, 3) if sched_sec else None,
+        "max_abs_diff": float(np.abs(base_embs - sched_embs).max()) if len(texts) else 0.0,
+    }
+
+
+def benchmark_scaling(
+    faissIndexer: "Faiss_Embedding.DirectFaissIndexer",
+    texts: List[str],
+    workers: Sequence[int] = (1, 2, 4, 8),
+    worker_threads: int = 1,
+) -> List[Dict[str, Any]]:
+    """
+    Hiệu suất mở rộng encode đa tiến trình: thời gian, speedup so với 1 worker,
+    efficiency = speedup / N. (Cần faissIndexer.encoder_path.)
+    """
+    old = (faissIndexer.num_workers, faissIndexer.worker_threads)
+    rows: List[Dict[str, Any]] = []
+    base = None
+    try:
+        for n in workers:
+            faissIndexer.num_workers, faissIndexer.worker_threads = int(n), int(worker_threads)
+            start = time.perf_counter()
+            faissIndexer._encode_texts(texts)
+            sec = time.perf_counter() - start
+            base = base or sec
+            speedup = base / sec if sec else 0.0
+            rows.append({
+                "workers": int(n),
+                "seconds": round(sec, 3),
+                "texts_per_sec": round(len(texts) / sec, 1) if sec else 0.0,
+                "speedup": round(speedup, 3),
+                "efficiency": round(speedup / int(n), 3),
+            })
+    finally:
+        faissIndexer.num_workers, faissIndexer.worker_threads = old
+    return rows
+
+
+def _synthetic_maps(n: int, chunks_per_index: int = 2) -> Tuple[Dict[str, Any], Dict[str, Any], Dict[str, Any]]:
+    """Mapping / MapData / MapChunk giả lập n phần tử (độ dài text ~ dữ liệu thật)."""
+    Mapping = {"index_to_key": {str(i): f"Nội dung[{i % 7}].Đoạn" for i in range(n)}}
+    MapData = {"items": [{"index": i, "key": f"Nội dung[{i % 7}].Đoạn", "text": f"Văn bản mẫu số {i} " * 20} for i in range(n)]}
+    MapChunk = {"index_to_chunk": {str(i): [i // 3 + j for j in range(chunks_per_index)] for i in range(n)}}
+    return Mapping, MapData, MapChunk
+
+
+def benchmark_search_context(
+    searchEngine: "Faiss_Searching.SemanticSearchEngine",
+    sizes: Sequence[int] = (1_000, 10_000, 100_000),
+    dim: int = 768,
+    n_queries: int = 200,
+    k: int = 20,
+    seed: int = 42,
+) -> List[Dict[str, Any]]:
+    """
+    p50 / p99 độ trễ SemanticSearchEngine.search (bỏ qua encode: truyền query_embedding)
+    theo kích thước corpus: dict Mapping/MapData/MapChunk (dựng map mỗi query) ↔ SearchContext dựng sẵn.
+    """
+    rng = np.random.default_rng(seed)
+    rows: List[Dict[str, Any]] = []
+    for n in sizes:
+        vectors = rng.standard_normal((int(n), dim)).astype("float32")
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        index = faiss.IndexFlatIP(dim)
+        index.add(vectors)
+        Mapping, MapData, MapChunk = _synthetic_maps(int(n))
+        context = Faiss_Searching.SearchContext.from_dicts(index, Mapping, MapData, MapChunk)
+        queries = sample_queries(vectors, n_queries, seed=seed)
+
+        modes = {
+            "dicts": lambda q: searchEngine.search("", index, Mapping, MapData, MapChunk, top_k=k, query_embedding=q),
+            "context": lambda q: searchEngine.search("", top_k=k, query_embedding=q, context=context),
+        }
+        for mode, run in modes.items():
+            times = []
+            for q in queries:
+                start = time.perf_counter()
+                run(q)
+                times.append(time.perf_counter() - start)
+            times_ms = np.asarray(times) * 1000
+            rows.append({
+                "corpus": int(n),
+                "mode": mode,
+                "p50_ms": round(float(np.percentile(times_ms, 50)), 4),
+                "p99_ms": round(float(np.percentile(times_ms, 99)), 4),
+            })
+    return rows
+
+
+def verbatim_queries(
+    store: "Faiss_MapStore.MapStore",
+    n_queries: int = 200,
+    span: Tuple[int, int] = (2, 5),
+    seed: int = 42,
+) -> Tuple[List[str], List[int]]:
+    """
+    Query giả lập kiểu gõ nguyên văn (số điều, mã học phần, tên riêng): lấy 1 đoạn
+    span[0]..span[1] âm tiết liên tiếp trong 1 passage. Trả về (queries, id FAISS đúng).
+    """
+    rng = np.random.default_rng(seed)
+    queries: List[str] = []
+    relevant: List[int] = []
+    for pos in rng.permutation(len(store)).tolist():
+        words = (store.texts[pos] or "").split()
+        if len(words) < span[0]:
+            continue
+        size = int(rng.integers(span[0], min(span[1], len(words)) + 1))
+        start = int(rng.integers(0, len(words) - size + 1))
+        queries.append(" ".join(words[start:start + size]))
+        relevant.append(int(store.ids[pos]))
+        if len(queries) >= n_queries:
+            break
+    return queries, relevant
+
+
+def _hit_rate(rows: List[List[Dict[str, Any]]], relevant: Sequence[int]) -> float:
+    return round(float(np.mean([rel in {r["index"] for r in res} for res, rel in zip(rows, relevant)])), 4) if relevant else 0.0
+
+
+def benchmark_lexical(
+    store: "Faiss_MapStore.MapStore",
+    queries: List[str],
+    relevant: Sequence[int],
+    k: int = 10,
+) -> Dict[str, Any]:
+    """BM25: thời gian build, kích thước (nén ↔ posting int64 + tf int32), p50 / p99 độ trễ, recall@k (passage gốc trong top-k)."""
+    start = time.perf_counter()
+    lexical = Faiss_Lexical.BM25Index.from_store(store)
+    build_sec = time.perf_counter() - start
+
+    times, found = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, ids = lexical.search(q, k)
+        times.append(time.perf_counter() - start)
+        found.append(ids)
+    times_ms = np.asarray(times) * 1000 if times else np.zeros(1)
+    postings = int(lexical.meta["postings"])
+    return {
+        "docs": len(lexical),
+        "terms": int(lexical.meta["terms"]),
+        "postings": postings,
+        "build_sec": round(build_sec, 3),
+        "size_mb": round(lexical.nbytes() / 2 ** 20, 3),
+        "raw_postings_mb": round(postings * 12 / 2 ** 20, 3),
+        "p50_ms": round(float(np.percentile(times_ms, 50)), 4),
+        "p99_ms": round(float(np.percentile(times_ms, 99)), 4),
+        f"recall@{k}": round(float(np.mean([rel in f for f, rel in zip(found, relevant)])), 4) if relevant else 0.0,
+    }
+
+
+def benchmark_hybrid(
+    searchEngine: "Faiss_Searching.SemanticSearchEngine",
+    context: "Faiss_Searching.SearchContext",
+    queries: List[str],
+    relevant: Sequence[int],
+    k: int = 10,
+    modes: Sequence[str] = ("dense",) + Faiss_Lexical.FUSION_MODES,
+) -> List[Dict[str, Any]]:
+    """
+    Dense ↔ hybrid (RRF / weighted) trên cùng tập query: p50 / p99 độ trễ search (gồm encode,
+    cache embedding bị bỏ qua) và recall@k của passage đúng. context cần có lexical.
+    """
+    rows: List[Dict[str, Any]] = []
+    query_cache, searchEngine.query_cache = searchEngine.query_cache, Faiss_Cache.TTLCache(0)
+    try:
+        for mode in modes:
+            times, results = [], []
+            for q in queries:
+                start = time.perf_counter()
+                results.append(searchEngine.search(q, top_k=k, context=context, hybrid=mode))
+                times.append(time.perf_counter() - start)
+            times_ms = np.asarray(times) * 1000 if times else np.zeros(1)
+            rows.append({
+                "mode": mode,
+                "queries": len(queries),
+                "p50_ms": round(float(np.percentile(times_ms, 50)), 4),
+                "p99_ms": round(float(np.percentile(times_ms, 99)), 4),
+                f"recall@{k}": _hit_rate(results, relevant),
+            })
+    finally:
+        searchEngine.query_cache = query_cache
+    return rows
+
+
+def benchmark_rerank(
+    reranker: Any,
+    tokenized: "Faiss_PassageTokens.TokenizedCrossEncoder",
+    store: "Faiss_MapStore.MapStore",
+    passages: "Faiss_PassageTokens.PassageTokens",
+    queries: List[str],
+    candidates: int = 20,
+    repeats: int = 1,
+    seed: int = 42,
+) -> Dict[str, Any]:
+    """
+    Rerank 1 query × `candidates` passage: CrossEncoder tokenize cả cặp text ↔ TokenizedCrossEncoder
+    dùng token passage dựng sẵn. p50 / p99 độ trễ, chênh lệch điểm lớn nhất, tỉ lệ query giữ nguyên thứ hạng.
+    """
+    rng = np.random.default_rng(seed)
+    base_times, token_times, diffs, same = [], [], [], []
+    for q in queries:
+        pos = rng.choice(len(store), size=min(candidates, len(store)), replace=False).tolist()
+        text_pairs = [[q, store.texts[p] or ""] for p in pos]
+        key_pairs = [[q, Faiss_PassageTokens.PassageKey(passages, p, store.texts[p] or "")] for p in pos]
+        for _ in range(max(1, repeats)):
+            start = time.perf_counter()
+            base = np.asarray(reranker.predict(text_pairs), dtype="float32")
+            base_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            fast = np.asarray(tokenized.predict(key_pairs), dtype="float32")
+            token_times.append(time.perf_counter() - start)
+        diffs.append(float(np.max(np.abs(base - fast))) if len(pos) else 0.0)
+        same.append(bool(np.array_equal(np.argsort(-base, kind="stable"), np.argsort(-fast, kind="stable"))))
+    base_ms = np.asarray(base_times) * 1000 if base_times else np.zeros(1)
+    token_ms = np.asarray(token_times) * 1000 if token_times else np.zeros(1)
+    return {
+        "queries": len(queries),
+        "candidates": candidates,
+        "text_p50_ms": round(float(np.percentile(base_ms, 50)), 4),
+        "text_p99_ms": round(float(np.percentile(base_ms, 99)), 4),
+        "token_p50_ms": round(float(np.percentile(token_ms, 50)), 4),
+        "token_p99_ms": round(float(np.percentile(token_ms, 99)), 4),
+        "max_score_diff": round(max(diffs), 6) if diffs else 0.0,
+        "same_ranking": round(float(np.mean(same)), 4) if same else 0.0,
+        "passages_mb": round(passages.nbytes() / 2 ** 20, 3),
+    }
+
+
+def print_rows(rows: List[Dict[str, Any]]) -> None:
+    if not rows:
+        return
+    cols = list(rows[0].keys())
+    print(" | ".join(cols))
+    for r in rows:
+        print(" | ".join(str(r.get(c)) for c in cols))
+
+
+# ===============================
+# 5. CLI
+# ===============================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="FAISS index benchmark: recall@k so với Flat, QPS, bộ nhớ.")
+    parser.add_argument("--faiss", default=None, help="Index Flat hiện có (vd. Database/HNMU/HNMU_Embedding_Index.faiss)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.05)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", nargs="*", default=list(Faiss_Embedding.INDEX_TYPES))
+    parser.add_argument("--query-file", default=None, help="Query held-out đã encode (.npy, float32, đã chuẩn hoá)")
+    parser.add_argument("--recommend", action="store_true", help="So sánh storage float32/fp16/int8 và đề xuất")
+    parser.add_argument("--min-recall", type=float, default=0.98)
+    parser.add_argument("--reduce-dims", type=int, nargs="*", default=None,
+                        help="Quét giảm chiều PCA/OPQ (vd. 64 128 256) cho index --types[0]")
+    parser.add_argument("--reduce-methods", nargs="*", default=["pca", "opq"])
+    parser.add_argument("--out", default=None, help="Ghi kết quả JSON")
+    parser.add_argument("--flatten-segment", nargs="*", default=None,
+                        help="Profile flatten cũ ↔ single-pass trên các file Segment (không cần --faiss)")
+    parser.add_argument("--schema", default=None, help="Schema JSON đi kèm --flatten-segment")
+    parser.add_argument("--list-policy", default="split", choices=["merge", "split"])
+    parser.add_argument("--lexical-store", default=None,
+                        help="MapStore (vd. Database/HNMU/HNMU_Embedding_MapStore): benchmark BM25 trên query nguyên văn")
+    parser.add_argument("--hybrid", action="store_true",
+                        help="Kèm --lexical-store: so dense ↔ hybrid bằng model / index chính của appFinal")
+    parser.add_argument("--rerank-store", default=None,
+                        help="MapStore: so reranker tokenize text ↔ token passage dựng sẵn (model rerank của appFinal)")
+    parser.add_argument("--candidates", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.rerank_store:
+        import appFinal
+        if appFinal.rerankTokens is None:
+            raise SystemExit("Reranker hiện tại không hỗ trợ token passage dựng sẵn.")
+        store = Faiss_MapStore.MapStore.load(args.rerank_store)
+        queries, _ = verbatim_queries(store, args.queries)
+        start = time.perf_counter()
+        passages = appFinal.rerankTokens.build_passages(store)
+        build_sec = time.perf_counter() - start
+        result = {"build_sec": round(build_sec, 3),
+                  **benchmark_rerank(appFinal.reranker, appFinal.rerankTokens, store, passages, queries, args.candidates)}
+        print_rows([result])
+        if args.out:
+            MyUtils.write_json(result, args.out, indent=2)
+        return
+
+    if args.lexical_store:
+        store = Faiss_MapStore.MapStore.load(args.lexical_store)
+        queries, relevant = verbatim_queries(store, args.queries)
+        result = {"lexical": benchmark_lexical(store, queries, relevant, k=args.k)}
+        print_rows([result["lexical"]])
+        if args.hybrid:
+            import appFinal
+            bundle = appFinal.currentIndex(appFinal.g_mainRegistry)
+            result["hybrid"] = benchmark_hybrid(appFinal.searchEngine, bundle.context, queries, relevant, k=args.k)
+            print_rows(result["hybrid"])
+        if args.out:
+            MyUtils.write_json(result, args.out, indent=2)
+        return
+
+    if args.flatten_segment:
+        schema = MyUtils.read_json(args.schema) if args.schema else None
+        faissIndexer = Faiss_Embedding.DirectFaissIndexer(indexer=None, list_policy=args.list_policy)
+        result = [
+            {"segment": path, **profile_flatten(faissIndexer, path, schema)}
+            for path in args.flatten_segment
+        ]
+        print_rows(result)
+        if args.out:
+            MyUtils.write_json(result, args.out, indent=2)
+        return
+    if not args.faiss:
+        parser.error("cần --faiss (hoặc --flatten-segment / --lexical-store)")
+
+    vectors = load_vectors(args.faiss)
+    if args.query_file:
+        queries = np.load(args.query_file).astype("float32")
+    else:
+        queries = sample_queries(vectors, args.queries, args.noise)
+
+    if args.reduce_dims:
+        result = benchmark_reduction(
+            vectors, queries, k=args.k, dims=args.reduce_dims,
+            methods=args.reduce_methods, index_type=args.types[0],
+        )
+        print_rows(result)
+    elif args.recommend:
+        result = recommend_storage(vectors, queries, k=args.k, min_recall=args.min_recall)
+        print_rows(result["rows"])
+        print(f"\n✅ Đề xuất: {result['recommended']}")
+    else:
+        result = benchmark_index_types(vectors, queries, k=args.k, index_types=args.types)
+        print_rows(result)
+    if args.out:
+        MyUtils.write_json(result, args.out, indent=2)
+
+
+if __name__ == "__main__":
+    main()
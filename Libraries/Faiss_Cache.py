@@ -0,0 +1,99 @@
+import time
+import hashlib
+import threading
+import unicodedata
+
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+def normalize_query(query: str) -> str:
+    """Chuẩn hoá query làm khoá cache: Unicode NFC + gộp khoảng trắng (giữ hoa/thường → embedding không đổi)."""
+    return " ".join(unicodedata.normalize("NFC", query or "").split())
+
+
+def query_hash(query: str) -> str:
+    return hashlib.blake2b(normalize_query(query).encode("utf-8"), digest_size=16).hexdigest()
+
+
+class TTLCache:
+    """
+    LRU giới hạn kích thước + TTL (thread-safe). maxsize <= 0 → tắt (get luôn trả default, không đếm).
+    Đếm hits / misses / evictions / expirations để tính hit ratio.
+    """
+
+    def __init__(self, maxsize: int, ttl_sec: Optional[float] = None, name: str = "cache"):
+        self.maxsize = int(maxsize)
+        self.ttl = float(ttl_sec) if ttl_sec else None
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()   # key → (hết hạn lúc, value)
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "invalidations": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.maxsize > 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        if not self.enabled:
+            return default
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return default
+            expires, value = entry
+            if expires is not None and expires <= now:
+                del self._data[key]
+                self._stats["expirations"] += 1
+                self._stats["misses"] += 1
+                return default
+            self._data.move_to_end(key)
+            self._stats["hits"] += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        if not self.enabled:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            self._data[key] = (expires, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self._stats["evictions"] += 1
+
+    def clear(self) -> int:
+        with self._lock:
+            n = len(self._data)
+            self._data.clear()
+            self._stats["invalidations"] += n
+            return n
+
+    def drop(self, predicate: Callable[[Hashable], bool]) -> int:
+        """Xoá các khoá thoả predicate (vd. mọi score của 1 phiên bản index cũ)."""
+        with self._lock:
+            stale = [k for k in self._data if predicate(k)]
+            for k in stale:
+                del self._data[k]
+            self._stats["invalidations"] += len(stale)
+            return len(stale)
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+            size = len(self._data)
+        lookups = s["hits"] + s["misses"]
+        return {
+            "name": self.name,
+            "enabled": self.enabled,
+            "size": size,
+            "maxsize": self.maxsize,
+            "ttl_sec": self.ttl,
+            **s,
+            "hit_ratio": round(s["hits"] / lookups, 4) if lookups else 0.0,
+        }
@@ -0,0 +1,301 @@
+import os
+import argparse
+import itertools
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from . import Common_MyUtils as MyUtils
+
+DECISIONS = ("full", "shrink", "skip")
+SCORE_KEYS = ("faiss_score", "fused_score")   # dense → faiss_score; hybrid → fused_score (mọi ứng viên đều có)
+
+
+# ===============================
+# 1. Chính sách cascade
+# ===============================
+class CascadePolicy:
+    """
+    Quyết định số ứng viên search đưa vào CrossEncoder, dựa trên phân bố score_key (giảm dần):
+      - skip:   top1 >= skip_score và (top1 - top2) >= skip_margin → không rerank, giữ thứ tự FAISS
+      - shrink: chỉ rerank ứng viên có score >= top1 - window (kẹp trong [min_rerank, max_rerank])
+      - full:   rerank toàn bộ
+    Ngưỡng None → tắt nhánh tương ứng (mặc định: luôn full, như trước).
+    Ngưỡng được hiệu chỉnh offline bằng calibrate() / CLI của module này, trên cùng chế độ search
+    (dense / hybrid) như lúc phục vụ; score_key ghi lại điểm đã dùng để hiệu chỉnh.
+    """
+
+    def __init__(
+        self,
+        skip_score: Optional[float] = None,
+        skip_margin: float = 0.0,
+        window: Optional[float] = None,
+        min_rerank: int = 1,
+        max_rerank: Optional[int] = None,
+        score_key: str = "faiss_score",
+    ):
+        if score_key not in SCORE_KEYS:
+            raise ValueError(f"score_key phải thuộc {SCORE_KEYS}")
+        self.skip_score = None if skip_score is None else float(skip_score)
+        self.skip_margin = float(skip_margin)
+        self.window = None if window is None else float(window)
+        self.min_rerank = max(1, int(min_rerank))
+        self.max_rerank = None if max_rerank is None else int(max_rerank)
+        self.score_key = score_key
+
+    @property
+    def enabled(self) -> bool:
+        return self.skip_score is not None or self.window is not None or self.max_rerank is not None
+
+    def plan(self, scores: np.ndarray) -> np.ndarray:
+        """
+        scores: ma trận (nq × N) faiss_score giảm dần theo hàng, -inf = không có ứng viên.
+        Trả về số ứng viên cần rerank cho từng query (0 = skip).
+        """
+        scores = np.atleast_2d(np.asarray(scores, dtype="float64"))
+        valid = np.isfinite(scores)
+        counts = valid.sum(axis=1)
+        top1 = np.where(counts > 0, scores[:, 0], -np.inf)
+        second = scores[:, 1] if scores.shape[1] > 1 else np.full(len(scores), -np.inf)
+        margin = np.where(np.isfinite(second), top1 - second, np.inf)
+
+        if self.window is not None:
+            n = ((scores >= (top1 - self.window)[:, None]) & valid).sum(axis=1)
+        else:
+            n = counts.copy()
+        n = np.maximum(n, self.min_rerank)
+        if self.max_rerank is not None:
+            n = np.minimum(n, self.max_rerank)
+        n = np.minimum(n, counts)
+
+        if self.skip_score is not None:
+            n[(top1 >= self.skip_score) & (margin >= self.skip_margin)] = 0
+        return n.astype("int64")
+
+    def scores_of(self, results: Sequence[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """
+        Điểm score_key của từng ứng viên; thiếu (vd. hit chỉ có BM25 khi score_key="faiss_score") → -inf,
+        tức không bao giờ được rerank mà xếp sau. None nếu không ứng viên nào có score_key
+        (chính sách hiệu chỉnh cho chế độ search khác) → caller rerank toàn bộ.
+        """
+        scores = np.array([r.get(self.score_key) if r.get(self.score_key) is not None else -np.inf for r in results],
+                          dtype="float64")
+        return scores if np.isfinite(scores).any() else None
+
+    def decide(self, scores: Sequence[float]) -> Tuple[int, str]:
+        """1 query: (số ứng viên cần rerank, "full" | "shrink" | "skip")."""
+        scores = np.asarray(list(scores), dtype="float64")
+        if scores.size == 0:
+            return 0, "full"
+        n = int(self.plan(scores[None, :])[0])
+        return n, "skip" if n == 0 else ("shrink" if n < scores.size else "full")
+
+    # ---------- Lưu / nạp ----------
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "skip_score": self.skip_score,
+            "skip_margin": self.skip_margin,
+            "window": self.window,
+            "min_rerank": self.min_rerank,
+            "max_rerank": self.max_rerank,
+            "score_key": self.score_key,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "CascadePolicy":
+        return cls(**{k: data[k] for k in ("skip_score", "skip_margin", "window", "min_rerank", "max_rerank", "score_key") if k in data})
+
+    @classmethod
+    def load(cls, path: str) -> "CascadePolicy":
+        """File không có → chính sách mặc định (luôn rerank toàn bộ)."""
+        data = MyUtils.read_json(path) if path and os.path.exists(path) else {}
+        return cls.from_dict(data.get("policy", data) if isinstance(data, dict) else {})
+
+
+# ===============================
+# 2. Hiệu chỉnh offline
+# ===============================
+def collect_records(
+    searchEngine: Any,
+    queries: List[str],
+    context: Any,
+    top_k: int = 20,
+    hybrid: Optional[str] = None,
+    score_key: str = "faiss_score",
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Chạy search (cùng chế độ hybrid như lúc phục vụ) + rerank TOÀN BỘ ứng viên (bỏ qua cache / cascade).
+    Trả về (F, R): score_key và rerank_score (nq × top_k), mỗi hàng xếp giảm dần theo F
+    (như rerank_many), -inf ở ô không có ứng viên / không có score_key.
+    """
+    results_list = searchEngine.search_many(queries, context=context, top_k=top_k, hybrid=hybrid)
+    F = np.full((len(queries), top_k), -np.inf)
+    R = np.full((len(queries), top_k), -np.inf)
+    pairs, owners = [], []
+    for qi, (query, results) in enumerate(zip(queries, results_list)):
+        results = results[:top_k]
+        scores = [r.get(score_key) if r.get(score_key) is not None else -np.inf for r in results]
+        for i, pos in enumerate(sorted(range(len(results)), key=lambda j: -scores[j])):
+            r = results[pos]
+            F[qi, i] = scores[pos]
+            if isinstance(r.get("text"), str) and r["text"].strip():
+                pairs.append([query, r["text"]])
+                owners.append((qi, i))
+    if pairs:
+        scores = searchEngine.reranker.predict(pairs, batch_size=searchEngine.rerank_batch_size, show_progress_bar=True)
+        for (qi, i), s in zip(owners, scores):
+            R[qi, i] = float(s)
+    return F, R
+
+
+def simulate(policy: CascadePolicy, F: np.ndarray, R: np.ndarray, k: int = 10) -> Dict[str, Any]:
+    """
+    So kết quả cascade với rerank toàn bộ trên bản ghi (F, R):
+      - top1_agreement: tỉ lệ query có top-1 trùng
+      - overlap_at_k: độ trùng trung bình của tập top-k
+      - avg_pairs / pair_savings: số cặp CrossEncoder trung bình / tỉ lệ tiết kiệm
+    """
+    nq, N = F.shape
+    n = policy.plan(F)
+    counts = np.isfinite(F).sum(axis=1)
+    pos = np.arange(N)[None, :]
+
+    full_rank = np.argsort(-R, axis=1, kind="stable")
+    # Cascade: ứng viên < n xếp theo rerank, phần còn lại giữ thứ tự FAISS phía sau
+    casc_key = np.where(pos < n[:, None], -R, np.inf)
+    casc_rank = np.lexsort((pos.repeat(nq, axis=0), casc_key), axis=1)
+
+    k = min(k, N)
+    overlap = [
+        len(set(full_rank[q, :min(k, counts[q])].tolist()) & set(casc_rank[q, :min(k, counts[q])].tolist()))
+        / max(1, min(k, counts[q]))
+        for q in range(nq)
+    ]
+    return {
+        "policy": policy.to_dict(),
+        "top1_agreement": round(float(np.mean(full_rank[:, 0] == casc_rank[:, 0])), 4),
+        "overlap_at_k": round(float(np.mean(overlap)), 4),
+        "avg_pairs": round(float(n.mean()), 3),
+        "pair_savings": round(float(1 - n.sum() / max(1, counts.sum())), 4),
+        "skip_ratio": round(float(np.mean(n == 0)), 4),
+    }
+
+
+def calibrate(
+    F: np.ndarray,
+    R: np.ndarray,
+    k: int = 10,
+    target_top1: float = 0.95,
+    target_overlap: float = 0.9,
+    min_rerank: int = 1,
+    quantiles: Sequence[float] = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99),
+    score_key: str = "faiss_score",
+) -> Dict[str, Any]:
+    """
+    Quét lưới ngưỡng (lấy theo phân vị của top1, margin top1-top2, khoảng cách tới top1)
+    → chọn chính sách tiết kiệm nhiều cặp nhất mà vẫn đạt target_top1 và target_overlap.
+    """
+    valid = np.isfinite(F)
+    top1 = F[valid[:, 0], 0]
+    margin = np.where(valid[:, 1], F[:, 0] - F[:, 1], np.inf) if F.shape[1] > 1 else np.zeros(len(F))
+    gaps = (F[:, :1] - F)[valid & (np.arange(F.shape[1])[None, :] > 0)]
+
+    skip_scores = [None] + (sorted({round(float(np.quantile(top1, q)), 4) for q in quantiles}) if top1.size else [])
+    skip_margins = sorted({0.0} | {round(float(np.quantile(margin[np.isfinite(margin)], q)), 4) for q in (0.25, 0.5, 0.75, 0.9)}) \
+        if np.isfinite(margin).any() else [0.0]
+    windows = [None] + (sorted({round(float(np.quantile(gaps, q)), 4) for q in (0.05, 0.1, 0.2, 0.3, 0.5, 0.7)}) if gaps.size else [])
+
+    rows = []
+    for skip_score, skip_margin, window in itertools.product(skip_scores, skip_margins, windows):
+        if skip_score is None and skip_margin > 0:
+            continue  # margin chỉ có nghĩa khi bật skip
+        rows.append(simulate(CascadePolicy(skip_score, skip_margin, window, min_rerank=min_rerank, score_key=score_key), F, R, k))
+
+    ok = [r for r in rows if r["top1_agreement"] >= target_top1 and r["overlap_at_k"] >= target_overlap]
+    best = max(ok, key=lambda r: (r["pair_savings"], r["top1_agreement"])) if ok else simulate(CascadePolicy(score_key=score_key), F, R, k)
+    return {
+        "policy": best["policy"],
+        "metrics": best,
+        "targets": {"top1_agreement": target_top1, "overlap_at_k": target_overlap, "k": k},
+        "queries": int(F.shape[0]),
+        "grid_size": len(rows),
+    }
+
+
+# ===============================
+# 3. CLI
+# ===============================
+def _read_queries(path: str) -> List[str]:
+    """.txt: mỗi dòng 1 query; .json / .jsonl: chuỗi hoặc dict có trường "query"."""
+    if path.endswith(".txt"):
+        with open(path, "r", encoding="utf-8") as f:
+            return [line.strip() for line in f if line.strip()]
+    items = MyUtils.iter_json_items(path)
+    return [q for q in ((it.get("query") if isinstance(it, dict) else it) for it in items) if isinstance(q, str) and q.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Hiệu chỉnh ngưỡng cascade rerank (skip / shrink CrossEncoder).")
+    parser.add_argument("--queries", required=True, help="Tập query (.txt mỗi dòng 1 query, hoặc .json / .jsonl)")
+    parser.add_argument("--pdfname", default="HNMU")
+    parser.add_argument("--top-k", type=int, default=20, help="Số ứng viên FAISS (như runSearch)")
+    parser.add_argument("--k", type=int, default=10, help="Số kết quả giữ sau rerank (như runRerank)")
+    parser.add_argument("--target-top1", type=float, default=0.95)
+    parser.add_argument("--target-overlap", type=float, default=0.9)
+    parser.add_argument("--min-rerank", type=int, default=1)
+    parser.add_argument("--backend", default="torch", help='"torch" | "onnx"')
+    parser.add_argument("--hybrid", default=None, choices=["dense", "rrf", "weighted"],
+                        help="Chế độ search khi hiệu chỉnh (mặc định: SEARCH_HYBRID trong Config, như lúc phục vụ)")
+    parser.add_argument("--out", default=None, help="Mặc định: CascadePath trong Config")
+    args = parser.parse_args()
+
+    import faiss
+    from Config import Configs, ModelLoader as ML
+    from . import Faiss_Lexical, Faiss_MapStore, Faiss_Searching
+
+    config = Configs.ConfigValues(pdfname=args.pdfname)
+    hybrid = args.hybrid or config["SEARCH_HYBRID"] or "dense"
+    score_key = "faiss_score" if hybrid == "dense" else "fused_score"
+    loader = ML.ModelLoader()
+    indexer, device = loader.load_encoder(
+        config["EMBEDD_MODEL"], f"Models/Sentence_Transformer/{config['EMBEDD_MODEL']}", backend=args.backend
+    )
+    reranker, _ = loader.load_reranker(
+        config["RERANK_MODEL"], f"Models/Cross_Encoder/{config['RERANK_MODEL']}", backend=args.backend
+    )
+    engine = Faiss_Searching.SemanticSearchEngine(indexer, reranker, device=str(device), top_k=args.top_k, rerank_k=args.k,
+                                                  hybrid=hybrid)
+
+    index = faiss.read_index(config["FaissPath"])
+    if os.path.isdir(config["MapStorePath"]):
+        store = Faiss_MapStore.MapStore.load(config["MapStorePath"])
+        lexical = None
+        if hybrid != "dense":
+            lexical = (Faiss_Lexical.BM25Index.load(config["LexicalPath"]) if os.path.isdir(config["LexicalPath"])
+                       else Faiss_Lexical.BM25Index.from_store(store))
+        context = Faiss_Searching.SearchContext(index, store, lexical=lexical)
+    elif hybrid != "dense":
+        raise SystemExit(f"hybrid={hybrid} cần MapStore ({config['MapStorePath']}); dùng --hybrid dense.")
+    else:
+        context = Faiss_Searching.SearchContext.from_dicts(
+            index, MyUtils.read_json(config["MappingPath"]), MyUtils.read_json(config["MapDataPath"]),
+            MyUtils.read_json(config["MapChunkPath"]),
+        )
+
+    queries = _read_queries(args.queries)
+    F, R = collect_records(engine, queries, context, top_k=args.top_k, hybrid=hybrid, score_key=score_key)
+    result = calibrate(F, R, k=args.k, target_top1=args.target_top1,
+                       target_overlap=args.target_overlap, min_rerank=args.min_rerank, score_key=score_key)
+    result["hybrid"] = hybrid
+
+    out = args.out or config["CascadePath"]
+    MyUtils.write_json(result, out, indent=2)
+    m = result["metrics"]
+    print(f"✅ {len(queries)} query → {out}")
+    print(f"   policy={result['policy']}")
+    print(f"   top1={m['top1_agreement']}, overlap@{args.k}={m['overlap_at_k']}, "
+          f"cặp/query={m['avg_pairs']} (tiết kiệm {m['pair_savings']:.1%}, skip {m['skip_ratio']:.1%})")
+
+
+if __name__ == "__main__":
+    main()
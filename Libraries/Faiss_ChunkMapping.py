@@ -1,4 +1,13 @@
-from typing import Dict, List, Any, Optional, Iterable
+import numpy as np
+
+from typing import Dict, List, Any, Optional, Iterable, Sequence, Tuple, Union
+
+CHUNK_AGGREGATIONS = ("max", "sum", "softmax")
+_SCORE_KEYS = ("rerank_score", "fused_score", "faiss_score")
+
+# View dựng sẵn lúc nạp (khớp các lời gọi process_chunks_pipeline trong appFinal)
+DEFAULT_DROP_SETS = (("Index",),)
+DEFAULT_FIELD_PATHS = ("Article",)
 
 # --------- A. Tiện ích cơ bản ---------
 
@@ -75,16 +84,273 @@ def _get_by_path(obj: Any, path: str) -> Any:
     return _step(obj, 0)
 
 
-# --------- B. Các hàm chính ---------
+# --------- B. Xếp hạng chunk (gộp điểm theo chunk) ---------
+
+class ChunkIndex:
+    """
+    index_to_chunk dạng CSR: chunk của id FAISS ở vị trí p = chunk_ids[indptr[p]:indptr[p + 1]].
+    from_store dùng thẳng mảng (memmap) của MapStore; from_mapchunk đổi JSON 1 lần lúc nạp.
+    """
+
+    def __init__(self, ids: np.ndarray, indptr: np.ndarray, chunk_ids: np.ndarray):
+        self.ids = ids
+        self.indptr = indptr
+        self.chunk_ids = chunk_ids
+        n = int(ids.shape[0])
+        self._dense = bool(n == 0 or (int(ids[0]) == 0 and int(ids[-1]) == n - 1))
+
+    @classmethod
+    def from_store(cls, store: Any) -> "ChunkIndex":
+        return cls(store.ids, store.chunk_indptr, store.chunk_ids)
+
+    @classmethod
+    def from_mapchunk(cls, MapChunk: Dict[str, Any]) -> "ChunkIndex":
+        raw = (MapChunk or {}).get("index_to_chunk", {})
+        items = sorted((int(i), [int(c) for c in cids if str(c).isdigit()]) for i, cids in raw.items())
+        indptr = np.zeros(len(items) + 1, dtype="int64")
+        np.cumsum([len(cids) for _, cids in items], out=indptr[1:])
+        ids = np.fromiter((i for i, _ in items), dtype="int64", count=len(items))
+        chunk_ids = np.fromiter((c for _, cids in items for c in cids), dtype="int64", count=int(indptr[-1]))
+        return cls(ids, indptr, chunk_ids)
+
+    def gather(self, hit_ids: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Mảng id FAISS → (owner, chunk): owner[j] = thứ tự hit sở hữu chunk[j]; id không có chunk bị bỏ."""
+        hit_ids = np.asarray(hit_ids, dtype="int64")
+        n = int(self.ids.shape[0])
+        if self._dense:
+            pos = np.where((hit_ids >= 0) & (hit_ids < n), hit_ids, -1)
+        else:
+            pos = np.searchsorted(self.ids, hit_ids)
+            found = pos < n
+            found[found] = self.ids[pos[found]] == hit_ids[found]
+            pos = np.where(found, pos, -1)
+        ok = pos >= 0
+        starts = np.where(ok, np.asarray(self.indptr)[np.maximum(pos, 0)], 0)
+        lens = np.where(ok, np.asarray(self.indptr)[np.maximum(pos, 0) + 1] - starts, 0)
+        owner = np.repeat(np.arange(hit_ids.shape[0]), lens)
+        offsets = np.arange(owner.shape[0]) - np.repeat(np.cumsum(lens) - lens, lens)
+        return owner, np.asarray(self.chunk_ids[np.repeat(starts, lens) + offsets], dtype="int64")
+
+
+def _hit_scores(results: List[Dict[str, Any]], score_key: Optional[str] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Điểm từng hit: score_key nếu chỉ định, không thì rerank_score → fused_score → faiss_score.
+    Đuôi ngoài rerank (cascade shrink) không có rerank_score → điểm ngay dưới hit rerank thấp nhất
+    (chỉ để xếp sau), đánh dấu trong mask tail.
+    Trả về (scores, tail).
+    """
+    keys = (score_key,) if score_key else _SCORE_KEYS
+    for key in keys:
+        scores = np.array([r.get(key) if r.get(key) is not None else np.nan for r in results], dtype="float64")
+        present = ~np.isnan(scores)
+        if present.any():
+            tail = np.zeros(len(results), dtype=bool)
+            if not score_key and not present.all():
+                tail = ~present
+                scores[tail] = scores[present].min() - 1.0
+            return scores, tail
+    return np.zeros(len(results), dtype="float64"), np.zeros(len(results), dtype=bool)
+
+
+def aggregate_chunk_scores(
+    owner: np.ndarray,
+    chunks: np.ndarray,
+    scores: np.ndarray,
+    agg: str = "max",
+    temperature: float = 1.0,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Gộp điểm hit → điểm chunk (vector hoá, O(1) mỗi cặp hit-chunk):
+      - "max": điểm cao nhất trong các hit của chunk (np.maximum.at)
+      - "sum": tổng điểm hit (np.add.at) — thưởng chunk có nhiều field khớp
+      - "softmax": tổng trọng số softmax(score / temperature) của các hit (chịu được logit âm)
+    Trả về (chunk_ids, scores, first_hit) theo thứ tự chunk_id; first_hit = thứ tự hit đầu tiên chứa chunk.
+    """
+    if agg not in CHUNK_AGGREGATIONS:
+        raise ValueError(f"agg phải thuộc {CHUNK_AGGREGATIONS}")
+    if chunks.size == 0:
+        return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float64"), np.zeros(0, dtype="int64")
+    uniq, inv = np.unique(chunks, return_inverse=True)
+    first_hit = np.full(uniq.shape[0], np.iinfo("int64").max, dtype="int64")
+    np.minimum.at(first_hit, inv, owner)
+
+    s = np.asarray(scores, dtype="float64")[owner]
+    if agg == "max":
+        out = np.full(uniq.shape[0], -np.inf)
+        np.maximum.at(out, inv, s)
+    else:
+        if agg == "softmax":
+            # Chuẩn hoá trên các hit có mặt trong owner (hit bị loại không chiếm trọng số)
+            hits = np.unique(owner)
+            hit_s = np.asarray(scores, dtype="float64")[hits] / max(float(temperature), 1e-6)
+            w = np.zeros(len(scores))
+            w[hits] = np.exp(hit_s - hit_s.max())
+            s = (w / w.sum())[owner]
+        out = np.zeros(uniq.shape[0])
+        np.add.at(out, inv, s)
+    return uniq, out, first_hit
+
+
+def rank_chunks(
+    results: List[Dict[str, Any]],
+    n_chunks: Optional[int] = None,
+    agg: str = "max",
+    score_key: Optional[str] = None,
+    temperature: float = 1.0,
+    chunk_index: Optional[ChunkIndex] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Xếp hạng chunk từ hit (field-level) đã search / rerank: gộp điểm theo chunk rồi sắp giảm dần
+    (hoà điểm → chunk xuất hiện trước đứng trước).
+    chunk_index: CSR index_to_chunk (ChunkIndex) → lấy chunk theo "index" của hit;
+        None → dùng "chunk_ids" có sẵn trong từng hit.
+    Hit đuôi ngoài rerank không được gộp vào điểm; chunk chỉ có hit đuôi đứng sau mọi chunk còn lại.
+    Trả về: [{"chunk_id": int, "score": float, "hits": int}, ...] (tối đa n_chunks).
+    """
+    if not results:
+        return []
+    scores, tail = _hit_scores(results, score_key)
+    if chunk_index is not None:
+        owner, chunks = chunk_index.gather(np.fromiter((r.get("index", -1) for r in results), dtype="int64", count=len(results)))
+    else:
+        lens = np.fromiter((len(r.get("chunk_ids") or ()) for r in results), dtype="int64", count=len(results))
+        owner = np.repeat(np.arange(len(results)), lens)
+        chunks = np.fromiter((int(c) for r in results for c in (r.get("chunk_ids") or ())), dtype="int64", count=int(lens.sum()))
+    keep = ~np.isnan(scores[owner])
+    owner, chunks = owner[keep], chunks[keep]
+    scores = np.where(np.isnan(scores), -np.inf, scores)
+
+    # Điểm sentinel của đuôi không phải điểm thật → không cộng vào "sum" / "softmax":
+    # chunk có hit rerank chỉ gộp hit rerank; chunk chỉ có hit đuôi xếp sau cùng (điểm sentinel)
+    head = ~tail[owner]
+    uniq, chunk_scores, first_hit = aggregate_chunk_scores(owner[head], chunks[head], scores, agg, temperature)
+    is_tail = np.zeros(uniq.shape[0], dtype=bool)
+    if not head.all():
+        t_uniq, t_scores, t_first = aggregate_chunk_scores(owner[~head], chunks[~head], scores, "max")
+        only = ~np.isin(t_uniq, uniq)
+        uniq = np.concatenate([uniq, t_uniq[only]])
+        chunk_scores = np.concatenate([chunk_scores, t_scores[only]])
+        first_hit = np.concatenate([first_hit, t_first[only]])
+        is_tail = np.concatenate([is_tail, np.ones(int(only.sum()), dtype=bool)])
+
+    order = np.lexsort((first_hit, -chunk_scores, is_tail))
+    if n_chunks is not None:
+        order = order[:int(n_chunks)]
+    counts = dict(zip(*np.unique(chunks, return_counts=True)))
+    return [
+        {"chunk_id": int(uniq[i]), "score": float(chunk_scores[i]), "hits": int(counts[uniq[i]])}
+        for i in order
+    ]
+
+
+# --------- C. View dựng sẵn của SegmentDict ---------
+
+def _drop_key(drop_fields: Optional[Iterable[str]]) -> frozenset:
+    return frozenset(x.lower() for x in (drop_fields or []))
+
+
+def _render_block(data: Any) -> str:
+    """Text 1 chunk đúng như collect_chunk_text: mỗi dòng + "\n", thêm 1 dòng trống ngăn cách."""
+    return "".join(line + "\n" for line in _iter_values_no_keys(data)) + "\n"
+
+
+class SegmentViews:
+    """
+    SegmentDict + view dựng 1 lần lúc nạp (mỗi tổ hợp drop_fields trong drop_sets):
+      - JSON đã bỏ trường (thay _filter_fields_recursive mỗi request)
+      - khối text đã render (thay _iter_values_no_keys)
+      - giá trị _get_by_path cho field_paths (vd. "Article")
+    Request chỉ còn tra theo chunk_id và nối chuỗi; tổ hợp / path không dựng sẵn vẫn tính như cũ.
+    View dùng chung giữa các request → chỉ đọc.
+    """
+
+    def __init__(
+        self,
+        SegmentDict: List[Dict[str, Any]],
+        drop_sets: Sequence[Sequence[str]] = DEFAULT_DROP_SETS,
+        field_paths: Sequence[str] = DEFAULT_FIELD_PATHS,
+    ):
+        self.raw = SegmentDict
+        self.field_paths = tuple(field_paths)
+        self._views: Dict[frozenset, List[Any]] = {}
+        self._texts: Dict[frozenset, List[str]] = {}
+        self._fields: Dict[Tuple[frozenset, str], List[Any]] = {}
+        for drop in [()] + [tuple(d) for d in drop_sets]:
+            key = _drop_key(drop)
+            if key in self._views:
+                continue
+            views = [_filter_fields_recursive(data, key) for data in SegmentDict] if key else SegmentDict
+            self._views[key] = views
+            self._texts[key] = [_render_block(data) for data in views]
+            for path in self.field_paths:
+                self._fields[(key, path)] = [
+                    _get_by_path(data, path) if isinstance(data, dict) else None for data in views
+                ]
+
+    def __len__(self) -> int:
+        return len(self.raw)
+
+    def __getitem__(self, pos: int) -> Any:
+        return self.raw[pos]
+
+    def view(self, cid: int, drop_fields: Optional[Iterable[str]] = None) -> Any:
+        """JSON của chunk cid (1-based) đã bỏ drop_fields."""
+        key = _drop_key(drop_fields)
+        views = self._views.get(key)
+        if views is not None:
+            return views[cid - 1]
+        return _filter_fields_recursive(self.raw[cid - 1], key)
+
+    def render(self, chunk_ids: List[int], drop_fields: Optional[Iterable[str]] = None) -> str:
+        """Text của danh sách chunk (như collect_chunk_text)."""
+        if not chunk_ids:
+            return "(Không có chunk nào)"
+        key = _drop_key(drop_fields)
+        texts = self._texts.get(key)
+        if texts is None:
+            return "".join(_render_block(self.view(cid, drop_fields)) for cid in chunk_ids).strip()
+        return "".join(texts[cid - 1] for cid in chunk_ids).strip()
+
+    def extract(
+        self,
+        chunks: List[Dict[str, Any]],
+        drop_fields: Optional[Iterable[str]] = None,
+        fields: Optional[List[str]] = None,
+    ) -> List[Dict[str, Any]]:
+        """Như extract_fields_for_each_chunk, path dựng sẵn được tra thẳng."""
+        key = _drop_key(drop_fields)
+        results = []
+        for ch in chunks:
+            cid, data = ch["chunk_id"], ch["data"]
+            if not isinstance(data, dict):
+                payload = data
+            elif fields is None:
+                payload = dict(data)
+            else:
+                payload = {}
+                for f in fields:
+                    values = self._fields.get((key, f))
+                    payload[f] = values[cid - 1] if values is not None else _get_by_path(data, f)
+            item = {"chunk_id": cid, "fields": payload}
+            if "score" in ch:
+                item["score"] = ch["score"]
+            results.append(item)
+        return results
+
+
+# --------- D. Các hàm chính ---------
 
 def extract_chunks_from_rerank_flexible(
     reranked_results: List[Dict[str, Any]],
-    SegmentDict: List[Dict[str, Any]],
+    SegmentDict: Union[List[Dict[str, Any]], SegmentViews],
     n_chunks: Optional[int] = None,
     drop_fields: Optional[List[str]] = None,
+    chunk_agg: Optional[str] = None,
+    chunk_index: Optional[ChunkIndex] = None,
 ) -> List[Dict[str, Any]]:
     """
-    - Lấy chunk theo thứ tự từ reranked.
+    - Lấy chunk theo thứ tự từ reranked (chunk_agg=None), hoặc theo điểm gộp của chunk
+      (chunk_agg="max" | "sum" | "softmax", xem rank_chunks → thêm "score").
     - Giới hạn số lượng chunk gốc trả về bằng n_chunks (nếu có).
     - Áp dụng bỏ trường theo drop_fields (toàn bộ cấu trúc).
     - Kết quả: [{"chunk_id": int, "data": <json đã lọc>}]
@@ -92,7 +358,14 @@ def extract_chunks_from_rerank_flexible(
     if not reranked_results:
         return []
 
-    ordered_ids = _ordered_unique_chunk_ids(reranked_results)
+    scores = {}
+    if chunk_agg is not None:
+        ranked = rank_chunks(reranked_results, n_chunks=None, agg=chunk_agg, chunk_index=chunk_index)
+        ranked = [r for r in ranked if 1 <= r["chunk_id"] <= len(SegmentDict)]
+        scores = {r["chunk_id"]: r["score"] for r in ranked}
+        ordered_ids = [r["chunk_id"] for r in ranked]
+    else:
+        ordered_ids = _ordered_unique_chunk_ids(reranked_results)
     if n_chunks is not None:
         ordered_ids = ordered_ids[:int(n_chunks)]
 
@@ -105,9 +378,15 @@ def extract_chunks_from_rerank_flexible(
             continue
         seen.add(cid)
         if 1 <= cid <= len(SegmentDict):
-            data = SegmentDict[cid - 1]
-            filtered = _filter_fields_recursive(data, drop_lower) if drop_lower else data
-            out.append({"chunk_id": cid, "data": filtered})
+            if isinstance(SegmentDict, SegmentViews):
+                filtered = SegmentDict.view(cid, drop_lower)
+            else:
+                data = SegmentDict[cid - 1]
+                filtered = _filter_fields_recursive(data, drop_lower) if drop_lower else data
+            item = {"chunk_id": cid, "data": filtered}
+            if cid in scores:
+                item["score"] = scores[cid]
+            out.append(item)
     return out
 
 
@@ -137,25 +416,28 @@ def extract_fields_for_each_chunk(
     for ch in chunks:
         data = ch["data"]
         if not isinstance(data, dict):
-            results.append({"chunk_id": ch["chunk_id"], "fields": data})
-            continue
-
-        if fields is None:
+            payload = data
+        elif fields is None:
             payload = {k: v for k, v in data.items()}
         else:
             payload = {}
             for f in fields:
                 payload[f] = _get_by_path(data, f)
-        results.append({"chunk_id": ch["chunk_id"], "fields": payload})
+        item = {"chunk_id": ch["chunk_id"], "fields": payload}
+        if "score" in ch:
+            item["score"] = ch["score"]
+        results.append(item)
     return results
 
 
 def process_chunks_pipeline(
     reranked_results: List[Dict[str, Any]],
-    SegmentDict: List[Dict[str, Any]],
+    SegmentDict: Union[List[Dict[str, Any]], SegmentViews],   # SegmentViews → tra view / text / field dựng sẵn
     drop_fields: Optional[List[str]] = None,     # Trường bị bỏ qua (áp dụng toàn bộ)
     fields: Optional[List[str]] = None,          # Trường muốn trích xuất (None → tất cả top-level)
-    n_chunks: Optional[int] = None               # Số lượng chunk gốc & text (nếu None → tất cả)
+    n_chunks: Optional[int] = None,              # Số lượng chunk gốc & text (nếu None → tất cả)
+    chunk_agg: Optional[str] = None,             # Gộp điểm theo chunk: None (thứ tự xuất hiện) | "max" | "sum" | "softmax"
+    chunk_index: Optional[ChunkIndex] = None,    # CSR index_to_chunk (None → dùng chunk_ids trong hit)
 ) -> Dict[str, Any]:
     """
     Trả về:
@@ -169,13 +451,17 @@ def process_chunks_pipeline(
         SegmentDict=SegmentDict,
         n_chunks=n_chunks,
         drop_fields=drop_fields,
+        chunk_agg=chunk_agg,
+        chunk_index=chunk_index,
     )
 
-    # 2️⃣ Biến thành text (cùng số lượng chunk)
-    chunks_text = collect_chunk_text(chunks_json)
-
-    # 3️⃣ Lấy các trường cụ thể
-    extracted_fields = extract_fields_for_each_chunk(chunks_json, fields=fields)
+    # 2️⃣ Biến thành text (cùng số lượng chunk) + 3️⃣ Lấy các trường cụ thể
+    if isinstance(SegmentDict, SegmentViews):
+        chunks_text = SegmentDict.render([ch["chunk_id"] for ch in chunks_json], drop_fields)
+        extracted_fields = SegmentDict.extract(chunks_json, drop_fields, fields)
+    else:
+        chunks_text = collect_chunk_text(chunks_json)
+        extracted_fields = extract_fields_for_each_chunk(chunks_json, fields=fields)
 
     return {
         "chunks_json": chunks_json,          # JSON chuẩn
@@ -1,15 +1,127 @@
 import logging
 import re, os
-import torch
+import json
+import hashlib
 import faiss
 import numpy as np
+import multiprocessing as mp
 
-from typing import Dict, List, Any, Tuple, Optional
+from typing import Dict, List, Any, Tuple, Optional, Iterable, Iterator
 
 from . import Common_MyUtils as MyUtils
+from . import Faiss_MapStore
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+ENCODER_BACKENDS = ("torch", "onnx")
+INDEX_TYPES = ("flat", "ivf_flat", "hnsw_flat", "ivf_pq", "opq")
+STORAGE_TYPES = ("float32", "fp16", "int8")
+REDUCE_TYPES = (None, "pca", "opq")
+_STORAGE_CODES = {"float32": "Flat", "fp16": "SQfp16", "int8": "SQ8"}
+STREAM_TRAIN_SIZE = 65536   # số text mẫu (reservoir) để train index trong build_streaming
+
+
+def ivf_of(index: faiss.Index) -> Optional[faiss.IndexIVF]:
+    """Trả về IndexIVF bên trong (qua IDMap/PreTransform) hoặc None."""
+    try:
+        return faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return None
+
+
+def hnsw_of(index: faiss.Index) -> Optional[faiss.IndexHNSW]:
+    """Trả về IndexHNSW bên trong (qua IDMap/PreTransform) hoặc None."""
+    idx = faiss.downcast_index(index)
+    while True:
+        if isinstance(idx, faiss.IndexHNSW):
+            return idx
+        inner = getattr(idx, "index", None)
+        if inner is None:
+            return None
+        idx = faiss.downcast_index(inner)
+
+
+def reduction_of(index: faiss.Index) -> Tuple[Optional[str], int]:
+    """
+    Phép giảm chiều thực sự nằm trong index (qua IDMap): ("pca" | "opq" | None, số chiều lưu).
+    OPQ chỉ xoay (d_out == d_in, vd. index_type="opq") không tính là giảm chiều.
+    """
+    idx = faiss.downcast_index(index)
+    if isinstance(idx, (faiss.IndexIDMap, faiss.IndexIDMap2)):
+        idx = faiss.downcast_index(idx.index)
+    reduce, d = None, int(index.d)
+    if isinstance(idx, faiss.IndexPreTransform):
+        for i in range(idx.chain.size()):
+            vt = faiss.downcast_VectorTransform(idx.chain.at(i))
+            if vt.d_out < vt.d_in:
+                reduce = "pca" if isinstance(vt, faiss.PCAMatrix) else "opq" if isinstance(vt, faiss.OPQMatrix) else reduce
+            d = int(vt.d_out)
+    return reduce, d
+
+
+def supports_remove(index: faiss.Index) -> bool:
+    """remove_ids dùng được: IVF (id tự quản) hoặc IDMap2 bọc Flat / ScalarQuantizer."""
+    if ivf_of(index) is not None:
+        return True
+    if isinstance(index, faiss.IndexIDMap2):
+        inner = faiss.downcast_index(index.index)
+        if isinstance(inner, faiss.IndexPreTransform):
+            inner = faiss.downcast_index(inner.index)
+        return isinstance(inner, faiss.IndexFlatCodes)
+    return False
+
+
+def search_params(
+    index: faiss.Index,
+    nprobe: Optional[int] = None,
+    efSearch: Optional[int] = None,
+    sel: Optional[faiss.IDSelector] = None,
+):
+    """
+    SearchParameters theo loại index (None nếu không có knob nào áp dụng).
+    sel: IDSelector trên id FAISS → lọc ngay trong lúc quét. Kiểu params phải là của index trong cùng
+    (IVF / HNSW): IDMap tự dịch sel sang id nội bộ, PreTransform chuyển nguyên params xuống.
+    """
+    extra = {"sel": sel} if sel is not None else {}
+    ivf = ivf_of(index)
+    if ivf is not None and (nprobe is not None or sel is not None):
+        return faiss.SearchParametersIVF(nprobe=int(nprobe if nprobe is not None else ivf.nprobe), **extra)
+    hnsw = hnsw_of(index)
+    if hnsw is not None and (efSearch is not None or sel is not None):
+        return faiss.SearchParametersHNSW(efSearch=int(efSearch if efSearch is not None else hnsw.hnsw.efSearch), **extra)
+    if sel is not None:
+        return faiss.SearchParameters(sel=sel)
+    return None
+
+
+# ---------- Worker cho encode đa tiến trình ----------
+_WORKER_MODEL: Any = None
+
+
+def _init_encode_worker(encoder_path: str, threads: int, backend: str = "torch") -> None:
+    """Mỗi worker giữ 1 bản encoder (CPU, cùng backend với tiến trình chính) với số thread cố định."""
+    global _WORKER_MODEL
+    if backend == "onnx":
+        from Config import OnnxBackend
+
+        _WORKER_MODEL = OnnxBackend.OnnxSentenceEncoder(
+            encoder_path, OnnxBackend.make_session_options(max(1, int(threads)), 1)
+        )
+        return
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    torch.set_num_threads(max(1, int(threads)))
+    _WORKER_MODEL = SentenceTransformer(encoder_path, device="cpu")
+
+
+def _encode_in_worker(job: Tuple[np.ndarray, List[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    pos, texts = job
+    embs = _WORKER_MODEL.encode(texts, batch_size=len(texts), convert_to_numpy=True, show_progress_bar=False)
+    return pos, np.asarray(embs, dtype="float32")
+
+
 class DirectFaissIndexer:
     """
         1) FaissPath (.faiss): chỉ chứa vectors,
@@ -23,6 +135,12 @@ class DirectFaissIndexer:
         device: str = "cpu",
         batch_size: int = 32,
         show_progress: bool = False,
+        max_tokens_per_batch: Optional[int] = None,  # None → batch_size × max_seq_length
+        max_batch_items: int = 512,
+        num_workers: int = 1,                # >1 → encode đa tiến trình trên CPU
+        worker_threads: int = 1,             # torch threads mỗi worker
+        encoder_path: Optional[str] = None,  # thư mục SentenceTransformer để worker tự load
+        encoder_backend: str = "torch",      # "torch" | "onnx": backend worker dùng (như encoder chính)
         flatten_mode: str = "split",
         join_sep: str = "\n",
         allowed_schema_types: Tuple[str, ...] = ("string", "array", "dict"),
@@ -30,11 +148,32 @@ class DirectFaissIndexer:
         normalize: bool = True,
         verbose: bool = False,
         list_policy: str = "split", # "merge" | "split"
+        id_map: bool = False,       # True → IndexIDMap2 (cho phép remove_chunks)
+        index_type: str = "flat",   # "flat" | "ivf_flat" | "hnsw_flat" | "ivf_pq" | "opq"
+        storage: str = "float32",   # "float32" | "fp16" | "int8" (ScalarQuantizer, cho flat / ivf_flat / hnsw_flat)
+        nlist: Optional[int] = None,
+        pq_m: Optional[int] = None,
+        pq_nbits: int = 8,
+        hnsw_m: int = 32,
+        ef_construction: int = 200,
+        train_size: Optional[int] = None,
+        nprobe: int = 16,
+        ef_search: int = 64,
+        reduce: Optional[str] = None,        # None | "pca" | "opq": giảm chiều trước khi index
+        reduce_dim: Optional[int] = None,    # số chiều sau khi giảm
     ):
         self.indexer = indexer
         self.device = device
         self.batch_size = batch_size
         self.show_progress = show_progress
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.max_batch_items = max_batch_items
+        self.num_workers = int(num_workers)
+        self.worker_threads = int(worker_threads)
+        self.encoder_path = encoder_path
+        if encoder_backend not in ENCODER_BACKENDS:
+            raise ValueError(f"encoder_backend phải là một trong {ENCODER_BACKENDS}")
+        self.encoder_backend = encoder_backend
         self.flatten_mode = flatten_mode
         self.join_sep = join_sep
         self.allowed_schema_types = allowed_schema_types
@@ -42,6 +181,23 @@ class DirectFaissIndexer:
         self.normalize = normalize
         self.verbose = verbose
         self.list_policy = list_policy
+        self.id_map = id_map
+
+        assert index_type in INDEX_TYPES, f"index_type phải thuộc {INDEX_TYPES}"
+        self.index_type = index_type
+        assert storage in STORAGE_TYPES, f"storage phải thuộc {STORAGE_TYPES}"
+        self.storage = storage
+        self.nlist = nlist
+        self.pq_m = pq_m
+        self.pq_nbits = pq_nbits
+        self.hnsw_m = hnsw_m
+        self.ef_construction = ef_construction
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        assert reduce in REDUCE_TYPES, f"reduce phải thuộc {REDUCE_TYPES}"
+        self.reduce = reduce
+        self.reduce_dim = reduce_dim
 
         self._non_keep_pattern = re.compile(r"[^\w\s\(\)\.\,\;\:\-–]", flags=re.UNICODE)
 
@@ -99,33 +255,105 @@ class DirectFaissIndexer:
             join_sep=self.join_sep
         )
 
+    # ---------- Lập lịch batch theo độ dài token ----------
+    def _token_lengths(self, texts: List[str]) -> np.ndarray:
+        """Số token (đã truncate theo max_seq_length) của từng text; fallback ~4 ký tự/token."""
+        tokenizer = getattr(self.indexer, "tokenizer", None)
+        max_len = int(getattr(self.indexer, "max_seq_length", 0) or 512)
+        if tokenizer is None:
+            return np.minimum(np.fromiter((len(t) // 4 + 2 for t in texts), dtype=np.int64, count=len(texts)), max_len)
+        ids = tokenizer(texts, add_special_tokens=True, truncation=True, max_length=max_len)["input_ids"]
+        return np.fromiter((len(x) for x in ids), dtype=np.int64, count=len(texts))
+
+    def _plan_batches(self, lengths: np.ndarray) -> List[np.ndarray]:
+        """
+        Sắp xếp giảm dần theo độ dài, cắt batch sao cho (số câu × độ dài dài nhất) ≤ token budget.
+        Trả về danh sách mảng vị trí gốc cho từng batch.
+        """
+        max_len = int(getattr(self.indexer, "max_seq_length", 0) or 512)
+        budget = int(self.max_tokens_per_batch or self.batch_size * max_len)
+        order = np.argsort(-lengths, kind="stable")
+
+        batches: List[np.ndarray] = []
+        start = 0
+        n = len(order)
+        while start < n:
+            longest = max(int(lengths[order[start]]), 1)
+            size = max(1, min(budget // longest, self.max_batch_items, n - start))
+            batches.append(order[start:start + size])
+            start += size
+        return batches
+
     # ---------- Encode (batch) với fallback OOM CPU ----------
-    def _encode_texts(self, texts: List[str]) -> torch.Tensor:
-        try:
-            embs = self.indexer.encode(
-                sentences=texts,
-                batch_size=self.batch_size,
-                convert_to_tensor=True,
-                device=self.device,
-                show_progress_bar=self.show_progress,
-            )
-            return embs
-        except RuntimeError as e:
-            if "CUDA out of memory" in str(e):
+    def _encode_batch(self, texts: List[str], device: str) -> np.ndarray:
+        return self.indexer.encode(
+            sentences=texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            device=device,
+            show_progress_bar=False,
+        )
+
+    def _encode_texts_parallel(self, texts: List[str], batches: List[np.ndarray]) -> np.ndarray:
+        """
+        Chia batch cho num_workers tiến trình (spawn, cùng encoder_backend); kết quả về theo thứ tự
+        (imap) và ghi vào ma trận float32 cấp phát khi có batch đầu tiên (số chiều lấy từ kết quả).
+        """
+        if not self.encoder_path:
+            raise ValueError("num_workers > 1 cần encoder_path (thư mục SentenceTransformer đã cache).")
+        out: Optional[np.ndarray] = None
+
+        ctx = mp.get_context("spawn")
+        jobs = ((pos, [texts[i] for i in pos]) for pos in batches)
+        with ctx.Pool(
+            processes=self.num_workers,
+            initializer=_init_encode_worker,
+            initargs=(self.encoder_path, self.worker_threads, self.encoder_backend),
+        ) as pool:
+            for bi, (pos, embs) in enumerate(pool.imap(_encode_in_worker, jobs)):
+                if out is None:
+                    out = np.empty((len(texts), embs.shape[1]), dtype="float32")
+                out[pos] = embs
+                if self.show_progress:
+                    print(f"\r🔢 Encode batch {bi + 1}/{len(batches)} ({self.num_workers} workers)", end="")
+        if self.show_progress:
+            print()
+        return out
+
+    def _encode_texts(self, texts: List[str]) -> np.ndarray:
+        """
+        Encode theo batch đã lập lịch (ít padding), ghi thẳng vào ma trận float32
+        cấp phát sẵn theo thứ tự gốc — không qua tensor → cpu → numpy.
+        num_workers > 1 → chia batch cho nhiều tiến trình CPU.
+        """
+        batches = self._plan_batches(self._token_lengths(texts))
+        if self.num_workers > 1 and texts:
+            return self._encode_texts_parallel(texts, batches)
+        out: Optional[np.ndarray] = None
+        device = self.device
+        for bi, pos in enumerate(batches):
+            batch = [texts[i] for i in pos]
+            try:
+                embs = self._encode_batch(batch, device)
+            except RuntimeError as e:
+                if "CUDA out of memory" not in str(e):
+                    raise
                 print("⚠️ CUDA OOM → fallback CPU.")
                 try:
                     self.indexer.to("cpu")
                 except Exception:
                     pass
-                embs = self.indexer.encode(
-                    sentences=texts,
-                    batch_size=self.batch_size,
-                    convert_to_tensor=True,
-                    device="cpu",
-                    show_progress_bar=self.show_progress,
-                )
-                return embs
-            raise
+                device = "cpu"
+                embs = self._encode_batch(batch, device)
+
+            if out is None:
+                out = np.empty((len(texts), embs.shape[1]), dtype="float32")
+            out[pos] = embs
+            if self.show_progress:
+                print(f"\r🔢 Encode batch {bi + 1}/{len(batches)}", end="")
+        if self.show_progress:
+            print()
+        return out if out is not None else np.zeros((0, 0), dtype="float32")
 
     # ---------- Build FAISS ----------
     @staticmethod
@@ -134,12 +362,203 @@ class DirectFaissIndexer:
         norms[norms == 0.0] = 1.0
         return mat / norms
 
+    def _nlist_for(self, n: int) -> int:
+        if self.nlist:
+            return int(self.nlist)
+        return max(1, min(int(4 * np.sqrt(n)), n // 39))
+
+    def _pq_m_for(self, dim: int) -> int:
+        if self.pq_m:
+            return int(self.pq_m)
+        for m in (64, 48, 32, 24, 16, 8, 4):
+            if dim % m == 0:
+                return m
+        return 1
+
+    def _reduce_prefix(self, dim: int, n_train: Optional[int] = None) -> Tuple[str, int]:
+        """
+        Tiền tố giảm chiều cho index_factory → IndexPreTransform: ma trận nằm trong file .faiss
+        và được áp dụng cho cả vector lúc add lẫn query lúc search.
+        - pca: PCA (có trừ mean) rồi L2norm lại để inner product vẫn là cosine
+        - opq: phép chiếu trực giao OPQ (học cùng PQ) xuống reduce_dim;
+          cần >= 256 vector để train PQ bên trong, ít hơn → dùng PCA
+        """
+        d = int(self.reduce_dim or dim)
+        if self.reduce is None or d >= dim:
+            return "", dim
+        if self.reduce == "opq" and (n_train is None or n_train >= 256):
+            return f"OPQ{self._pq_m_for(d)}_{d},", d
+        if self.reduce == "opq":
+            logging.warning(f"⚠️ OPQ: chỉ có {n_train} vector (< 256) để train → dùng PCA{d}.")
+        return f"PCA{d},L2norm,", d
+
+    def _factory_string(self, n: int, dim: int, n_train: Optional[int] = None) -> str:
+        """
+        Chuỗi faiss.index_factory cho index_type; fallback "Flat" nếu quá ít vector để train.
+        n: số vector dự kiến (chọn nlist); n_train: số vector thực có để train (mặc định = n).
+        """
+        t = self.index_type
+        code = _STORAGE_CODES[self.storage]
+        n_train = int(n if n_train is None else n_train)
+        prefix, d = self._reduce_prefix(dim, n_train)
+        if t == "flat":
+            return prefix + code
+        if t == "hnsw_flat":
+            return f"{prefix}HNSW{self.hnsw_m},{code}"
+
+        nlist = self._nlist_for(n)
+        need = nlist if t == "ivf_flat" else max(nlist, 2 ** self.pq_nbits)
+        if n_train < need:
+            logging.warning(f"⚠️ {t}: chỉ có {n_train} vector (< {need}) để train → dùng {code}.")
+            return prefix + code
+        if t == "ivf_flat":
+            return f"{prefix}IVF{nlist},{code}"
+        if self.storage != "float32":
+            logging.warning(f"⚠️ {t} đã nén bằng PQ → bỏ qua storage={self.storage}.")
+        m = self._pq_m_for(d)
+        if t == "ivf_pq" or self.reduce == "opq":
+            return f"{prefix}IVF{nlist},PQ{m}x{self.pq_nbits}"
+        return f"{prefix}OPQ{m},IVF{nlist},PQ{m}x{self.pq_nbits}"
+
+    def _index_meta(self, index: faiss.Index) -> Dict[str, Any]:
+        """
+        meta của Mapping: dim = số chiều encoder (query đưa vào index), reduce_dim = số chiều lưu.
+        reduce / reduce_dim đọc từ index đã dựng (vd. OPQ thiếu vector train → đã dùng PCA).
+        """
+        reduce, reduce_dim = reduction_of(index)
+        return {
+            "dim": int(index.d),
+            "metric": "ip",
+            "normalized": bool(self.normalize),
+            "index_type": self.index_type,
+            "storage": self.storage,
+            "reduce": reduce,
+            "reduce_dim": reduce_dim,
+        }
+
+    def _train_sample(self, matrix: np.ndarray) -> np.ndarray:
+        n = matrix.shape[0]
+        size = int(self.train_size or n)
+        if size >= n:
+            return matrix
+        rng = np.random.default_rng(42)
+        return matrix[np.sort(rng.choice(n, size=size, replace=False))]
+
+    def _new_faiss_index(self, sample: np.ndarray, n_hint: Optional[int] = None) -> faiss.Index:
+        """Tạo + train index rỗng; n_hint = số vector dự kiến (chọn nlist), mặc định = len(sample)."""
+        sample = np.ascontiguousarray(sample, dtype="float32")
+        n, dim = int(n_hint or sample.shape[0]), int(sample.shape[1])
+        n_train = min(int(sample.shape[0]), int(self.train_size or sample.shape[0]))
+        factory = self._factory_string(n, dim, n_train=n_train)
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+
+        hnsw = hnsw_of(index)
+        if hnsw is not None:
+            hnsw.hnsw.efConstruction = int(self.ef_construction)
+            hnsw.hnsw.efSearch = int(self.ef_search)
+
+        if not index.is_trained:
+            index.train(self._train_sample(sample))
+        ivf = ivf_of(index)
+        if ivf is not None:
+            ivf.nprobe = int(self.nprobe)
+
+        if self.verbose:
+            logging.info(f"🧱 FAISS index: {factory} (n={n}, dim={dim})")
+
+        if self.id_map and ivf is None:
+            index = faiss.IndexIDMap2(index)
+        return index
+
+    def _add_vectors(self, index: faiss.Index, matrix: np.ndarray, start: int) -> None:
+        """Thêm vector với id liên tục start, start+1, ..."""
+        matrix = np.ascontiguousarray(matrix, dtype="float32")
+        if self.id_map:
+            index.add_with_ids(matrix, np.arange(start, start + matrix.shape[0], dtype="int64"))
+        else:
+            index.add(matrix)
+
     def _create_faiss_index(self, matrix: np.ndarray) -> faiss.Index:
-        dim = int(matrix.shape[1])
-        index = faiss.IndexFlatIP(dim)
-        index.add(matrix.astype("float32"))
+        index = self._new_faiss_index(matrix)
+        self._add_vectors(index, matrix, 0)
         return index
 
+    # ---------- Flatten các segment thành cặp (key, text) ----------
+    def _walk_item(self, item: Any) -> Iterator[Tuple[str, str, str]]:
+        """
+        Một lượt duyệt (stack, không đệ quy, không copy) thay cho
+        _preprocess_data → _merge_lists → MyUtils.flatten_json.
+        Làm sạch text, áp dụng list_policy / flatten_mode và yield (key, base_key, text)
+        theo đúng thứ tự cũ; base_key (key bỏ chỉ số [i]) được dựng song song, không dùng regex.
+        """
+        clean = MyUtils.preprocess_text
+        pattern, max_chars = self._non_keep_pattern, self.max_chars_per_text
+        merge = self.list_policy == "merge"
+        mode, sep = self.flatten_mode, self.join_sep
+
+        stack: List[Tuple[Any, str, str]] = [(item, "", "")]
+        while stack:
+            node, key, base = stack.pop()
+
+            if isinstance(node, dict):
+                stack.extend(reversed([
+                    (v, f"{key}.{k}" if key else k, f"{base}.{k}" if base else k)
+                    for k, v in node.items()
+                ]))
+                continue
+
+            if isinstance(node, list):
+                if merge and all(isinstance(x, (str, int, float)) for x in node):
+                    node = sep.join(clean(x, pattern, max_chars) if isinstance(x, str) else str(x) for x in node)
+                elif mode == "split":
+                    stack.extend(reversed([(v, f"{key}[{i}]", base) for i, v in enumerate(node)]))
+                    continue
+                elif mode == "join":
+                    parts = (
+                        clean(x, pattern, max_chars) if isinstance(x, str)
+                        else str(MyUtils.preprocess_data(x, pattern, max_chars))
+                        for x in node
+                    )
+                    node = sep.join(p for p in (x.strip() for x in parts) if p)
+                else:  # "keep" → lá là list, không phải text
+                    continue
+            elif isinstance(node, str):
+                node = clean(node, pattern, max_chars)
+            else:
+                continue
+
+            text = node.strip()
+            if text:
+                yield key, base, text
+
+    def _pairs_from_items(
+        self,
+        items: Iterable[Tuple[int, Any]],
+        schema: Optional[Dict[str, str]],
+    ) -> Tuple[List[Tuple[str, str]], List[int], List[str]]:
+        """items: [(chunk_id, segment)] → (pair_list, chunk_map, base_keys)."""
+        pair_list: List[Tuple[str, str]] = []
+        chunk_map: List[int] = []
+        base_keys: List[str] = []
+        eligible: Dict[str, bool] = {}  # base_key → hợp lệ theo schema (tính 1 lần / dạng key)
+        allowed = self.allowed_schema_types
+        for chunk_id, item in items:
+            for key, base, text in self._walk_item(item):
+                ok = eligible.get(base)
+                if ok is None:
+                    ok = eligible[base] = schema is None or schema.get(base) in allowed
+                if ok:
+                    pair_list.append((key, text))
+                    chunk_map.append(chunk_id)
+                    base_keys.append(base)
+        return pair_list, chunk_map, base_keys
+
+    def _encode_matrix(self, texts: List[str]) -> np.ndarray:
+        embs = self._encode_texts(texts)
+        if self.normalize:
+            embs = self._l2_normalize(embs)
+        return embs.astype("float32", copy=False)
+
 
     # ================================================================
     #  Hàm lọc trùng nhưng vẫn gom nhóm chunk tương ứng
@@ -147,10 +566,13 @@ class DirectFaissIndexer:
     def deduplicates_with_mask(
         self,
         pairs: List[Tuple[str, str]],
-        chunk_map: List[int]
+        chunk_map: List[int],
+        base_keys: Optional[List[str]] = None,
     ) -> Tuple[List[Tuple[str, str]], List[List[int]]]:
-
+        """base_keys (từ _pairs_from_items) → không phải tính lại bằng regex."""
         assert len(pairs) == len(chunk_map), "pairs và chunk_map phải đồng dài"
+        if base_keys is None:
+            base_keys = [self._base_key_for_schema(k) for k, _ in pairs]
 
         seen_per_key: Dict[str, Dict[str, int]] = {}
         # base_key -> text_norm -> index trong filtered_pairs
@@ -158,12 +580,11 @@ class DirectFaissIndexer:
         filtered_pairs: List[Tuple[str, str]] = []
         chunk_groups: List[List[int]] = []
 
-        for (key, text), c in zip(pairs, chunk_map):
+        for (key, text), c, base_key in zip(pairs, chunk_map, base_keys):
             text_norm = text.strip()
             if not text_norm:
                 continue
 
-            base_key = re.sub(r"\[\d+\]", "", key)
             if base_key not in seen_per_key:
                 seen_per_key[base_key] = {}
 
@@ -208,31 +629,18 @@ class DirectFaissIndexer:
         data_list = data_obj if isinstance(data_obj, list) else [data_obj]
 
         # 2️⃣ Flatten + lưu chunk_id
-        pair_list: List[Tuple[str, str]] = []
-        chunk_map: List[int] = []
-        for chunk_id, item in enumerate(data_list, start=1):
-            processed = self._preprocess_data(item)
-            flat = self._flatten_json(processed)
-            for k, v in flat.items():
-                if not self._eligible_by_schema(k, schema):
-                    continue
-                if isinstance(v, str) and v.strip():
-                    pair_list.append((k, v.strip()))
-                    chunk_map.append(chunk_id)
+        pair_list, chunk_map, base_keys = self._pairs_from_items(enumerate(data_list, start=1), schema)
 
         if not pair_list:
             raise ValueError("Không tìm thấy nội dung văn bản hợp lệ để encode.")
 
         # 3️⃣ Loại trùng nhưng gom nhóm chunk
-        pair_list, chunk_groups = self.deduplicates_with_mask(pair_list, chunk_map)
+        pair_list, chunk_groups = self.deduplicates_with_mask(pair_list, chunk_map, base_keys)
 
         # 4️⃣ Encode
         keys  = [k for k, _ in pair_list]
         texts = [t for _, t in pair_list]
-        embs_t = self._encode_texts(texts)
-        embs = embs_t.detach().cpu().numpy()
-        if self.normalize:
-            embs = self._l2_normalize(embs)
+        embs = self._encode_matrix(texts)
 
         # 5️⃣ FAISS
         FaissIndex = self._create_faiss_index(embs)
@@ -243,13 +651,7 @@ class DirectFaissIndexer:
 
         index_to_key = {str(i): k for i, k in enumerate(keys)}
         Mapping = {
-            "meta": {
-                "count": len(keys),
-                "dim": int(embs.shape[1]),
-                "metric": "ip",
-                "normalized": bool(self.normalize),
-            },
-
+            "meta": {"count": len(keys), **self._index_meta(FaissIndex)},
             "index_to_key": index_to_key,
         }
         MapData = {
@@ -262,4 +664,291 @@ class DirectFaissIndexer:
             }
         }
 
-        return FaissIndex, Mapping, MapData, chunk_groups
\ No newline at end of file
+        return FaissIndex, Mapping, MapData, chunk_groups
+
+    # ================================================================
+    #  Build streaming: bộ nhớ đỉnh không phụ thuộc kích thước corpus
+    # ================================================================
+    def _encode_window(self, texts: List[str]) -> np.ndarray:
+        embs = np.ascontiguousarray(self._encode_texts(texts), dtype="float32")
+        if self.normalize:
+            faiss.normalize_L2(embs)  # tại chỗ, không tạo bản sao
+        return embs
+
+    def _needs_training(self) -> bool:
+        """Index phải train trước khi add (IVF / PQ, giảm chiều PCA / OPQ, SQ8)."""
+        return self.index_type not in ("flat", "hnsw_flat") or self.reduce is not None or self.storage == "int8"
+
+    def _iter_passages(
+        self,
+        SegmentPath: str,
+        schema: Optional[Dict[str, str]],
+    ) -> Iterator[Tuple[int, Any, str, str, bytes]]:
+        """(chunk_id, segment, key, text, digest) theo thứ tự file; digest = hash (base_key, text) để lọc trùng."""
+        for chunk_id, item in enumerate(MyUtils.iter_json_items(SegmentPath), start=1):
+            pair_list, _, base_keys = self._pairs_from_items([(chunk_id, item)], schema)
+            for (key, text), base_key in zip(pair_list, base_keys):
+                digest = hashlib.blake2b(f"{base_key}\x00{text}".encode("utf-8"), digest_size=12).digest()
+                yield chunk_id, item, key, text, digest
+
+    def _stream_train_sample(self, SegmentPath: str, schema: Optional[Dict[str, str]]) -> Tuple[int, List[str]]:
+        """
+        Lượt đọc đầu (không encode): đếm số passage không trùng (chọn nlist) và lấy mẫu ngẫu nhiên
+        (reservoir, train_size hoặc STREAM_TRAIN_SIZE text) trải đều toàn corpus để train.
+        """
+        size = int(self.train_size or STREAM_TRAIN_SIZE)
+        rng = np.random.default_rng(42)
+        seen: set = set()
+        sample: List[str] = []
+        for _, _, _, text, digest in self._iter_passages(SegmentPath, schema):
+            if digest in seen:
+                continue
+            seen.add(digest)
+            if len(sample) < size:
+                sample.append(text)
+            else:
+                j = int(rng.integers(0, len(seen)))
+                if j < size:
+                    sample[j] = text
+        return len(seen), sample
+
+    def build_streaming(
+        self,
+        SegmentPath: str,
+        SchemaDict: Optional[Dict[str, str]],
+        StorePath: str,
+        window_size: int = 4096,
+    ) -> Tuple[faiss.Index, "Faiss_MapStore.MapStore", Dict[str, Any]]:
+        """
+        Như build_from_json nhưng đọc segment lần lượt (JSONL hoặc JSON array qua
+        MyUtils.iter_json_items), lọc trùng trực tuyến và encode theo cửa sổ window_size
+        text mới → chuẩn hoá tại chỗ → add vào FAISS rồi bỏ cửa sổ.
+        key / text / chunk ghi thẳng xuống MapStore (StorePath) qua MapStoreWriter, không giữ trong RAM;
+        lọc trùng chỉ giữ digest 12 byte mỗi passage.
+        Index cần train: lượt đọc đầu đếm tổng số passage (chọn nlist) + lấy mẫu train trên toàn corpus,
+        rồi mới encode / add ở lượt thứ hai.
+        Trả về (FaissIndex, MapStore, Manifest). Chỉ dùng như thư viện (appFinal vẫn build_from_json).
+        """
+        assert os.path.exists(SegmentPath), f"Không thấy file segment: {SegmentPath}"
+        schema = SchemaDict
+
+        FaissIndex: Optional[faiss.Index] = None
+        if self._needs_training():
+            count, sample = self._stream_train_sample(SegmentPath, schema)
+            if not sample:
+                raise ValueError("Không tìm thấy nội dung văn bản hợp lệ để encode.")
+            FaissIndex = self._new_faiss_index(self._encode_window(sample), n_hint=count)
+            del sample
+
+        writer = Faiss_MapStore.MapStoreWriter(StorePath)
+        seen: Dict[bytes, int] = {}
+        segments: Dict[str, str] = {}
+        window: List[str] = []
+        added = 0
+        last_chunk = 0
+
+        def _flush() -> None:
+            nonlocal FaissIndex, added
+            if not window:
+                return
+            embs = self._encode_window(window)
+            if FaissIndex is None:
+                FaissIndex = self._new_faiss_index(embs)
+            self._add_vectors(FaissIndex, embs, added)
+            added += embs.shape[0]
+            window.clear()
+            if self.verbose:
+                logging.info(f"🧩 Đã add {added} vector")
+
+        try:
+            for chunk_id, item, key, text, digest in self._iter_passages(SegmentPath, schema):
+                if chunk_id != last_chunk:
+                    last_chunk = chunk_id
+                    segments[str(chunk_id)] = self._segment_hash(item)
+                    if len(window) >= window_size:
+                        _flush()
+                idx = seen.get(digest)
+                if idx is not None:
+                    writer.link(idx, chunk_id)
+                    continue
+                idx = len(seen)
+                seen[digest] = idx
+                writer.add(idx, key, text, chunk_id)
+                window.append(text)
+            _flush()
+            if added == 0:
+                raise ValueError("Không tìm thấy nội dung văn bản hợp lệ để encode.")
+        except BaseException:
+            writer.abort()
+            raise
+
+        store = writer.close(
+            mapping_meta={"count": added, **self._index_meta(FaissIndex)},
+            mapdata_meta={
+                "count": added,
+                "flatten_mode": self.flatten_mode,
+                "schema_used": schema is not None,
+                "list_policy": self.list_policy,
+            },
+        )
+        Manifest = {
+            "segments": segments,
+            "next_index": len(seen),
+            "next_chunk": last_chunk + 1,
+            "id_map": bool(self.id_map),
+        }
+        return FaissIndex, store, Manifest
+
+    # ================================================================
+    #  Manifest: segment nào đã được index (chunk_id → hash nội dung)
+    # ================================================================
+    @staticmethod
+    def _segment_hash(item: Any) -> str:
+        raw = json.dumps(item, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def build_manifest(self, data_list: List[Any], chunk_groups: List[List[int]]) -> Dict[str, Any]:
+        """Manifest cho index vừa build bằng build_from_json."""
+        return {
+            "segments": {str(cid): self._segment_hash(item) for cid, item in enumerate(data_list, start=1)},
+            "next_index": len(chunk_groups),
+            "next_chunk": len(data_list) + 1,
+            "id_map": bool(self.id_map),
+        }
+
+    @staticmethod
+    def _dedup_state(MapData: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        """base_key → text → index, dựng lại từ MapData (không encode lại)."""
+        seen: Dict[str, Dict[str, int]] = {}
+        for item in MapData.get("items", []):
+            base_key = re.sub(r"\[\d+\]", "", item["key"])
+            seen.setdefault(base_key, {})[item["text"]] = int(item["index"])
+        return seen
+
+    # ================================================================
+    #  Thêm segment mới vào index sẵn có (chỉ encode cặp mới)
+    # ================================================================
+    def add_segments(
+        self,
+        segments: List[Any],
+        FaissIndex: faiss.Index,
+        Mapping: Dict[str, Any],
+        MapData: Dict[str, Any],
+        chunk_groups: List[List[int]],
+        Manifest: Dict[str, Any],
+        SchemaDict: Optional[Dict[str, str]] = None,
+        chunk_ids: Optional[List[int]] = None,
+    ) -> Dict[str, int]:
+        """
+        Cập nhật tại chỗ FaissIndex / Mapping / MapData / chunk_groups / Manifest.
+        - chunk_ids=None → gán tiếp theo Manifest["next_chunk"] (append vào cuối Segment).
+        - Segment có cùng chunk_id + cùng hash → bỏ qua; khác hash → gỡ bản cũ rồi thêm lại.
+        - (key, text) đã có trong index → chỉ thêm chunk_id vào nhóm, không encode.
+        Trả về thống kê {"segments", "skipped", "encoded", "linked"}.
+        """
+        if chunk_ids is None:
+            start = int(Manifest.get("next_chunk", 1))
+            chunk_ids = list(range(start, start + len(segments)))
+        assert len(chunk_ids) == len(segments), "segments và chunk_ids phải đồng dài"
+
+        indexed = Manifest.setdefault("segments", {})
+        todo: List[Tuple[int, Any]] = []
+        changed: List[int] = []
+        for cid, item in zip(chunk_ids, segments):
+            h = self._segment_hash(item)
+            old = indexed.get(str(cid))
+            if old == h:
+                continue
+            if old is not None:
+                changed.append(cid)
+            todo.append((cid, item))
+
+        if changed:
+            self.remove_chunks(changed, FaissIndex, Mapping, MapData, chunk_groups, Manifest)
+
+        pair_list, chunk_map, base_keys = self._pairs_from_items(todo, SchemaDict)
+
+        seen = self._dedup_state(MapData)
+        next_index = int(Manifest.get("next_index", len(chunk_groups)))
+        new_pairs: List[Tuple[str, str]] = []
+        linked = 0
+        for (key, text), c, base_key in zip(pair_list, chunk_map, base_keys):
+            text_norm = text.strip()
+            if not text_norm:
+                continue
+            bucket = seen.setdefault(base_key, {})
+            if text_norm in bucket:
+                group = chunk_groups[bucket[text_norm]]
+                if c not in group:
+                    group.append(c)
+                    linked += 1
+                continue
+            bucket[text_norm] = next_index + len(new_pairs)
+            new_pairs.append((key, text_norm))
+            chunk_groups.append([c])
+
+        if new_pairs:
+            embs = self._encode_matrix([t for _, t in new_pairs])
+            ids = np.arange(next_index, next_index + len(new_pairs), dtype="int64")
+            if isinstance(FaissIndex, faiss.IndexIDMap) or ivf_of(FaissIndex) is not None:
+                FaissIndex.add_with_ids(embs, ids)
+            else:
+                assert FaissIndex.ntotal == next_index, "Index không có IDMap nên id phải liên tục"
+                FaissIndex.add(embs)
+
+            i2k = Mapping.setdefault("index_to_key", {})
+            for i, (k, t) in zip(ids.tolist(), new_pairs):
+                i2k[str(i)] = k
+                MapData.setdefault("items", []).append({"index": i, "key": k, "text": t})
+
+        for cid, item in todo:
+            indexed[str(cid)] = self._segment_hash(item)
+        Manifest["next_index"] = next_index + len(new_pairs)
+        Manifest["next_chunk"] = max(int(Manifest.get("next_chunk", 1)), max(chunk_ids, default=0) + 1)
+        self._refresh_meta(Mapping, MapData, FaissIndex)
+
+        return {"segments": len(todo), "skipped": len(segments) - len(todo), "encoded": len(new_pairs), "linked": linked}
+
+    # ================================================================
+    #  Gỡ chunk khỏi index (cần IDMap2/IVF nếu phải xoá vector)
+    # ================================================================
+    def remove_chunks(
+        self,
+        chunk_ids: List[int],
+        FaissIndex: faiss.Index,
+        Mapping: Dict[str, Any],
+        MapData: Dict[str, Any],
+        chunk_groups: List[List[int]],
+        Manifest: Dict[str, Any],
+    ) -> Dict[str, int]:
+        """
+        Bỏ chunk_ids khỏi mọi nhóm; vector nào không còn chunk nào thì xoá khỏi index,
+        Mapping, MapData. chunk_id không được dùng lại (Segment giữ nguyên vị trí).
+        """
+        drop = set(int(c) for c in chunk_ids)
+        touched = [idx for idx, group in enumerate(chunk_groups) if group and drop.intersection(group)]
+        orphan = [idx for idx in touched if drop.issuperset(chunk_groups[idx])]
+        if orphan and not supports_remove(FaissIndex):
+            raise ValueError("remove_chunks cần IndexIDMap2 bọc Flat hoặc index IVF (khởi tạo DirectFaissIndexer với id_map=True).")
+
+        for idx in touched:
+            chunk_groups[idx] = [c for c in chunk_groups[idx] if c not in drop]
+
+        if orphan:
+            FaissIndex.remove_ids(faiss.IDSelectorBatch(np.asarray(orphan, dtype="int64")))
+            i2k = Mapping.get("index_to_key", {})
+            for idx in orphan:
+                i2k.pop(str(idx), None)
+            gone = set(orphan)
+            MapData["items"] = [it for it in MapData.get("items", []) if int(it["index"]) not in gone]
+
+        segs = Manifest.get("segments", {})
+        for c in drop:
+            segs.pop(str(c), None)
+        self._refresh_meta(Mapping, MapData, FaissIndex)
+        return {"chunks": len(drop), "removed_vectors": len(orphan)}
+
+    @staticmethod
+    def _refresh_meta(Mapping: Dict[str, Any], MapData: Dict[str, Any], FaissIndex: faiss.Index) -> None:
+        Mapping.setdefault("meta", {})["count"] = int(FaissIndex.ntotal)
+        MapData.setdefault("meta", {})["count"] = len(MapData.get("items", []))
@@ -0,0 +1,201 @@
+import re
+import threading
+import faiss
+import numpy as np
+
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from . import Faiss_MapStore
+from . import Faiss_Cache
+
+_INDEX_SUFFIX = re.compile(r"\[\d+\]")
+
+
+def base_key(key: Optional[str]) -> str:
+    """Key phẳng → trường schema: "Content.SubCategory.Core[0]" → "Content.SubCategory.Core"."""
+    return _INDEX_SUFFIX.sub("", key or "")
+
+
+def contains(bitmap: np.ndarray, ids: np.ndarray) -> np.ndarray:
+    """Bit của từng id trong bitmap packbits(bitorder="little"); id < 0 hoặc ngoài bitmap → False."""
+    ids = np.asarray(ids, dtype="int64")
+    ok = (ids >= 0) & (ids < bitmap.shape[0] * 8)
+    out = np.zeros(ids.shape, dtype=bool)
+    sel = ids[ok]
+    out[ok] = ((bitmap[sel >> 3] >> (sel & 7).astype("uint8")) & 1).astype(bool)
+    return out
+
+
+# ===============================
+# 1. Điều kiện lọc
+# ===============================
+class SearchFilter:
+    """
+    Điều kiện lọc khi search (các tiêu chí AND với nhau, trong 1 tiêu chí là OR):
+      - base_keys: trường schema ("Article", "Content.SubCategory.Core", ...)
+      - chunk_range: (lo, hi) — passage thuộc ít nhất 1 chunk có id trong [lo, hi]
+      - chunk_ids: passage thuộc ít nhất 1 chunk trong danh sách
+      - ids: id FAISS (passage) cụ thể
+    """
+
+    __slots__ = ("base_keys", "chunk_range", "chunk_ids", "ids")
+
+    def __init__(
+        self,
+        base_keys: Optional[Iterable[str]] = None,
+        chunk_range: Optional[Sequence[int]] = None,
+        chunk_ids: Optional[Iterable[int]] = None,
+        ids: Optional[Iterable[int]] = None,
+    ):
+        self.base_keys = tuple(sorted({base_key(k) for k in base_keys})) if base_keys is not None else None
+        if chunk_range is not None:
+            if len(chunk_range) != 2:
+                raise ValueError("chunk_range phải là (lo, hi).")
+            lo, hi = int(chunk_range[0]), int(chunk_range[1])
+            if lo > hi:
+                raise ValueError(f"chunk_range không hợp lệ: lo={lo} > hi={hi}.")
+            self.chunk_range = (lo, hi)
+        else:
+            self.chunk_range = None
+        self.chunk_ids = tuple(sorted({int(c) for c in chunk_ids})) if chunk_ids is not None else None
+        self.ids = tuple(sorted({int(i) for i in ids})) if ids is not None else None
+
+    @classmethod
+    def coerce(cls, value: Union["SearchFilter", Dict[str, Any], None]) -> Optional["SearchFilter"]:
+        """None / dict (vd. body API) / SearchFilter → SearchFilter (None nếu không có tiêu chí nào)."""
+        if value is None:
+            return None
+        if not isinstance(value, cls):
+            unknown = set(value) - set(cls.__slots__)
+            if unknown:
+                raise ValueError(f"Tiêu chí lọc không hỗ trợ: {sorted(unknown)} (hỗ trợ: {list(cls.__slots__)}).")
+            value = cls(**value)
+        return None if value.is_empty() else value
+
+    def is_empty(self) -> bool:
+        return all(getattr(self, name) is None for name in self.__slots__)
+
+    def cache_key(self) -> Tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__ if getattr(self, name) is not None}
+
+    def __repr__(self) -> str:
+        return f"SearchFilter({self.to_dict()})"
+
+
+# ===============================
+# 2. Bitset dựng sẵn trên MapStore
+# ===============================
+class Selection:
+    """Kết quả lọc: bitmap id FAISS (packbits little) + IDSelector trỏ vào bitmap (giữ tham chiếu bitmap)."""
+
+    __slots__ = ("bitmap", "count", "selector")
+
+    def __init__(self, bitmap: np.ndarray, count: int):
+        self.bitmap = bitmap
+        self.count = int(count)
+        self.selector = faiss.IDSelectorBitmap(bitmap.shape[0] * 8, faiss.swig_ptr(bitmap))
+
+    def contains(self, ids: np.ndarray) -> np.ndarray:
+        return contains(self.bitmap, ids)
+
+
+class FilterIndex:
+    """
+    Bitset theo không gian id FAISS, dựng 1 lần cho mỗi MapStore:
+      - mỗi base_key 1 bitmap (packbits) → lọc trường = OR các bitmap
+      - CSR chunk → passage: owner[j] = vị trí passage của chunk_ids[j] → lọc chunk vector hoá
+    Bitmap đã ghép được giữ trong LRU theo SearchFilter.cache_key().
+    """
+
+    def __init__(self, store: Faiss_MapStore.MapStore, cache_size: int = 256):
+        self.store = store
+        n = len(store)
+        self.n_bits = int(store.ids[-1]) + 1 if n else 0
+        self.n_bytes = (self.n_bits + 7) // 8
+        self._key_bits: Optional[Dict[str, np.ndarray]] = None
+        self._owner: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+        self._cache = Faiss_Cache.TTLCache(cache_size, name="filter_bitmap")
+
+    # ---------- Dựng bitset ----------
+    def warm(self) -> "FilterIndex":
+        """Dựng bitmap base_key + owner chunk ngay (gọi lúc nạp index, không để request đầu tiên chịu)."""
+        if self._key_bits is None:
+            with self._lock:
+                if self._key_bits is None:
+                    self._owner = np.repeat(
+                        np.arange(len(self.store), dtype="int64"), np.diff(np.asarray(self.store.chunk_indptr))
+                    )
+                    self._key_bits = self._build_key_bits()
+        return self
+
+    def _build_key_bits(self) -> Dict[str, np.ndarray]:
+        names: Dict[str, int] = {}
+        codes = np.fromiter(
+            (names.setdefault(base_key(self.store.keys[pos]), len(names)) for pos in range(len(self.store))),
+            dtype="int32", count=len(self.store),
+        )
+        ids = np.asarray(self.store.ids, dtype="int64")
+        order = np.argsort(codes, kind="stable")
+        bounds = np.searchsorted(codes[order], np.arange(len(names) + 1))
+        bits = {}
+        for name, code in names.items():
+            bits[name] = self._pack(ids[order[bounds[code]:bounds[code + 1]]])
+            bits[name].setflags(write=False)
+        return bits
+
+    def _pack(self, ids: np.ndarray) -> np.ndarray:
+        mask = np.zeros(self.n_bytes * 8, dtype=bool)
+        mask[ids] = True
+        return np.packbits(mask, bitorder="little")
+
+    @property
+    def base_keys(self) -> List[str]:
+        return sorted(self.warm()._key_bits)
+
+    # ---------- Ghép điều kiện ----------
+    def select(self, spec: Union[SearchFilter, Dict[str, Any], None]) -> Optional[Selection]:
+        """SearchFilter → Selection (None = không lọc); count = số passage còn lại (có thể 0)."""
+        spec = SearchFilter.coerce(spec)
+        if spec is None:
+            return None
+        key = spec.cache_key()
+        selection = self._cache.get(key)
+        if selection is None:
+            bitmap = self._compose(spec)
+            bitmap.setflags(write=False)
+            selection = Selection(bitmap, int(np.unpackbits(bitmap).sum()))
+            self._cache.put(key, selection)
+        return selection
+
+    def _compose(self, spec: SearchFilter) -> np.ndarray:
+        self.warm()
+        bitmap = np.full(self.n_bytes, 0xFF, dtype="uint8")
+        if self.n_bits % 8:
+            bitmap[-1] = (1 << (self.n_bits % 8)) - 1   # bit thừa cuối bitmap
+        if spec.base_keys is not None:
+            keys = np.zeros(self.n_bytes, dtype="uint8")
+            for name in spec.base_keys:
+                if name in self._key_bits:
+                    keys |= self._key_bits[name]
+            bitmap &= keys
+        if spec.chunk_range is not None or spec.chunk_ids is not None:
+            chunk_ids = np.asarray(self.store.chunk_ids)
+            hit = np.ones(chunk_ids.shape[0], dtype=bool)
+            if spec.chunk_range is not None:
+                lo, hi = spec.chunk_range
+                hit &= (chunk_ids >= lo) & (chunk_ids <= hi)
+            if spec.chunk_ids is not None:
+                hit &= np.isin(chunk_ids, np.asarray(spec.chunk_ids, dtype=chunk_ids.dtype))
+            bitmap &= self._pack(np.asarray(self.store.ids, dtype="int64")[np.unique(self._owner[hit])])
+        if spec.ids is not None:
+            ids = np.asarray(spec.ids, dtype="int64")
+            bitmap &= self._pack(ids[(ids >= 0) & (ids < self.n_bits)])
+        return bitmap
+
+    def nbytes(self) -> int:
+        self.warm()
+        return int(sum(b.nbytes for b in self._key_bits.values()) + self._owner.nbytes)
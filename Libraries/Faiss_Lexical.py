@@ -0,0 +1,252 @@
+import os
+import re
+import json
+import shutil
+import unicodedata
+import numpy as np
+
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import Common_MyUtils as MyUtils
+from . import Faiss_Filter
+
+# Tiếng Việt viết tách âm tiết bằng khoảng trắng → token = âm tiết / số / mã (vd. "điều", "12", "it3040")
+TOKEN_PATTERN = re.compile(r"\w+", flags=re.UNICODE)
+
+_ARRAYS = ("ids", "doc_len", "indptr", "doc_delta", "tf", "idf")
+_TERMS_FILE = "terms.json"
+_META_FILE = "meta.json"
+
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Tách âm tiết: NFC + chữ thường + chuỗi \\w liên tiếp (giữ dấu, số, mã học phần)."""
+    if not text:
+        return []
+    return TOKEN_PATTERN.findall(unicodedata.normalize("NFC", text).lower())
+
+
+# ===============================
+# 1. Inverted index BM25 (nén)
+# ===============================
+class BM25Index:
+    """
+    Inverted index dạng CSR theo term:
+      - indptr[t]:indptr[t+1] → posting của term t
+      - doc_delta: vị trí doc mã hoá delta trong từng posting (uint16 nếu vừa, không thì uint32)
+      - tf: tần suất term trong doc (uint16)
+      - ids: vị trí doc → id FAISS; doc_len: số token / doc; idf: theo term
+    Chấm điểm: giải nén posting của các term trong query (cumsum), cộng dồn bằng np.bincount,
+    top-k bằng np.argpartition.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], terms: List[str], meta: Dict[str, Any], LexicalPath: Optional[str] = None):
+        self.LexicalPath = LexicalPath
+        self.meta = meta
+        self.k1 = float(meta.get("k1", 1.5))
+        self.b = float(meta.get("b", 0.75))
+        self.avgdl = float(meta.get("avgdl", 1.0)) or 1.0
+        self.ids = arrays["ids"]
+        self.doc_len = arrays["doc_len"]
+        self.indptr = arrays["indptr"]
+        self.doc_delta = arrays["doc_delta"]
+        self.tf = arrays["tf"]
+        self.idf = arrays["idf"]
+        self.terms = terms
+        self.vocab = {t: i for i, t in enumerate(terms)}
+        # Mẫu số BM25 phần phụ thuộc độ dài doc: k1 * (1 - b + b * dl / avgdl), tính sẵn
+        self._len_norm = (self.k1 * (1 - self.b + self.b * np.asarray(self.doc_len, dtype="float32") / self.avgdl)).astype("float32")
+
+    @classmethod
+    def build(cls, ids: Sequence[int], texts: Iterable[Optional[str]], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        vocab: Dict[str, int] = {}
+        term_ids: List[np.ndarray] = []
+        tfs: List[np.ndarray] = []
+        doc_len = []
+        for text in texts:
+            counts = Counter(tokenize(text))
+            doc_len.append(sum(counts.values()))
+            term_ids.append(np.fromiter((vocab.setdefault(t, len(vocab)) for t in counts), dtype="int64", count=len(counts)))
+            tfs.append(np.fromiter(counts.values(), dtype="int64", count=len(counts)))
+
+        n_docs, n_terms = len(doc_len), len(vocab)
+        tids = np.concatenate(term_ids) if term_ids else np.zeros(0, dtype="int64")
+        tf = np.concatenate(tfs) if tfs else np.zeros(0, dtype="int64")
+        docs = np.repeat(np.arange(n_docs, dtype="int64"), [len(t) for t in term_ids])
+
+        order = np.lexsort((docs, tids))    # theo term, rồi theo doc
+        tids, docs, tf = tids[order], docs[order], tf[order]
+        df = np.bincount(tids, minlength=n_terms)
+        indptr = np.zeros(n_terms + 1, dtype="int64")
+        np.cumsum(df, out=indptr[1:])
+
+        delta = np.diff(docs, prepend=0)
+        delta[indptr[:-1][df > 0]] = docs[indptr[:-1][df > 0]]     # đầu mỗi posting: lưu vị trí tuyệt đối
+        delta_dtype = "uint16" if delta.size == 0 or int(delta.max()) <= np.iinfo("uint16").max else "uint32"
+
+        arrays = {
+            "ids": np.asarray(list(ids), dtype="int64"),
+            "doc_len": np.asarray(doc_len, dtype="float32"),
+            "indptr": indptr,
+            "doc_delta": delta.astype(delta_dtype),
+            "tf": np.minimum(tf, np.iinfo("uint16").max).astype("uint16"),
+            "idf": np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype("float32"),
+        }
+        if arrays["ids"].shape[0] != n_docs:
+            raise ValueError("ids và texts phải cùng độ dài.")
+        terms = [None] * n_terms
+        for t, i in vocab.items():
+            terms[i] = t
+        meta = {
+            "count": n_docs,
+            "terms": n_terms,
+            "postings": int(tids.shape[0]),
+            "avgdl": float(np.mean(doc_len)) if doc_len else 1.0,
+            "k1": float(k1),
+            "b": float(b),
+            "delta_dtype": delta_dtype,
+        }
+        return cls(arrays, terms, meta)
+
+    @classmethod
+    def from_store(cls, store: Any, k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        """Từ MapStore: cùng id FAISS / text với index dense."""
+        return cls.build(np.asarray(store.ids).tolist(), (store.texts[i] for i in range(len(store))), k1=k1, b=b)
+
+    @classmethod
+    def from_mapdata(cls, MapData: Dict[str, Any], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        items = sorted(MapData.get("items", []), key=lambda it: int(it["index"]))
+        return cls.build([int(it["index"]) for it in items], (it.get("text") for it in items), k1=k1, b=b)
+
+    # ---------- Lưu / nạp ----------
+    def save(self, LexicalPath: str) -> None:
+        """Ghi vào thư mục tạm rồi đổi tên (như MapStore)."""
+        LexicalPath = LexicalPath.rstrip("/\\")
+        tmp_path, old_path = f"{LexicalPath}.tmp", f"{LexicalPath}.old"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        with open(os.path.join(tmp_path, _TERMS_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.terms, f, ensure_ascii=False)
+        MyUtils.write_json(self.meta, os.path.join(tmp_path, _META_FILE), indent=2)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(LexicalPath):
+            os.replace(LexicalPath, old_path)
+        os.replace(tmp_path, LexicalPath)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.LexicalPath = LexicalPath
+
+    @classmethod
+    def load(cls, LexicalPath: str, mmap: bool = True) -> "BM25Index":
+        arrays = {
+            name: np.load(os.path.join(LexicalPath, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _ARRAYS
+        }
+        with open(os.path.join(LexicalPath, _TERMS_FILE), "r", encoding="utf-8") as f:
+            terms = json.load(f)
+        return cls(arrays, terms, MyUtils.read_json(os.path.join(LexicalPath, _META_FILE)), LexicalPath)
+
+    # ---------- Tra cứu ----------
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def postings(self, tid: int) -> Tuple[np.ndarray, np.ndarray]:
+        """(vị trí doc, tf) của 1 term — giải nén delta."""
+        a, b = int(self.indptr[tid]), int(self.indptr[tid + 1])
+        return np.cumsum(self.doc_delta[a:b], dtype="int64"), np.asarray(self.tf[a:b], dtype="float32")
+
+    def scores(self, query: str) -> np.ndarray:
+        """Điểm BM25 của mọi doc (mảng dày, 0 = không khớp term nào)."""
+        n = len(self)
+        tids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        if not tids or n == 0:
+            return np.zeros(n, dtype="float32")
+        docs, contrib = [], []
+        for tid in tids:
+            d, tf = self.postings(tid)
+            docs.append(d)
+            contrib.append(self.idf[tid] * tf * (self.k1 + 1) / (tf + self._len_norm[d]))
+        return np.bincount(np.concatenate(docs), weights=np.concatenate(contrib), minlength=n).astype("float32")
+
+    def search(self, query: str, k: int = 20, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k (scores, ids FAISS) giảm dần; thiếu thì đệm score 0 / id -1.
+        allowed: bitmap id FAISS (Faiss_Filter.Selection.bitmap) → chỉ giữ doc được phép trước khi chọn top-k.
+        """
+        out_scores = np.zeros(k, dtype="float32")
+        out_ids = np.full(k, -1, dtype="int64")
+        s = self.scores(query)
+        hit = np.flatnonzero(s > 0)
+        if allowed is not None:
+            hit = hit[Faiss_Filter.contains(allowed, self.ids[hit])]
+        if hit.size == 0:
+            return out_scores, out_ids
+        if hit.size > k:
+            hit = hit[np.argpartition(-s[hit], k - 1)[:k]]
+        hit = hit[np.argsort(-s[hit], kind="stable")]
+        out_scores[:hit.size] = s[hit]
+        out_ids[:hit.size] = self.ids[hit]
+        return out_scores, out_ids
+
+    def search_many(
+        self, queries: Sequence[str], k: int = 20, allowed: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        rows = [self.search(q, k, allowed) for q in queries]
+        if not rows:
+            return np.zeros((0, k), dtype="float32"), np.zeros((0, k), dtype="int64")
+        return np.stack([r[0] for r in rows]), np.stack([r[1] for r in rows])
+
+    def nbytes(self) -> int:
+        return sum(int(np.asarray(getattr(self, name)).nbytes) for name in _ARRAYS)
+
+
+# ===============================
+# 2. Hợp nhất kết quả dense + lexical
+# ===============================
+FUSION_MODES = ("rrf", "weighted")
+
+
+def fuse(
+    dense_scores: np.ndarray,
+    dense_ids: np.ndarray,
+    lex_scores: np.ndarray,
+    lex_ids: np.ndarray,
+    k: int,
+    mode: str = "rrf",
+    rrf_k: int = 60,
+    lexical_weight: float = 0.3,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Hợp nhất 1 hàng kết quả (id < 0 bị bỏ):
+      - "rrf": Σ 1 / (rrf_k + hạng)
+      - "weighted": (1 - w) * dense + w * bm25, mỗi danh sách chuẩn hoá min-max
+    Trả về (ids, fused, dense_score, bm25_score) dài ≤ k; NaN = không có trong danh sách tương ứng.
+    """
+    if mode not in FUSION_MODES:
+        raise ValueError(f"mode phải thuộc {FUSION_MODES}")
+    dkeep, lkeep = dense_ids >= 0, lex_ids >= 0
+    d_ids, d_sc = dense_ids[dkeep], dense_scores[dkeep].astype("float64")
+    l_ids, l_sc = lex_ids[lkeep], lex_scores[lkeep].astype("float64")
+
+    if mode == "rrf":
+        d_part = 1.0 / (rrf_k + 1 + np.arange(d_ids.size))
+        l_part = 1.0 / (rrf_k + 1 + np.arange(l_ids.size))
+    else:
+        def _minmax(x: np.ndarray) -> np.ndarray:
+            span = x.max() - x.min() if x.size else 0.0
+            return (x - x.min()) / span if span > 0 else np.ones_like(x)
+        d_part = (1 - lexical_weight) * _minmax(d_sc)
+        l_part = lexical_weight * _minmax(l_sc)
+
+    uniq, inverse = np.unique(np.concatenate([d_ids, l_ids]), return_inverse=True)
+    fused = np.bincount(inverse, weights=np.concatenate([d_part, l_part]), minlength=uniq.size)
+    dense_of = np.full(uniq.size, np.nan)
+    dense_of[inverse[:d_ids.size]] = d_sc
+    bm25_of = np.full(uniq.size, np.nan)
+    bm25_of[inverse[d_ids.size:]] = l_sc
+
+    # Điểm hợp nhất bằng nhau → ưu tiên điểm dense
+    order = np.lexsort((-np.nan_to_num(dense_of, nan=-np.inf), -fused))[:k]
+    return uniq[order], fused[order], dense_of[order], bm25_of[order]
@@ -0,0 +1,333 @@
+import os
+import json
+import shutil
+import hashlib
+import argparse
+import numpy as np
+
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from . import Common_MyUtils as MyUtils
+
+# Thư mục artifact (mỗi mảng 1 file .npy → np.load(mmap_mode="r") = np.memmap, zero-copy)
+_ARRAYS = ("ids", "key_offsets", "key_blob", "text_offsets", "text_blob", "chunk_indptr", "chunk_ids")
+_META_FILE = "meta.json"
+
+
+# ===============================
+# 1. Bảng chuỗi: offsets + blob UTF-8
+# ===============================
+class StringTable:
+    """Chuỗi thứ i = blob[offsets[i]:offsets[i+1]] (UTF-8); chỉ decode khi truy cập."""
+
+    def __init__(self, offsets: np.ndarray, blob: np.ndarray):
+        self.offsets = offsets
+        self.blob = blob
+
+    def __len__(self) -> int:
+        return int(self.offsets.shape[0]) - 1
+
+    def __getitem__(self, pos: int) -> str:
+        a, b = int(self.offsets[pos]), int(self.offsets[pos + 1])
+        return self.blob[a:b].tobytes().decode("utf-8")
+
+    @staticmethod
+    def pack(values: Iterable[Optional[str]]) -> Dict[str, np.ndarray]:
+        encoded = [(v or "").encode("utf-8") for v in values]
+        offsets = np.zeros(len(encoded) + 1, dtype="int64")
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype="uint8")
+        return {"offsets": offsets, "blob": blob}
+
+
+# ===============================
+# 2. MapStore (thay Mapping / MapData / MapChunk JSON)
+# ===============================
+class MapStore:
+    """
+    Tra cứu index FAISS → key / text / chunk_ids trên mảng memmap:
+      - ids: id FAISS (int64, tăng dần; có thể thưa sau remove_chunks)
+      - key_offsets + key_blob, text_offsets + text_blob: StringTable
+      - chunk_indptr + chunk_ids: CSR index → nhóm chunk
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], StorePath: Optional[str] = None):
+        self.StorePath = StorePath
+        self.meta = meta
+        self.ids = arrays["ids"]
+        self.keys = StringTable(arrays["key_offsets"], arrays["key_blob"])
+        self.texts = StringTable(arrays["text_offsets"], arrays["text_blob"])
+        self.chunk_indptr = arrays["chunk_indptr"]
+        self.chunk_ids = arrays["chunk_ids"]
+        self._hash: Optional[str] = None
+        n = int(self.ids.shape[0])
+        self._dense = bool(n == 0 or (int(self.ids[0]) == 0 and int(self.ids[-1]) == n - 1))
+
+    @classmethod
+    def from_dicts(
+        cls,
+        Mapping: Dict[str, Any],
+        MapData: Dict[str, Any],
+        MapChunk: Optional[Dict[str, Any]] = None,
+    ) -> "MapStore":
+        """MapStore trong RAM (cùng bố cục mảng) từ Mapping / MapData / MapChunk dạng dict."""
+        arrays, meta = pack_arrays(Mapping, MapData, MapChunk)
+        for arr in arrays.values():
+            arr.setflags(write=False)
+        return cls(arrays, meta)
+
+    @classmethod
+    def load(cls, StorePath: str) -> "MapStore":
+        arrays = {name: np.load(os.path.join(StorePath, f"{name}.npy"), mmap_mode="r") for name in _ARRAYS}
+        with open(os.path.join(StorePath, _META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        return cls(arrays, meta, StorePath)
+
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def position(self, idx: int) -> int:
+        """Vị trí trong mảng của id FAISS; -1 nếu không có."""
+        n = len(self)
+        if self._dense:
+            return idx if 0 <= idx < n else -1
+        pos = int(np.searchsorted(self.ids, idx))
+        return pos if pos < n and int(self.ids[pos]) == idx else -1
+
+    def positions(self, ids: np.ndarray) -> np.ndarray:
+        """Bản vector hoá của position(): mảng id FAISS → mảng vị trí (-1 nếu không có)."""
+        ids = np.asarray(ids, dtype="int64")
+        n = len(self)
+        if self._dense:
+            return np.where((ids >= 0) & (ids < n), ids, -1)
+        pos = np.searchsorted(self.ids, ids)
+        found = pos < n
+        found[found] = self.ids[pos[found]] == ids[found]
+        return np.where(found, pos, -1)
+
+    def key(self, idx: int) -> Optional[str]:
+        pos = self.position(idx)
+        return self.keys[pos] if pos >= 0 else None
+
+    def text(self, idx: int) -> Optional[str]:
+        pos = self.position(idx)
+        return self.texts[pos] if pos >= 0 else None
+
+    def chunks(self, idx: int) -> List[int]:
+        pos = self.position(idx)
+        if pos < 0:
+            return []
+        return self.chunk_ids[self.chunk_indptr[pos]:self.chunk_indptr[pos + 1]].tolist()
+
+    def content_hash(self) -> str:
+        """Hash nội dung (ids, key, text, chunk) — đổi khi artifact đổi dù tên phiên bản giữ nguyên."""
+        if self._hash is None:
+            h = hashlib.blake2b(digest_size=16)
+            for arr in (self.ids, self.keys.offsets, self.keys.blob, self.texts.offsets, self.texts.blob,
+                        self.chunk_indptr, self.chunk_ids):
+                h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+            self._hash = h.hexdigest()
+        return self._hash
+
+    def nbytes(self) -> int:
+        return sum(int(getattr(self, a).nbytes) for a in ("ids", "chunk_indptr", "chunk_ids")) + sum(
+            int(t.offsets.nbytes + t.blob.nbytes) for t in (self.keys, self.texts)
+        )
+
+
+# ===============================
+# 3. Ghi artifact
+# ===============================
+def pack_arrays(
+    Mapping: Dict[str, Any],
+    MapData: Dict[str, Any],
+    MapChunk: Optional[Dict[str, Any]] = None,
+) -> Tuple[Dict[str, np.ndarray], Dict[str, Any]]:
+    """Mapping / MapData / MapChunk (dạng dict như build_from_json) → (mảng, meta) của MapStore."""
+    i2k = Mapping.get("index_to_key", {})
+    idx2text = {int(it["index"]): it.get("text") for it in MapData.get("items", [])}
+    i2c = (MapChunk or {}).get("index_to_chunk", {})
+
+    ids = np.array(sorted(int(i) for i in i2k), dtype="int64")
+    keys = StringTable.pack(i2k[str(i)] for i in ids.tolist())
+    texts = StringTable.pack(idx2text.get(i) for i in ids.tolist())
+
+    groups = [i2c.get(str(i), []) for i in ids.tolist()]
+    chunk_indptr = np.zeros(len(groups) + 1, dtype="int64")
+    np.cumsum([len(g) for g in groups], out=chunk_indptr[1:])
+    chunk_ids = np.fromiter((int(c) for g in groups for c in g), dtype="int64", count=int(chunk_indptr[-1]))
+
+    arrays = {
+        "ids": ids,
+        "key_offsets": keys["offsets"], "key_blob": keys["blob"],
+        "text_offsets": texts["offsets"], "text_blob": texts["blob"],
+        "chunk_indptr": chunk_indptr, "chunk_ids": chunk_ids,
+    }
+    meta = {
+        "count": int(ids.shape[0]),
+        "mapping": Mapping.get("meta", {}),
+        "mapdata": MapData.get("meta", {}),
+        "mapchunk": (MapChunk or {}).get("meta", {}),
+    }
+    return arrays, meta
+
+
+def write_mapstore(
+    StorePath: str,
+    Mapping: Dict[str, Any],
+    MapData: Dict[str, Any],
+    MapChunk: Optional[Dict[str, Any]] = None,
+) -> MapStore:
+    """
+    Ghi Mapping / MapData / MapChunk thành artifact nhị phân.
+    Ghi vào thư mục tạm rồi đổi tên → reader không bao giờ thấy artifact dở dang.
+    """
+    arrays, meta = pack_arrays(Mapping, MapData, MapChunk)
+    StorePath = StorePath.rstrip("/\\")
+    tmp_path, old_path = f"{StorePath}.tmp", f"{StorePath}.old"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    for name, arr in arrays.items():
+        np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(arr))
+    MyUtils.write_json(meta, os.path.join(tmp_path, _META_FILE), indent=2)
+
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.exists(StorePath):
+        os.replace(StorePath, old_path)
+    os.replace(tmp_path, StorePath)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return MapStore.load(StorePath)
+
+
+class MapStoreWriter:
+    """
+    Ghi MapStore tăng dần (build_streaming): mỗi passage append thẳng xuống file tạm
+    (ids, offsets, blob key/text), cặp (id, chunk) ghi riêng rồi dựng CSR khi close().
+    RAM không phụ thuộc độ dài text; chỉ bước dựng CSR cần ~3 mảng int64 theo số cặp.
+    id phải tăng dần (như build_from_json / build_streaming cấp).
+    """
+
+    _BLOCK = 1 << 20   # số phần tử mỗi lần chép file tạm → .npy
+
+    def __init__(self, StorePath: str):
+        self.StorePath = StorePath.rstrip("/\\")
+        self.tmp_path = f"{self.StorePath}.tmp"
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+        os.makedirs(self.tmp_path)
+        self._files = {
+            name: open(os.path.join(self.tmp_path, f"{name}.bin"), "wb")
+            for name in ("ids", "key_offsets", "key_blob", "text_offsets", "text_blob", "pairs")
+        }
+        self._sizes = {"key": 0, "text": 0}
+        self._files["key_offsets"].write(np.zeros(1, dtype="int64").tobytes())
+        self._files["text_offsets"].write(np.zeros(1, dtype="int64").tobytes())
+        self.count = 0
+        self.pairs = 0
+        self._last_id = -1
+
+    def add(self, idx: int, key: Optional[str], text: Optional[str], chunk_id: Optional[int] = None) -> None:
+        """Thêm 1 passage (id tăng dần); chunk_id → link luôn."""
+        if idx <= self._last_id:
+            raise ValueError(f"id phải tăng dần: {idx} <= {self._last_id}")
+        self._last_id = int(idx)
+        self._files["ids"].write(np.int64(idx).tobytes())
+        for name, value in (("key", key), ("text", text)):
+            raw = (value or "").encode("utf-8")
+            self._files[f"{name}_blob"].write(raw)
+            self._sizes[name] += len(raw)
+            self._files[f"{name}_offsets"].write(np.int64(self._sizes[name]).tobytes())
+        self.count += 1
+        if chunk_id is not None:
+            self.link(idx, chunk_id)
+
+    def link(self, idx: int, chunk_id: int) -> None:
+        """Gắn thêm chunk cho passage đã add (trùng lặp được bỏ khi close)."""
+        self._files["pairs"].write(np.array([idx, chunk_id], dtype="int64").tobytes())
+        self.pairs += 1
+
+    def _to_npy(self, name: str, dtype: str) -> None:
+        src_path = os.path.join(self.tmp_path, f"{name}.bin")
+        n = os.path.getsize(src_path) // np.dtype(dtype).itemsize
+        dst = np.lib.format.open_memmap(os.path.join(self.tmp_path, f"{name}.npy"), mode="w+", dtype=dtype, shape=(n,))
+        if n:
+            src = np.memmap(src_path, dtype=dtype, mode="r", shape=(n,))
+            for start in range(0, n, self._BLOCK):
+                dst[start:start + self._BLOCK] = src[start:start + self._BLOCK]
+            del src
+        dst.flush()
+        del dst
+        os.remove(src_path)
+
+    def _write_chunks(self) -> None:
+        """Cặp (id, chunk) → CSR theo thứ tự ids (sắp xếp + bỏ trùng)."""
+        path = os.path.join(self.tmp_path, "pairs.bin")
+        pairs = np.fromfile(path, dtype="int64").reshape(-1, 2)
+        os.remove(path)
+        ids = np.load(os.path.join(self.tmp_path, "ids.npy"), mmap_mode="r")
+        pos = np.searchsorted(ids, pairs[:, 0])
+        chunk = pairs[:, 1]
+        del pairs
+        order = np.lexsort((chunk, pos))
+        pos, chunk = pos[order], chunk[order]
+        keep = np.ones(pos.shape[0], dtype=bool)
+        keep[1:] = (pos[1:] != pos[:-1]) | (chunk[1:] != chunk[:-1])
+        pos, chunk = pos[keep], chunk[keep]
+        chunk_indptr = np.zeros(self.count + 1, dtype="int64")
+        np.cumsum(np.bincount(pos, minlength=self.count), out=chunk_indptr[1:])
+        np.save(os.path.join(self.tmp_path, "chunk_indptr.npy"), chunk_indptr)
+        np.save(os.path.join(self.tmp_path, "chunk_ids.npy"), chunk)
+
+    def close(
+        self,
+        mapping_meta: Optional[Dict[str, Any]] = None,
+        mapdata_meta: Optional[Dict[str, Any]] = None,
+    ) -> MapStore:
+        """Đóng file tạm → .npy + meta, đổi tên thư mục (nguyên tử như write_mapstore)."""
+        for f in self._files.values():
+            f.close()
+        for name in ("ids", "key_offsets", "text_offsets"):
+            self._to_npy(name, "int64")
+        for name in ("key_blob", "text_blob"):
+            self._to_npy(name, "uint8")
+        self._write_chunks()
+        meta = {"count": self.count, "mapping": mapping_meta or {}, "mapdata": mapdata_meta or {}, "mapchunk": {}}
+        MyUtils.write_json(meta, os.path.join(self.tmp_path, _META_FILE), indent=2)
+
+        old_path = f"{self.StorePath}.old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(self.StorePath):
+            os.replace(self.StorePath, old_path)
+        os.replace(self.tmp_path, self.StorePath)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return MapStore.load(self.StorePath)
+
+    def abort(self) -> None:
+        for f in self._files.values():
+            f.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+def convert_json(MappingPath: str, MapDataPath: str, MapChunkPath: Optional[str], StorePath: str) -> MapStore:
+    """Chuyển bộ *_Mapping.json / *_MapData.json / *_MapChunk.json sẵn có sang MapStore."""
+    MapChunk = MyUtils.read_json(MapChunkPath) if MapChunkPath else None
+    return write_mapstore(StorePath, MyUtils.read_json(MappingPath), MyUtils.read_json(MapDataPath), MapChunk)
+
+
+# ===============================
+# 4. CLI
+# ===============================
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Chuyển Mapping/MapData/MapChunk JSON → MapStore (memmap).")
+    parser.add_argument("--mapping", required=True)
+    parser.add_argument("--mapdata", required=True)
+    parser.add_argument("--mapchunk", default=None)
+    parser.add_argument("--out", required=True, help="Thư mục MapStore (vd. Database/HNMU/HNMU_Embedding_MapStore)")
+    args = parser.parse_args()
+
+    json_bytes = sum(os.path.getsize(p) for p in (args.mapping, args.mapdata, args.mapchunk) if p)
+    store = convert_json(args.mapping, args.mapdata, args.mapchunk, args.out)
+    print(f"✅ {len(store)} vector → {args.out} ({store.nbytes() / 1024:.1f} KB, JSON {json_bytes / 1024:.1f} KB)")
+
+
+if __name__ == "__main__":
+    main()
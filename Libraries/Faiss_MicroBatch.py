@@ -0,0 +1,227 @@
+import time
+import queue
+import asyncio
+import logging
+import threading
+import numpy as np
+
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+# ===============================
+# 1. Micro-batching scheduler
+# ===============================
+class _Request:
+    __slots__ = ("items", "future", "enqueued")
+
+    def __init__(self, items: List[Any]):
+        self.items = items
+        self.future: Future = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatcher:
+    """
+    Gom request từ nhiều luồng / coroutine thành 1 lần chạy model:
+      - chờ tối đa max_wait_ms kể từ request đầu tiên, hoặc tới khi đủ max_batch item
+      - fn(items) chạy 1 lần trên cả lô (trả về chuỗi cùng độ dài), kết quả được tách về future của từng caller
+    Request lớn hơn max_batch vẫn chạy 1 mình (không bị cắt).
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[Any]], Sequence[Any]],
+        max_batch: int = 64,
+        max_wait_ms: float = 5.0,
+        name: str = "batcher",
+    ):
+        self.fn = fn
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self.name = name
+        self._queue: "queue.Queue[Optional[_Request]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {
+            "requests": 0, "items": 0, "batches": 0, "errors": 0,
+            "queue_depth": 0, "max_queue_depth": 0, "max_batch_items": 0,
+            "wait_ms_total": 0.0, "run_ms_total": 0.0,
+        }
+
+    # ---------- Gửi request ----------
+    def submit(self, items: Sequence[Any]) -> Future:
+        """Đưa items vào hàng đợi; Future trả về list kết quả cùng thứ tự items."""
+        req = _Request(list(items))
+        if not req.items:
+            req.future.set_result([])
+            return req.future
+        self._ensure_started()
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["queue_depth"] += 1
+            self._stats["max_queue_depth"] = max(self._stats["max_queue_depth"], self._stats["queue_depth"])
+        self._queue.put(req)
+        return req.future
+
+    def __call__(self, items: Sequence[Any]) -> List[Any]:
+        """Bản chặn (cho endpoint sync chạy trong threadpool)."""
+        return self.submit(items).result()
+
+    async def asubmit(self, items: Sequence[Any]) -> List[Any]:
+        """Bản async (cho endpoint async): không chặn event loop."""
+        return await asyncio.wrap_future(self.submit(items))
+
+    # ---------- Vòng lặp worker ----------
+    def _ensure_started(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            with self._lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(target=self._loop, name=f"MicroBatcher-{self.name}", daemon=True)
+                    self._thread.start()
+
+    def _collect(self, first: _Request) -> Tuple[List[_Request], Optional[_Request], bool]:
+        """Gom request tới khi đủ max_batch item hoặc hết max_wait. Trả về (lô, request để dành, stop)."""
+        batch, n = [first], len(first.items)
+        deadline = first.enqueued + self.max_wait
+        while n < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            try:
+                # Hết hạn chờ vẫn lấy nốt request đã xếp hàng (tải cao → hàng đợi dồn)
+                req = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if req is None:
+                return batch, None, True
+            if n + len(req.items) > self.max_batch:
+                return batch, req, False  # không vừa lô này → mở đầu lô sau
+            batch.append(req)
+            n += len(req.items)
+        return batch, None, False
+
+    def _loop(self) -> None:
+        carry: Optional[_Request] = None
+        stop = False
+        while not stop:
+            first = carry if carry is not None else self._queue.get()
+            if first is None:
+                break
+            batch, carry, stop = self._collect(first)
+            self._run(batch)
+
+    def _run(self, batch: List[_Request]) -> None:
+        flat = [x for req in batch for x in req.items]
+        start = time.perf_counter()
+        with self._lock:
+            self._stats["queue_depth"] -= len(batch)
+            self._stats["wait_ms_total"] += sum(start - req.enqueued for req in batch) * 1000
+        try:
+            out = self.fn(flat)
+        except Exception as e:
+            logging.error(f"❌ [{self.name}] Lỗi khi chạy lô {len(flat)} item: {e}")
+            with self._lock:
+                self._stats["errors"] += 1
+            for req in batch:
+                req.future.set_exception(e)
+            return
+        run_ms = (time.perf_counter() - start) * 1000
+
+        pos = 0
+        for req in batch:
+            size = len(req.items)
+            req.future.set_result(out[pos:pos + size])
+            pos += size
+
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["items"] += len(flat)
+            self._stats["max_batch_items"] = max(self._stats["max_batch_items"], len(flat))
+            self._stats["run_ms_total"] += run_ms
+
+    def stop(self) -> None:
+        self._queue.put(None)
+
+    # ---------- Thống kê ----------
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        batches, requests = max(1, s["batches"]), max(1, s["requests"])
+        return {
+            "name": self.name,
+            "max_batch": self.max_batch,
+            "max_wait_ms": round(self.max_wait * 1000, 3),
+            "requests": s["requests"],
+            "items": s["items"],
+            "batches": s["batches"],
+            "errors": s["errors"],
+            "queue_depth": s["queue_depth"],
+            "max_queue_depth": s["max_queue_depth"],
+            "avg_batch_items": round(s["items"] / batches, 2),
+            "avg_requests_per_batch": round(s["requests"] / batches, 2),
+            "max_batch_items": s["max_batch_items"],
+            "avg_wait_ms": round(s["wait_ms_total"] / requests, 3),
+            "avg_run_ms": round(s["run_ms_total"] / batches, 3),
+        }
+
+
+# ===============================
+# 2. Proxy model (cùng interface encode / predict)
+# ===============================
+class BatchedEncoder:
+    """
+    Bọc SentenceTransformer (hoặc backend ONNX cùng .encode): mỗi lời gọi encode() được gom
+    với lời gọi đồng thời khác thành 1 lô. Luôn trả về numpy float32.
+    Mỗi forward tối đa batch_size câu (mặc định max_batch): lô / request quá lớn được model.encode
+    chia thành nhiều forward thay vì 1 forward khổng lồ.
+    Thuộc tính khác (get_sentence_embedding_dimension, ...) chuyển thẳng cho model gốc.
+    """
+
+    def __init__(
+        self,
+        model: Any,
+        max_batch: int = 64,
+        max_wait_ms: float = 5.0,
+        device: Optional[str] = None,
+        batch_size: Optional[int] = None,
+    ):
+        self.model = model
+        self.device = device
+        self.batch_size = max(1, int(batch_size or max_batch))
+        self.batcher = MicroBatcher(self._forward, max_batch=max_batch, max_wait_ms=max_wait_ms, name="encoder")
+
+    def _forward(self, sentences: List[str]) -> np.ndarray:
+        kwargs = {"device": self.device} if self.device else {}
+        return np.asarray(self.model.encode(
+            sentences,
+            batch_size=min(len(sentences), self.batch_size),
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            **kwargs,
+        ), dtype="float32")
+
+    def encode(self, sentences: Any, **_: Any) -> np.ndarray:
+        """Tham số batch_size / device / convert_to_* của caller bị bỏ qua (lô chung, forward ≤ self.batch_size)."""
+        single = isinstance(sentences, str)
+        out = np.asarray(self.batcher([sentences] if single else list(sentences)), dtype="float32")
+        return out[0] if single else out
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
+
+
+class BatchedReranker:
+    """Bọc CrossEncoder (hoặc backend ONNX cùng .predict): cặp (query, passage) của các request đồng thời chung batch."""
+
+    def __init__(self, model: Any, max_batch: int = 128, max_wait_ms: float = 5.0, batch_size: int = 32):
+        self.model = model
+        self.batch_size = int(batch_size)
+        self.batcher = MicroBatcher(self._forward, max_batch=max_batch, max_wait_ms=max_wait_ms, name="reranker")
+
+    def _forward(self, pairs: List[Any]) -> np.ndarray:
+        return np.asarray(self.model.predict(pairs, batch_size=self.batch_size, show_progress_bar=False))
+
+    def predict(self, pairs: Sequence[Any], **_: Any) -> np.ndarray:
+        return np.asarray(self.batcher(pairs))
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
@@ -0,0 +1,368 @@
+import os
+import shutil
+import logging
+import threading
+import numpy as np
+
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from . import Common_MyUtils as MyUtils
+
+# Thư mục artifact (như MapStore / Lexical): mỗi mảng 1 file .npy → np.load(mmap_mode="r")
+_ARRAYS = ("ids", "indptr", "tokens")
+_META_FILE = "meta.json"
+
+DEFAULT_MAX_LENGTH = 512        # độ dài cặp tối đa nếu reranker không khai báo max_length
+DEFAULT_QUERY_TOKENS = 64       # ngân sách token của query; passage nhận phần còn lại
+_PROBE_PAIRS = (
+    ("học phí bao nhiêu", "Điều 12. Học phí được thu theo từng học kỳ."),
+    ("IT3040", "Mã học phần IT3040 là Kỹ thuật lập trình, 3 tín chỉ"),
+)
+
+
+def tokenizer_name(tokenizer: Any) -> str:
+    """Định danh tokenizer (đường dẫn + kích thước vocab): cache chỉ dùng được với đúng tokenizer đã build."""
+    return f"{getattr(tokenizer, 'name_or_path', '') or type(tokenizer).__name__}:{len(tokenizer)}"
+
+
+def _token_ids(tokenizer: Any, texts: List[str], max_tokens: Optional[int] = None) -> List[List[int]]:
+    """Token id không kèm token đặc biệt; cắt theo token (không cắt theo ký tự)."""
+    kwargs = {"truncation": True, "max_length": int(max_tokens)} if max_tokens else {}
+    return tokenizer(texts, add_special_tokens=False, **kwargs)["input_ids"]
+
+
+# ===============================
+# 1. Khuôn ghép cặp (query, passage) theo tokenizer
+# ===============================
+class PairTemplate:
+    """
+    Cặp của tokenizer = prefix + query + middle + passage + suffix (vd. BERT: [CLS] q [SEP] p [SEP],
+    XLM-R: <s> q </s></s> p </s>), suy ra từ tokenizer(q, p) trên cặp mẫu → ghép id không cần tokenize lại.
+    """
+
+    def __init__(self, prefix: List[int], middle: List[int], suffix: List[int], type_a: Optional[int], type_b: Optional[int]):
+        self.prefix = list(prefix)
+        self.middle = list(middle)
+        self.suffix = list(suffix)
+        self.type_a = type_a
+        self.type_b = type_b
+
+    @property
+    def n_special(self) -> int:
+        return len(self.prefix) + len(self.middle) + len(self.suffix)
+
+    @classmethod
+    def probe(cls, tokenizer: Any, samples: Sequence[Tuple[str, str]] = _PROBE_PAIRS) -> "PairTemplate":
+        """Suy khuôn từ cặp mẫu; ValueError nếu tokenizer không ghép cặp bằng cách nối 2 chuỗi đã tách."""
+        found = None
+        for q, p in samples:
+            q_ids, p_ids = _token_ids(tokenizer, [q, p])
+            enc = tokenizer(q, p)
+            full, types = list(enc["input_ids"]), enc.get("token_type_ids")
+            template = None
+            for i in range(len(full) - len(q_ids) - len(p_ids) + 1):
+                if full[i:i + len(q_ids)] != q_ids:
+                    continue
+                for j in range(i + len(q_ids), len(full) - len(p_ids) + 1):
+                    if full[j:j + len(p_ids)] == p_ids:
+                        template = cls(
+                            full[:i], full[i + len(q_ids):j], full[j + len(p_ids):],
+                            int(types[i]) if types is not None else None,
+                            int(types[j]) if types is not None else None,
+                        )
+                        break
+                if template is not None:
+                    break
+            rebuilt, rebuilt_types = template.build(q_ids, p_ids) if template is not None else (None, None)
+            if rebuilt != full or (types is not None and rebuilt_types != list(types)):
+                raise ValueError(f"Không suy được khuôn ghép cặp của tokenizer {tokenizer_name(tokenizer)}.")
+            if found is not None and vars(found) != vars(template):
+                raise ValueError(f"Khuôn ghép cặp của tokenizer {tokenizer_name(tokenizer)} không ổn định.")
+            found = template
+        return found
+
+    def build(self, q_ids: Sequence[int], p_ids: Sequence[int]) -> Tuple[List[int], Optional[List[int]]]:
+        ids = self.prefix + list(q_ids) + self.middle + list(p_ids) + self.suffix
+        if self.type_a is None:
+            return ids, None
+        n_a = len(self.prefix) + len(q_ids) + len(self.middle)
+        return ids, [self.type_a] * n_a + [self.type_b] * (len(ids) - n_a)
+
+
+# ===============================
+# 2. Cache token passage (CSR, memmap)
+# ===============================
+class PassageTokens:
+    """
+    Token id (đã cắt theo token, không kèm token đặc biệt) của mọi passage trong index:
+      - ids: id FAISS (int64, tăng dần) — cùng thứ tự MapStore
+      - indptr + tokens: CSR, token của vị trí p = tokens[indptr[p]:indptr[p + 1]] (uint16 nếu vocab < 65536)
+    meta["tokenizer"] phải khớp tokenizer của reranker, không thì bỏ qua cache.
+    """
+
+    def __init__(self, arrays: Dict[str, np.ndarray], meta: Dict[str, Any], PassagesPath: Optional[str] = None):
+        self.ids = arrays["ids"]
+        self.indptr = arrays["indptr"]
+        self.tokens = arrays["tokens"]
+        self.meta = meta
+        self.PassagesPath = PassagesPath
+        n = int(self.ids.shape[0])
+        self._dense = bool(n == 0 or (int(self.ids[0]) == 0 and int(self.ids[-1]) == n - 1))
+
+    @classmethod
+    def build(
+        cls,
+        ids: Sequence[int],
+        texts: Iterable[Optional[str]],
+        tokenizer: Any,
+        max_passage_tokens: int,
+        batch_size: int = 256,
+        store_hash: Optional[str] = None,
+    ) -> "PassageTokens":
+        texts = [t or "" for t in texts]
+        ids = np.asarray(list(ids), dtype="int64")
+        if ids.shape[0] != len(texts):
+            raise ValueError("ids và texts phải cùng độ dài.")
+        chunks: List[np.ndarray] = []
+        for start in range(0, len(texts), batch_size):
+            for toks in _token_ids(tokenizer, texts[start:start + batch_size], max_passage_tokens):
+                chunks.append(np.asarray(toks, dtype="int64"))
+        lens = np.fromiter((c.shape[0] for c in chunks), dtype="int64", count=len(chunks))
+        indptr = np.zeros(len(chunks) + 1, dtype="int64")
+        np.cumsum(lens, out=indptr[1:])
+        dtype = "uint16" if len(tokenizer) <= np.iinfo("uint16").max + 1 else "int32"
+        tokens = np.concatenate(chunks).astype(dtype) if chunks else np.zeros(0, dtype=dtype)
+        meta = {
+            "count": int(ids.shape[0]),
+            "tokenizer": tokenizer_name(tokenizer),
+            "max_passage_tokens": int(max_passage_tokens),
+            "tokens": int(tokens.shape[0]),
+            "truncated": int((lens >= max_passage_tokens).sum()),
+            "dtype": dtype,
+            "store_hash": store_hash,
+        }
+        return cls({"ids": ids, "indptr": indptr, "tokens": tokens}, meta)
+
+    @classmethod
+    def from_store(cls, store: Any, tokenizer: Any, max_passage_tokens: int, batch_size: int = 256) -> "PassageTokens":
+        """Từ MapStore: cùng id FAISS / text với index (build 1 lần cạnh index)."""
+        return cls.build(
+            np.asarray(store.ids), (store.texts[i] for i in range(len(store))), tokenizer,
+            max_passage_tokens, batch_size=batch_size, store_hash=store.content_hash(),
+        )
+
+    # ---------- Lưu / nạp ----------
+    def save(self, PassagesPath: str) -> None:
+        """Ghi vào thư mục tạm rồi đổi tên (như MapStore / Lexical)."""
+        PassagesPath = PassagesPath.rstrip("/\\")
+        tmp_path, old_path = f"{PassagesPath}.tmp", f"{PassagesPath}.old"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), np.ascontiguousarray(getattr(self, name)))
+        MyUtils.write_json(self.meta, os.path.join(tmp_path, _META_FILE), indent=2)
+
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(PassagesPath):
+            os.replace(PassagesPath, old_path)
+        os.replace(tmp_path, PassagesPath)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self.PassagesPath = PassagesPath
+
+    @classmethod
+    def load(cls, PassagesPath: str, mmap: bool = True) -> "PassageTokens":
+        arrays = {
+            name: np.load(os.path.join(PassagesPath, f"{name}.npy"), mmap_mode="r" if mmap else None)
+            for name in _ARRAYS
+        }
+        return cls(arrays, MyUtils.read_json(os.path.join(PassagesPath, _META_FILE)), PassagesPath)
+
+    # ---------- Tra cứu ----------
+    def __len__(self) -> int:
+        return int(self.ids.shape[0])
+
+    def matches(self, tokenizer: Any = None, store: Any = None) -> bool:
+        """Cache còn dùng được: cùng tokenizer và (nếu có store_hash) cùng nội dung MapStore."""
+        if tokenizer is not None and self.meta.get("tokenizer") != tokenizer_name(tokenizer):
+            return False
+        if store is not None and self.meta.get("store_hash") not in (None, store.content_hash()):
+            return False
+        return True
+
+    def tokens_of(self, idx: int) -> Optional[np.ndarray]:
+        """Token của id FAISS idx (None nếu không có trong cache)."""
+        n = len(self)
+        if self._dense:
+            pos = idx if 0 <= idx < n else -1
+        else:
+            pos = int(np.searchsorted(self.ids, idx))
+            pos = pos if pos < n and int(self.ids[pos]) == idx else -1
+        if pos < 0:
+            return None
+        return self.tokens[self.indptr[pos]:self.indptr[pos + 1]]
+
+    def nbytes(self) -> int:
+        return sum(int(getattr(self, name).nbytes) for name in _ARRAYS)
+
+
+class PassageKey(NamedTuple):
+    """Vế passage của cặp rerank khi dùng cache token (text để dự phòng khi cache không có / không khớp)."""
+    passages: PassageTokens
+    index: int
+    text: str
+
+
+# ===============================
+# 3. Reranker dùng token dựng sẵn
+# ===============================
+class TokenizedCrossEncoder:
+    """
+    Bọc CrossEncoder (hoặc OnnxCrossEncoder, cùng .model / .tokenizer): predict nhận cặp [query, passage]
+    với passage là str hoặc PassageKey. Chỉ tokenize query (mỗi query 1 lần / lô); passage lấy token
+    từ PassageTokens, ghép theo PairTemplate, xếp theo độ dài rồi pad thành tensor từng batch.
+    Cắt theo token: query ≤ max_query_tokens, passage ≤ max_length - query - token đặc biệt.
+    """
+
+    accepts_passage_keys = True
+
+    def __init__(
+        self,
+        model: Any,
+        max_length: Optional[int] = None,
+        max_query_tokens: int = DEFAULT_QUERY_TOKENS,
+        batch_size: int = 32,
+    ):
+        self.model = model
+        self.tokenizer = model.tokenizer
+        self.max_length = int(max_length or getattr(model, "max_length", None) or DEFAULT_MAX_LENGTH)
+        self.max_query_tokens = int(max_query_tokens)
+        self.batch_size = int(batch_size)
+        self.template = PairTemplate.probe(self.tokenizer)
+        self.name = tokenizer_name(self.tokenizer)
+        self.pad_id = int(getattr(self.tokenizer, "pad_token_id", None) or 0)
+        self.input_names = [n for n in getattr(self.tokenizer, "model_input_names", ("input_ids", "attention_mask"))
+                            if n in ("input_ids", "attention_mask", "token_type_ids")]
+        self._forward = self._make_forward(model)
+        self._lock = threading.Lock()
+        self._warned: set = set()
+        self._stats = {"pairs": 0, "batches": 0, "cached_passages": 0, "tokenized_passages": 0,
+                       "tokens": 0, "padded_tokens": 0}
+
+    @property
+    def max_passage_tokens(self) -> int:
+        """Ngân sách passage khi build PassageTokens cho reranker này."""
+        return max(1, self.max_length - self.max_query_tokens - self.template.n_special)
+
+    def build_passages(self, store: Any, batch_size: int = 256) -> PassageTokens:
+        return PassageTokens.from_store(store, self.tokenizer, self.max_passage_tokens, batch_size=batch_size)
+
+    # ---------- Forward (torch hoặc ONNX Runtime) ----------
+    @staticmethod
+    def _make_forward(model: Any):
+        inner = model.model
+        num_labels = int(getattr(getattr(inner, "config", None), "num_labels", 1))
+        if callable(getattr(inner, "parameters", None)):
+            import torch
+
+            # Như CrossEncoder.predict: activation_fn (ST ≥ 4) / default_activation_function (ST 3.x)
+            # / activation_fct (ST cũ); không có → sigmoid khi num_labels == 1
+            activation = next(
+                (fn for fn in (getattr(model, a, None) for a in ("activation_fn", "default_activation_function", "activation_fct"))
+                 if fn is not None),
+                torch.sigmoid if num_labels == 1 else None,
+            )
+
+            def forward(feeds: Dict[str, np.ndarray]) -> np.ndarray:
+                device = next(inner.parameters()).device
+                with torch.inference_mode():
+                    logits = inner(**{k: torch.from_numpy(v).to(device) for k, v in feeds.items()}).logits
+                    if activation is not None:
+                        logits = activation(logits)
+                out = logits.float().cpu().numpy()
+                return out[:, 0] if num_labels == 1 else out
+        else:
+            def forward(feeds: Dict[str, np.ndarray]) -> np.ndarray:
+                logits = np.asarray(inner(**feeds).logits, dtype="float32")
+                return 1.0 / (1.0 + np.exp(-logits[:, 0])) if num_labels == 1 else logits
+        return forward
+
+    # ---------- Ghép cặp ----------
+    def _passage_ids(self, passage: Any, budget: int) -> Tuple[Any, bool]:
+        """(token passage, lấy từ cache?) — cache không có / khác tokenizer → tokenize text."""
+        if isinstance(passage, PassageKey):
+            if passage.passages.matches(self.tokenizer):
+                toks = passage.passages.tokens_of(int(passage.index))
+                if toks is not None:
+                    return toks[:budget], True
+            elif passage.passages.meta.get("tokenizer") not in self._warned:
+                self._warned.add(passage.passages.meta.get("tokenizer"))
+                logging.warning(f"⚠️ PassageTokens build bằng {passage.passages.meta.get('tokenizer')}, "
+                                f"reranker dùng {self.name} → tokenize passage mỗi lần.")
+            passage = passage.text
+        return _token_ids(self.tokenizer, [passage or ""], budget)[0], False
+
+    def assemble(self, pairs: Sequence[Sequence[Any]]) -> List[Tuple[List[int], Optional[List[int]]]]:
+        """Cặp → (input_ids, token_type_ids) chưa pad; query trùng nhau chỉ tokenize 1 lần."""
+        queries = list(dict.fromkeys(p[0] for p in pairs))
+        q_tokens = dict(zip(queries, _token_ids(self.tokenizer, queries, self.max_query_tokens))) if queries else {}
+        out, cached = [], 0
+        for q, passage in pairs:
+            q_ids = q_tokens[q]
+            budget = max(1, self.max_length - len(q_ids) - self.template.n_special)
+            p_ids, hit = self._passage_ids(passage, budget)
+            cached += hit
+            out.append(self.template.build(q_ids, np.asarray(p_ids).tolist()))
+        with self._lock:
+            self._stats["cached_passages"] += cached
+            self._stats["tokenized_passages"] += len(pairs) - cached
+        return out
+
+    def _pad(self, encoded: List[Tuple[List[int], Optional[List[int]]]]) -> Dict[str, np.ndarray]:
+        width = max(len(ids) for ids, _ in encoded)
+        input_ids = np.full((len(encoded), width), self.pad_id, dtype="int64")
+        attention = np.zeros((len(encoded), width), dtype="int64")
+        types = np.zeros((len(encoded), width), dtype="int64")
+        for row, (ids, tt) in enumerate(encoded):
+            input_ids[row, :len(ids)] = ids
+            attention[row, :len(ids)] = 1
+            if tt is not None:
+                types[row, :len(tt)] = tt
+        feeds = {"input_ids": input_ids, "attention_mask": attention, "token_type_ids": types}
+        return {name: feeds[name] for name in self.input_names}
+
+    # ---------- Interface CrossEncoder ----------
+    def predict(self, sentences: Sequence[Sequence[Any]], batch_size: Optional[int] = None, **_: Any) -> np.ndarray:
+        pairs = list(sentences)
+        if not pairs:
+            return np.zeros((0,), dtype="float32")
+        bs = int(batch_size or self.batch_size)
+        encoded = self.assemble(pairs)
+        order = np.argsort([len(ids) for ids, _ in encoded], kind="stable")   # gom cặp cùng độ dài → ít pad
+        scores: List[Any] = [None] * len(pairs)
+        tokens = padded = 0
+        for start in range(0, len(order), bs):
+            rows = order[start:start + bs]
+            lengths = [len(encoded[i][0]) for i in rows]
+            feeds = self._pad([encoded[i] for i in rows])
+            tokens += sum(lengths)
+            padded += max(lengths) * len(rows)
+            for i, s in zip(rows, self._forward(feeds)):
+                scores[i] = s
+        with self._lock:
+            self._stats["pairs"] += len(pairs)
+            self._stats["batches"] += (len(order) + bs - 1) // bs
+            self._stats["tokens"] += tokens
+            self._stats["padded_tokens"] += padded
+        return np.asarray(scores, dtype="float32")
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._lock:
+            s = dict(self._stats)
+        return {
+            **s,
+            "passage_cache_ratio": round(s["cached_passages"] / s["pairs"], 4) if s["pairs"] else 0.0,
+            "padding_efficiency": round(s["tokens"] / s["padded_tokens"], 4) if s["padded_tokens"] else 0.0,
+        }
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.model, name)
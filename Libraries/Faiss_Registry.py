@@ -0,0 +1,301 @@
+import os
+import time
+import shutil
+import logging
+import threading
+import faiss
+import psutil
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from . import Common_MyUtils as MyUtils
+from . import Faiss_MapStore
+from . import Faiss_Lexical
+from . import Faiss_PassageTokens
+from . import Faiss_Searching
+from . import Faiss_ChunkMapping
+
+# Bố cục 1 phiên bản: <root>/<version>/{Index.faiss, Segment.json, MapStore/, Lexical/, Passages/}
+# Phiên bản được ghi vào thư mục ẩn ".<version>.tmp" rồi đổi tên → thư mục không bắt đầu bằng "." là đã đủ.
+INDEX_FILE = "Index.faiss"
+SEGMENT_FILE = "Segment.json"
+STORE_DIR = "MapStore"
+LEXICAL_DIR = "Lexical"
+PASSAGES_DIR = "Passages"
+
+
+def _rss_mb() -> float:
+    return psutil.Process().memory_info().rss / 2 ** 20
+
+
+def _storage_index(index: Any) -> Any:
+    """Bóc IDMap / PreTransform / HNSW → index giữ dữ liệu vector (flat codes hoặc IVF)."""
+    index = faiss.downcast_index(index)
+    while True:
+        if isinstance(index, (faiss.IndexIDMap, faiss.IndexIDMap2, faiss.IndexPreTransform)):
+            index = faiss.downcast_index(index.index)
+        elif isinstance(index, faiss.IndexHNSW):
+            index = faiss.downcast_index(index.storage)
+        else:
+            return index
+
+
+def is_mapped(index: Any) -> bool:
+    """Dữ liệu vector của index có thật sự map từ file (không nằm trong RAM)?"""
+    inner = _storage_index(index)
+    if inner.ntotal == 0:
+        return False
+    if isinstance(inner, faiss.IndexIVF):
+        invlists = faiss.downcast_InvertedLists(inner.invlists)
+        if isinstance(invlists, faiss.OnDiskInvertedLists):
+            return True
+        return (isinstance(invlists, faiss.ArrayInvertedLists) and invlists.nlist > 0
+                and not any(invlists.codes.at(i).is_owned for i in range(invlists.nlist)))
+    if isinstance(inner, faiss.IndexFlatCodes):
+        return not inner.codes.is_owned
+    return False
+
+
+def read_index(FaissPath: str, use_mmap: bool = True) -> Tuple[Any, bool]:
+    """
+    Đọc index với IO_FLAG_MMAP_IFC: map flat codes (Flat / SQ / PQ, storage của HNSW) và list IVF.
+    (IO_FLAG_MMAP chỉ map list IVF, Flat vẫn bị đọc hết vào RAM dù không báo lỗi.)
+    Trả về (index, mmap) — mmap lấy từ is_mapped(), tức dữ liệu thật sự được map, không phải "không lỗi".
+    """
+    if use_mmap:
+        try:
+            index = faiss.read_index(FaissPath, faiss.IO_FLAG_MMAP_IFC)
+            mapped = is_mapped(index)
+            if not mapped:
+                logging.info(f"ℹ️ {os.path.basename(FaissPath)}: loại index không hỗ trợ mmap → đã đọc vào RAM.")
+            return index, mapped
+        except RuntimeError as e:
+            logging.info(f"ℹ️ {os.path.basename(FaissPath)}: không mmap được ({str(e).splitlines()[0]}) → đọc vào RAM.")
+    return faiss.read_index(FaissPath), False
+
+
+class IndexBundle:
+    """
+    Một phiên bản bất biến (index, lookups, segment). Request lấy bundle 1 lần rồi dùng tới
+    cuối → vẫn chạy trên phiên bản cũ dù registry đã swap.
+    context: SearchContext dựng 1 lần khi nạp (truyền cho search / rerank).
+    Segments: SegmentViews (JSON đã bỏ trường / text / field dựng sẵn) cho process_chunks_pipeline.
+    """
+
+    def __init__(
+        self,
+        version: str,
+        FaissIndex: Any,
+        SegmentDict: Any,
+        MapStore: Optional[Faiss_MapStore.MapStore] = None,
+        Mapping: Optional[Dict[str, Any]] = None,
+        MapData: Optional[Dict[str, Any]] = None,
+        MapChunk: Optional[Dict[str, Any]] = None,
+        Lexical: Optional[Faiss_Lexical.BM25Index] = None,
+        Passages: Optional[Faiss_PassageTokens.PassageTokens] = None,
+        mmap: bool = False,
+        load_sec: float = 0.0,
+        rss_mb: float = 0.0,
+        rss_delta_mb: float = 0.0,
+    ):
+        self.version = version
+        self.FaissIndex = FaissIndex
+        self.SegmentDict = SegmentDict
+        self.Segments = Faiss_ChunkMapping.SegmentViews(SegmentDict) if isinstance(SegmentDict, list) else SegmentDict
+        self.MapStore = MapStore
+        self.Mapping = Mapping
+        self.MapData = MapData
+        self.MapChunk = MapChunk
+        self.Lexical = Lexical
+        self.Passages = Passages
+        self.mmap = mmap
+        self.load_sec = load_sec
+        self.rss_mb = rss_mb
+        self.rss_delta_mb = rss_delta_mb
+        self.loaded_at = time.time()
+        self.context = Faiss_Searching.SearchContext.from_data({
+            "FaissIndex": FaissIndex, "MapStore": MapStore,
+            "Mapping": Mapping, "MapData": MapData, "MapChunk": MapChunk, "Lexical": Lexical,
+            "Passages": Passages,
+        }, version) if FaissIndex is not None else None
+        if self.context is not None:
+            self.context.filters.warm()   # bitset lọc (base_key / chunk) dựng lúc nạp, không để request đầu tiên chịu
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "version": self.version,
+            "content_hash": self.context.content_hash if self.context is not None else None,
+            "ntotal": int(self.FaissIndex.ntotal) if self.FaissIndex is not None else 0,
+            "mmap": self.mmap,
+            "load_sec": round(self.load_sec, 4),
+            "rss_mb": round(self.rss_mb, 1),
+            "rss_delta_mb": round(self.rss_delta_mb, 1),
+            "loaded_at": self.loaded_at,
+        }
+
+
+# ===============================
+# Ghi phiên bản mới
+# ===============================
+def publish_version(
+    root: str,
+    FaissIndex: Any,
+    SegmentDict: Any,
+    Mapping: Dict[str, Any],
+    MapData: Dict[str, Any],
+    MapChunk: Optional[Dict[str, Any]] = None,
+    version: Optional[str] = None,
+    keep: int = 3,
+    build_passages: Optional[Callable[[Faiss_MapStore.MapStore], Faiss_PassageTokens.PassageTokens]] = None,
+) -> str:
+    """
+    Ghi bundle vào <root>/<version> (tmp → rename, nguyên tử) rồi dọn bớt, giữ `keep` bản mới nhất.
+    build_passages (vd. TokenizedCrossEncoder.build_passages): có thì ghi kèm token passage cho reranker.
+    """
+    version = version or time.strftime("v%Y%m%d-%H%M%S") + f"-{int(time.time() * 1000) % 1000:03d}"
+    final_path = os.path.join(root, version)
+    tmp_path = os.path.join(root, f".{version}.tmp")
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    faiss.write_index(FaissIndex, os.path.join(tmp_path, INDEX_FILE))
+    MyUtils.write_json(SegmentDict, os.path.join(tmp_path, SEGMENT_FILE), indent=1)
+    store = Faiss_MapStore.write_mapstore(os.path.join(tmp_path, STORE_DIR), Mapping, MapData, MapChunk)
+    Faiss_Lexical.BM25Index.from_store(store).save(os.path.join(tmp_path, LEXICAL_DIR))
+    if build_passages is not None:
+        build_passages(store).save(os.path.join(tmp_path, PASSAGES_DIR))
+    del store   # đóng memmap trước khi đổi tên thư mục
+    os.replace(tmp_path, final_path)
+
+    for old in list_versions(root)[:-max(1, keep)]:
+        # Linux: file đang mmap vẫn dùng được sau khi xoá; bundle cũ giữ tới khi request cuối xong
+        shutil.rmtree(os.path.join(root, old), ignore_errors=True)
+    return version
+
+
+def list_versions(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return sorted(
+        d for d in os.listdir(root)
+        if not d.startswith(".") and os.path.isfile(os.path.join(root, d, INDEX_FILE))
+    )
+
+
+# ===============================
+# Registry (read-copy-update)
+# ===============================
+class IndexRegistry:
+    """
+    Giữ con trỏ tới bundle hiện hành. Đọc: current() (không khoá — gán tham chiếu là nguyên tử).
+    Ghi: refresh() nạp phiên bản mới nhất trong root rồi swap con trỏ; bundle cũ được giải phóng
+    khi request cuối cùng còn giữ nó kết thúc.
+    on_swap(old, new): gọi sau mỗi lần swap (vd. xoá cache của phiên bản cũ).
+    """
+
+    def __init__(
+        self,
+        root: str,
+        name: str = "main",
+        poll_sec: float = 10.0,
+        use_mmap: bool = True,
+        on_swap: Optional[Callable[[Optional[IndexBundle], IndexBundle], None]] = None,
+    ):
+        self.root = root
+        self.name = name
+        self.poll_sec = float(poll_sec)
+        self.use_mmap = use_mmap
+        self.on_swap = on_swap
+        self._current: Optional[IndexBundle] = None
+        self._lock = threading.Lock()
+        self._history: List[Dict[str, Any]] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def current(self) -> Optional[IndexBundle]:
+        return self._current
+
+    def history(self) -> List[Dict[str, Any]]:
+        """Thống kê nạp (thời gian, RSS) của từng phiên bản đã nạp."""
+        return list(self._history)
+
+    def _swap(self, bundle: IndexBundle) -> None:
+        old = self._current
+        self._current = bundle
+        self._history.append(bundle.stats())
+        logging.info(
+            f"🔁 [{self.name}] {old.version if old else '-'} → {bundle.version} "
+            f"({bundle.load_sec:.3f}s, RSS {bundle.rss_mb:.1f} MB, mmap={bundle.mmap})"
+        )
+        if self.on_swap is not None:
+            try:
+                self.on_swap(old, bundle)
+            except Exception as e:
+                logging.warning(f"⚠️ [{self.name}] on_swap lỗi: {e}")
+
+    def seed(self, version: str, data: Dict[str, Any]) -> IndexBundle:
+        """Dùng dữ liệu đã nạp sẵn (vd. ReadData) làm phiên bản đầu khi root chưa có phiên bản nào."""
+        bundle = IndexBundle(
+            version,
+            data.get("FaissIndex"),
+            data.get("SegmentDict"),
+            MapStore=data.get("MapStore"),
+            Mapping=data.get("Mapping"),
+            MapData=data.get("MapData"),
+            MapChunk=data.get("MapChunk"),
+            Lexical=data.get("Lexical"),
+            Passages=data.get("Passages"),
+            rss_mb=_rss_mb(),
+        )
+        with self._lock:
+            self._swap(bundle)
+        return bundle
+
+    def load_version(self, version: str) -> IndexBundle:
+        path = os.path.join(self.root, version)
+        rss_before = _rss_mb()
+        start = time.perf_counter()
+        FaissIndex, mmap = read_index(os.path.join(path, INDEX_FILE), self.use_mmap)
+        store = Faiss_MapStore.MapStore.load(os.path.join(path, STORE_DIR))
+        lexical_path = os.path.join(path, LEXICAL_DIR)
+        # Phiên bản cũ (chưa có Lexical/) → dựng BM25 từ MapStore trong RAM
+        lexical = Faiss_Lexical.BM25Index.load(lexical_path) if os.path.isdir(lexical_path) else Faiss_Lexical.BM25Index.from_store(store)
+        passages_path = os.path.join(path, PASSAGES_DIR)
+        passages = Faiss_PassageTokens.PassageTokens.load(passages_path) if os.path.isdir(passages_path) else None
+        SegmentDict = MyUtils.read_json(os.path.join(path, SEGMENT_FILE))
+        load_sec = time.perf_counter() - start
+        rss_after = _rss_mb()
+        return IndexBundle(
+            version, FaissIndex, SegmentDict, MapStore=store, Lexical=lexical, Passages=passages, mmap=mmap,
+            load_sec=load_sec, rss_mb=rss_after, rss_delta_mb=rss_after - rss_before,
+        )
+
+    def refresh(self) -> bool:
+        """Nạp phiên bản mới nhất nếu khác phiên bản hiện hành. Trả về True nếu đã swap."""
+        with self._lock:
+            versions = list_versions(self.root)
+            if not versions:
+                return False
+            latest = versions[-1]
+            if self._current is not None and self._current.version == latest:
+                return False
+            try:
+                bundle = self.load_version(latest)
+            except Exception as e:
+                logging.error(f"❌ [{self.name}] Không nạp được phiên bản {latest}: {e}")
+                return False
+            self._swap(bundle)
+            return True
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.poll_sec):
+            self.refresh()
+
+    def start_watch(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name=f"IndexRegistry-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop_watch(self) -> None:
+        self._stop.set()
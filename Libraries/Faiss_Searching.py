@@ -1,9 +1,113 @@
 import faiss
+import hashlib
+import logging
+import threading
 import numpy as np
 
 from typing import Dict, List, Any, Optional
 from sentence_transformers import SentenceTransformer, CrossEncoder
 
+from . import Faiss_Embedding
+from . import Faiss_MapStore
+from . import Faiss_Cache
+from . import Faiss_Cascade
+from . import Faiss_Lexical
+from . import Faiss_Filter
+from . import Faiss_PassageTokens
+
+
+def _rows_from_store(store: Faiss_MapStore.MapStore, scores: np.ndarray, ids: np.ndarray) -> List[List[Dict[str, Any]]]:
+    """Ma trận kết quả FAISS (nq × k) → mỗi query 1 danh sách dict; tra vị trí 1 lần cho cả ma trận, bỏ id < 0."""
+    ids = np.asarray(ids, dtype="int64")
+    positions = store.positions(ids.ravel()).reshape(ids.shape).tolist()
+    indptr, chunk_ids = store.chunk_indptr, store.chunk_ids
+    rows = []
+    for row_ids, row_pos, row_scores in zip(ids.tolist(), positions, scores.tolist()):
+        results = []
+        for idx, pos, score in zip(row_ids, row_pos, row_scores):
+            if idx < 0:
+                continue  # IVF/HNSW có thể trả ít hơn k kết quả
+            found = pos >= 0
+            results.append({
+                "index": idx,
+                "key": store.keys[pos] if found else None,
+                "text": store.texts[pos] if found else None,
+                "faiss_score": float(score),
+                "chunk_ids": chunk_ids[indptr[pos]:indptr[pos + 1]].tolist() if found else [],
+            })
+        rows.append(results)
+    return rows
+
+
+def _results_from_store(store: Faiss_MapStore.MapStore, scores: np.ndarray, ids: np.ndarray) -> List[Dict[str, Any]]:
+    """1 hàng kết quả FAISS → danh sách dict."""
+    return _rows_from_store(store, np.asarray(scores)[None, :], np.asarray(ids)[None, :])[0]
+
+
+class SearchContext:
+    """
+    Ngữ cảnh search bất biến, dựng 1 lần lúc nạp index: index FAISS + tra cứu
+    id → key / text / chunk_ids trên mảng (MapStore), thay cho dựng dict mỗi query.
+    lexical: BM25Index (tùy chọn) cùng id / text → search hybrid.
+    filters: FilterIndex (bitset base_key / chunk trên id FAISS) → search có lọc.
+    passages: PassageTokens (tùy chọn, token passage dựng sẵn) → rerank chỉ tokenize query.
+    """
+
+    __slots__ = ("index", "store", "version", "content_hash", "lexical", "filters", "passages")
+
+    def __init__(
+        self,
+        index: "faiss.Index",  # type: ignore
+        store: Faiss_MapStore.MapStore,
+        version: Optional[str] = None,
+        lexical: Optional[Faiss_Lexical.BM25Index] = None,
+        passages: Optional[Faiss_PassageTokens.PassageTokens] = None,
+    ):
+        if passages is not None and not passages.matches(store=store):
+            logging.warning("⚠️ PassageTokens không khớp MapStore (build từ nội dung khác) → rerank tokenize text.")
+            passages = None
+        object.__setattr__(self, "index", index)
+        object.__setattr__(self, "store", store)
+        object.__setattr__(self, "version", version)
+        object.__setattr__(self, "lexical", lexical)
+        object.__setattr__(self, "filters", Faiss_Filter.FilterIndex(store))
+        object.__setattr__(self, "passages", passages)
+        # Khoá cache rerank: đổi khi nội dung index / lookups đổi (không phụ thuộc tên phiên bản)
+        shape = f"{type(index).__name__}:{getattr(index, 'ntotal', 0)}:{getattr(index, 'd', 0)}:" if index is not None else ""
+        object.__setattr__(self, "content_hash", hashlib.blake2b(
+            (shape + store.content_hash()).encode("utf-8"), digest_size=16
+        ).hexdigest())
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError("SearchContext là bất biến; tạo context mới thay vì sửa.")
+
+    @classmethod
+    def from_dicts(
+        cls,
+        index: "faiss.Index",  # type: ignore
+        Mapping: Dict[str, Any],
+        MapData: Dict[str, Any],
+        MapChunk: Optional[Dict[str, Any]] = None,
+        version: Optional[str] = None,
+        lexical: Optional[Faiss_Lexical.BM25Index] = None,
+        passages: Optional[Faiss_PassageTokens.PassageTokens] = None,
+    ) -> "SearchContext":
+        return cls(index, Faiss_MapStore.MapStore.from_dicts(Mapping, MapData, MapChunk), version, lexical, passages)
+
+    @classmethod
+    def from_data(cls, data: Dict[str, Any], version: Optional[str] = None) -> "SearchContext":
+        """Từ dict kiểu appFinal.ReadData: dùng MapStore nếu có, không thì đóng gói từ JSON."""
+        store = data.get("MapStore")
+        if store is None:
+            store = Faiss_MapStore.MapStore.from_dicts(data.get("Mapping") or {}, data.get("MapData") or {}, data.get("MapChunk"))
+        return cls(data.get("FaissIndex"), store, version, data.get("Lexical"), data.get("Passages"))
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def results(self, scores: np.ndarray, ids: np.ndarray) -> List[Dict[str, Any]]:
+        return _results_from_store(self.store, scores, ids)
+
 
 class SemanticSearchEngine:
 
@@ -16,23 +120,83 @@ class SemanticSearchEngine:
         top_k: int = 20,
         rerank_k: int = 10,
         rerank_batch_size: int = 16,
+        encode_batch_size: int = 64,
+        nprobe: Optional[int] = None,
+        efSearch: Optional[int] = None,
+        query_cache_size: int = 0,
+        rerank_cache_size: int = 0,
+        cache_ttl_sec: Optional[float] = None,
+        cascade: Optional[Faiss_Cascade.CascadePolicy] = None,
+        hybrid: Optional[str] = None,
+        rrf_k: int = 60,
+        lexical_weight: float = 0.3,
+        lexical_k: Optional[int] = None,
     ):
         self.device = device
+        self.nprobe = nprobe        # IVF / IVF-PQ / OPQ: số cluster quét khi search
+        self.efSearch = efSearch    # HNSW: độ rộng hàng đợi khi search
         self.normalize = normalize
         self.top_k = int(top_k)
         self.rerank_k = int(rerank_k)
         self.rerank_batch_size = int(rerank_batch_size)
+        self.encode_batch_size = int(encode_batch_size)   # search_many: số query / batch encode
+
+        # Hybrid BM25 + dense (cần context.lexical): None | "rrf" | "weighted"
+        if hybrid is not None and hybrid not in Faiss_Lexical.FUSION_MODES:
+            raise ValueError(f"hybrid phải là None hoặc thuộc {Faiss_Lexical.FUSION_MODES}")
+        self.hybrid = hybrid
+        self.rrf_k = int(rrf_k)
+        self.lexical_weight = float(lexical_weight)
+        self.lexical_k = lexical_k      # số ứng viên mỗi nhánh trước khi hợp nhất (None → top_k)
 
-        # ✅ Nhận trực tiếp model đã load
-        if not isinstance(indexer, SentenceTransformer):
-            raise TypeError("indexer phải là SentenceTransformer đã load sẵn.")
+        # ✅ Nhận trực tiếp model đã load (SentenceTransformer hoặc backend ONNX cùng interface encode)
+        if not callable(getattr(indexer, "encode", None)):
+            raise TypeError("indexer phải là SentenceTransformer (hoặc model có .encode) đã load sẵn.")
         self._indexer = indexer
 
-        # Reranker là tùy chọn
-        if reranker and not isinstance(reranker, CrossEncoder):
-            raise TypeError("reranker phải là CrossEncoder hoặc None.")
+        # Reranker là tùy chọn (CrossEncoder hoặc backend ONNX cùng interface predict)
+        if reranker is not None and not callable(getattr(reranker, "predict", None)):
+            raise TypeError("reranker phải là CrossEncoder (hoặc model có .predict) hoặc None.")
         self.reranker = reranker
 
+        # Cache (0 → tắt): query chuẩn hoá → embedding; (hash query, index passage, hash nội dung index) → rerank score
+        self.query_cache = Faiss_Cache.TTLCache(query_cache_size, cache_ttl_sec, name="query_embedding")
+        self.rerank_cache = Faiss_Cache.TTLCache(rerank_cache_size, cache_ttl_sec, name="rerank_score")
+
+        # Cascade: bỏ qua / thu hẹp rerank khi FAISS đã chắc chắn (None → luôn rerank toàn bộ)
+        self.cascade = cascade
+        self._rerank_lock = threading.Lock()
+        self._rerank_stats = {"requests": 0, "candidates": 0, "reranked_pairs": 0, "cached_pairs": 0,
+                              **{d: 0 for d in Faiss_Cascade.DECISIONS}}
+
+    # ---------------------------
+    # Cache
+    # ---------------------------
+    def invalidate_caches(self, content_hash: Optional[str] = None) -> Dict[str, int]:
+        """
+        Gọi khi index được swap: xoá cache embedding và score rerank của phiên bản cũ
+        (content_hash=None → xoá toàn bộ score).
+        """
+        dropped_scores = (
+            self.rerank_cache.drop(lambda key: key[2] == content_hash)
+            if content_hash is not None else self.rerank_cache.clear()
+        )
+        return {"query_embedding": self.query_cache.clear(), "rerank_score": dropped_scores}
+
+    def cache_metrics(self) -> Dict[str, Any]:
+        return {"query_embedding": self.query_cache.metrics(), "rerank_score": self.rerank_cache.metrics()}
+
+    def rerank_metrics(self) -> Dict[str, Any]:
+        """Tổng hợp cascade: số request theo quyết định, số cặp CrossEncoder thực chạy / ứng viên."""
+        with self._rerank_lock:
+            s = dict(self._rerank_stats)
+        requests = max(1, s["requests"])
+        return {
+            **s,
+            "avg_pairs_per_request": round(s["reranked_pairs"] / requests, 3),
+            "pair_savings": round(1 - s["reranked_pairs"] / s["candidates"], 4) if s["candidates"] else 0.0,
+        }
+
     # ---------------------------
     # Tiện ích nội bộ
     # ---------------------------
@@ -57,51 +221,246 @@ class SemanticSearchEngine:
     def search(
         self,
         query: str,
-        faissIndex: "faiss.Index",  # type: ignore
-        Mapping: Dict[str, Any],
-        MapData: Dict[str, Any],
+        faissIndex: Optional["faiss.Index"] = None,  # type: ignore
+        Mapping: Optional[Dict[str, Any]] = None,
+        MapData: Optional[Dict[str, Any]] = None,
         MapChunk: Optional[Dict[str, Any]] = None,
         top_k: Optional[int] = None,
         query_embedding: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None,
+        efSearch: Optional[int] = None,
+        store: Optional[Faiss_MapStore.MapStore] = None,
+        context: Optional[SearchContext] = None,
+        hybrid: Optional[str] = None,
+        filters: Optional[Any] = None,
     ) -> List[Dict[str, Any]]:
         """
+        nprobe / efSearch: knob lúc search cho index IVF / HNSW (None → mặc định engine, rồi mặc định index).
+        context: SearchContext dựng sẵn (index + tra cứu mảng) — đường nhanh, thay cho các tham số dưới.
+        store: MapStore (memmap) thay cho Mapping / MapData / MapChunk JSON.
+        hybrid: "rrf" | "weighted" | "dense" cho lời gọi này (None → self.hybrid); cần context.lexical.
+        filters: SearchFilter hoặc dict {"base_keys", "chunk_range", "chunk_ids", "ids"} → lọc trong lúc quét
+            (IDSelector trong SearchParameters), top_k chỉ gồm passage thoả điều kiện.
         Trả về:
             [{"index":..., "key":..., "text":..., "faiss_score":...}, ...]
+            (hybrid: thêm "bm25_score", "fused_score"; faiss_score = None nếu chỉ nhánh BM25 tìm thấy)
         """
         k = int(top_k or self.top_k)
+        if context is not None:
+            faissIndex, store = context.index, context.store
+        selection = self._selection(filters, context, store, Mapping, MapData, MapChunk)
+        if selection is not None and selection.count == 0:
+            return []
 
-        # 1. Encode truy vấn (hoặc dùng sẵn embedding)
-        if query_embedding is None:
-            q = self._indexer.encode(
-                [query], convert_to_tensor=True, device=str(self.device)
+        # 1. Encode truy vấn (hoặc dùng sẵn embedding) + normalize nếu dùng cosine
+        q = self._query_matrix([query], query_embedding)
+
+        # 2. Search FAISS (+ BM25 rồi hợp nhất nếu hybrid)
+        mode = self._hybrid_mode(hybrid, context, [query])
+        if mode is not None:
+            return self._hybrid_rows([query], q, k, faissIndex, context, mode, nprobe, efSearch, selection)[0]
+        scores, ids = self._search_matrix(faissIndex, q, k, nprobe, efSearch, selection)
+
+        # 3. Mapping kết quả
+        if store is not None:
+            return _results_from_store(store, scores[0], ids[0])
+        return self._rows_from_dicts(scores, ids, Mapping, MapData, MapChunk)[0]
+
+    def search_many(
+        self,
+        queries: List[str],
+        faissIndex: Optional["faiss.Index"] = None,  # type: ignore
+        Mapping: Optional[Dict[str, Any]] = None,
+        MapData: Optional[Dict[str, Any]] = None,
+        MapChunk: Optional[Dict[str, Any]] = None,
+        top_k: Optional[int] = None,
+        query_embeddings: Optional[np.ndarray] = None,
+        nprobe: Optional[int] = None,
+        efSearch: Optional[int] = None,
+        store: Optional[Faiss_MapStore.MapStore] = None,
+        context: Optional[SearchContext] = None,
+        hybrid: Optional[str] = None,
+        filters: Optional[Any] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Như search() cho nhiều query: encode theo batch (encode_batch_size), 1 lần faissIndex.search
+        trên cả ma trận query, tra cứu kết quả vector hoá. filters áp dụng chung cho cả lô.
+        Trả về: danh sách kết quả theo đúng thứ tự queries.
+        """
+        if not queries and query_embeddings is None:
+            return []
+        k = int(top_k or self.top_k)
+        if context is not None:
+            faissIndex, store = context.index, context.store
+        selection = self._selection(filters, context, store, Mapping, MapData, MapChunk)
+
+        q = self._query_matrix(queries, query_embeddings)
+        if selection is not None and selection.count == 0:
+            return [[] for _ in range(q.shape[0])]
+        mode = self._hybrid_mode(hybrid, context, queries)
+        if mode is not None:
+            return self._hybrid_rows(queries, q, k, faissIndex, context, mode, nprobe, efSearch, selection)
+        scores, ids = self._search_matrix(faissIndex, q, k, nprobe, efSearch, selection)
+
+        if store is not None:
+            return _rows_from_store(store, scores, ids)
+        return self._rows_from_dicts(scores, ids, Mapping, MapData, MapChunk)
+
+    @staticmethod
+    def _selection(
+        filters: Optional[Any],
+        context: Optional[SearchContext],
+        store: Optional[Faiss_MapStore.MapStore],
+        Mapping: Optional[Dict[str, Any]],
+        MapData: Optional[Dict[str, Any]],
+        MapChunk: Optional[Dict[str, Any]],
+    ) -> Optional[Faiss_Filter.Selection]:
+        """filters → Selection trên bitset của context (dựng sẵn); đường store / JSON dựng FilterIndex tạm."""
+        spec = Faiss_Filter.SearchFilter.coerce(filters)
+        if spec is None:
+            return None
+        if context is not None:
+            return context.filters.select(spec)
+        if store is None:
+            store = Faiss_MapStore.MapStore.from_dicts(Mapping or {}, MapData or {}, MapChunk)
+        return Faiss_Filter.FilterIndex(store).select(spec)
+
+    def _hybrid_mode(self, hybrid: Optional[str], context: Optional[SearchContext], queries: Optional[List[str]]) -> Optional[str]:
+        """Chế độ hợp nhất thực dùng; None nếu tắt ("dense"), thiếu context.lexical hoặc không có text query."""
+        mode = hybrid if hybrid is not None else self.hybrid
+        if mode in (None, "dense"):
+            return None
+        if mode not in Faiss_Lexical.FUSION_MODES:
+            raise ValueError(f"hybrid phải thuộc {Faiss_Lexical.FUSION_MODES + ('dense',)}")
+        if context is None or context.lexical is None or not queries:
+            return None
+        return mode
+
+    def _hybrid_rows(
+        self,
+        queries: List[str],
+        q: np.ndarray,
+        k: int,
+        faissIndex: "faiss.Index",  # type: ignore
+        context: SearchContext,
+        mode: str,
+        nprobe: Optional[int] = None,
+        efSearch: Optional[int] = None,
+        selection: Optional[Faiss_Filter.Selection] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """Dense top-k' + BM25 top-k' → hợp nhất (RRF / weighted) → top-k, tra cứu qua MapStore."""
+        k_cand = max(k, int(self.lexical_k or k))
+        dense_scores, dense_ids = self._search_matrix(faissIndex, q, k_cand, nprobe, efSearch, selection)
+        lex_scores, lex_ids = context.lexical.search_many(
+            queries, k_cand, allowed=selection.bitmap if selection is not None else None
+        )
+
+        fused_ids = np.full((len(queries), k), -1, dtype="int64")
+        fused_scores = np.zeros((len(queries), k), dtype="float32")
+        extras = []
+        for row in range(len(queries)):
+            ids, fused, dense, bm25 = Faiss_Lexical.fuse(
+                dense_scores[row], dense_ids[row], lex_scores[row], lex_ids[row], k,
+                mode=mode, rrf_k=self.rrf_k, lexical_weight=self.lexical_weight,
             )
-            q = q.detach().cpu().numpy().astype("float32")
-        else:
-            q = np.asarray(query_embedding, dtype="float32")
+            fused_ids[row, :ids.size] = ids
+            fused_scores[row, :ids.size] = fused
+            extras.append((dense.tolist(), bm25.tolist()))
+
+        rows = _rows_from_store(context.store, fused_scores, fused_ids)
+        for results, (dense, bm25) in zip(rows, extras):
+            for r, d, b in zip(results, dense, bm25):
+                r["fused_score"] = r["faiss_score"]
+                r["faiss_score"] = None if np.isnan(d) else float(d)
+                r["bm25_score"] = None if np.isnan(b) else float(b)
+        return rows
+
+    def _query_matrix(self, queries: List[str], query_embeddings: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Encode queries (hoặc dùng sẵn embedding) → ma trận float32 (nq × d), đã normalize nếu dùng cosine.
+        Query được chuẩn hoá (NFC, gộp khoảng trắng); chỉ encode query chưa có trong query_cache (không trùng lặp).
+        """
+        if query_embeddings is not None:
+            q = np.asarray(query_embeddings, dtype="float32")
             if q.ndim == 1:
                 q = q[None, :]
+            if self.normalize:
+                q = self._l2_normalize(q)
+            return np.ascontiguousarray(q, dtype="float32")
 
-        # 2. Normalize nếu dùng cosine
-        if self.normalize:
-            q = self._l2_normalize(q)
+        keys = [Faiss_Cache.normalize_query(t) for t in queries]
+        cached = [self.query_cache.get(key) for key in keys]
+        missing = list(dict.fromkeys(key for key, vec in zip(keys, cached) if vec is None))
+        if missing:
+            q = self._indexer.encode(
+                missing,
+                batch_size=min(self.encode_batch_size, len(missing)),
+                convert_to_tensor=True,
+                device=str(self.device),
+            )
+            if hasattr(q, "detach"):  # tensor (SentenceTransformer); proxy micro-batch trả sẵn numpy
+                q = q.detach().cpu().numpy()
+            q = np.asarray(q, dtype="float32")
+            if self.normalize:
+                q = self._l2_normalize(q)
+            encoded = {key: np.array(vec) for key, vec in zip(missing, q)}   # copy: không giữ cả ma trận lô
+            for key, vec in encoded.items():
+                vec.setflags(write=False)
+                self.query_cache.put(key, vec)
+            cached = [vec if vec is not None else encoded[key] for key, vec in zip(keys, cached)]
+        return np.ascontiguousarray(np.stack(cached), dtype="float32")
 
-        # 3. Search FAISS
-        scores, ids = faissIndex.search(q, k)
-        idx2text, idx2key = self._build_idx_maps(Mapping, MapData)
+    def _search_matrix(
+        self,
+        faissIndex: "faiss.Index",  # type: ignore
+        q: np.ndarray,
+        k: int,
+        nprobe: Optional[int] = None,
+        efSearch: Optional[int] = None,
+        selection: Optional[Faiss_Filter.Selection] = None,
+    ):
+        """
+        1 lần faissIndex.search trên cả ma trận query (index PCA/OPQ là IndexPreTransform → tự chiếu query).
+        selection: IDSelector đi trong SearchParameters → id bị loại không chiếm chỗ trong top-k.
+        """
+        if q.shape[1] != faissIndex.d:
+            raise ValueError(f"Query có {q.shape[1]} chiều nhưng index nhận {faissIndex.d} chiều (encoder khác lúc build?).")
+        params = Faiss_Embedding.search_params(
+            faissIndex,
+            nprobe=nprobe if nprobe is not None else self.nprobe,
+            efSearch=efSearch if efSearch is not None else self.efSearch,
+            sel=selection.selector if selection is not None else None,
+        )
+        if params is not None:
+            return faissIndex.search(q, k, params=params)
+        return faissIndex.search(q, k)
 
-        # 4. Mapping kết quả
+    def _rows_from_dicts(
+        self,
+        scores: np.ndarray,
+        ids: np.ndarray,
+        Mapping: Optional[Dict[str, Any]],
+        MapData: Optional[Dict[str, Any]],
+        MapChunk: Optional[Dict[str, Any]],
+    ) -> List[List[Dict[str, Any]]]:
+        """Đường cũ (Mapping / MapData / MapChunk JSON): dựng ánh xạ 1 lần cho cả ma trận kết quả."""
+        idx2text, idx2key = self._build_idx_maps(Mapping or {}, MapData or {})
         chunk_map = MapChunk.get("index_to_chunk", {}) if MapChunk else {}
-        results = []
-        for score, idx in zip(scores[0].tolist(), ids[0].tolist()):
-            chunk_ids = chunk_map.get(str(idx), [])
-            results.append({
-                "index": int(idx),
-                "key": idx2key.get(int(idx)),
-                "text": idx2text.get(int(idx)),
-                "faiss_score": float(score),
-                "chunk_ids": chunk_ids,
-            })
-        return results
+        rows = []
+        for row_scores, row_ids in zip(scores.tolist(), ids.tolist()):
+            results = []
+            for score, idx in zip(row_scores, row_ids):
+                if idx < 0:
+                    continue  # IVF/HNSW có thể trả ít hơn k kết quả
+                results.append({
+                    "index": int(idx),
+                    "key": idx2key.get(int(idx)),
+                    "text": idx2text.get(int(idx)),
+                    "faiss_score": float(score),
+                    "chunk_ids": chunk_map.get(str(idx), []),
+                })
+            rows.append(results)
+        return rows
 
     # ---------------------------
     # 2️⃣ RERANK: CrossEncoder rerank
@@ -112,9 +471,15 @@ class SemanticSearchEngine:
         results: List[Dict[str, Any]],
         top_k: Optional[int] = None,
         show_progress: bool = False,
+        context: Optional[SearchContext] = None,
+        stats: Optional[Dict[str, Any]] = None,
+        cascade: Optional[Faiss_Cascade.CascadePolicy] = None,
     ) -> List[Dict[str, Any]]:
         """
         Xếp hạng lại kết quả bằng CrossEncoder (nếu có).
+        context: nếu kết quả chỉ có "index" (không kèm text) → lấy text từ context.
+        stats: dict (tùy chọn) nhận thống kê của request (quyết định cascade, số cặp đã rerank).
+        cascade: chính sách cascade cho lời gọi này (None → self.cascade).
         Trả về danh sách top_k kết quả đã rerank.
         """
         if not results:
@@ -122,26 +487,107 @@ class SemanticSearchEngine:
         if self.reranker is None:
             raise ValueError("⚠️ Không có reranker được cung cấp khi khởi tạo.")
 
+        statsList: List[Dict[str, Any]] = []
+        reranked = self.rerank_many([query], [results], top_k=top_k, show_progress=show_progress,
+                                    context=context, stats=statsList, cascade=cascade)[0]
+        if stats is not None:
+            stats.update(statsList[0])
+        return reranked
+
+    def rerank_many(
+        self,
+        queries: List[str],
+        results_list: List[List[Dict[str, Any]]],
+        top_k: Optional[int] = None,
+        show_progress: bool = False,
+        context: Optional[SearchContext] = None,
+        stats: Optional[List[Dict[str, Any]]] = None,
+        cascade: Optional[Faiss_Cascade.CascadePolicy] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Như rerank() cho nhiều query: gom mọi cặp (query, passage) vào chung các batch
+        CrossEncoder (rerank_batch_size) → 1 lần predict cho cả lô, rồi tách về từng query.
+        Cặp đã có trong rerank_cache (cùng query, passage, nội dung index) không chạy lại.
+        cascade (None → self.cascade): chỉ rerank n ứng viên đầu theo cascade.score_key (n = 0 → giữ thứ tự search);
+        phần còn lại xếp sau theo thứ tự search. stats: list (tùy chọn) nhận thống kê từng query.
+        """
+        if len(queries) != len(results_list):
+            raise ValueError("queries và results_list phải cùng độ dài.")
+        if self.reranker is None and any(results_list):
+            raise ValueError("⚠️ Không có reranker được cung cấp khi khởi tạo.")
+
         k = int(top_k or self.rerank_k)
 
+        # Cascade: số ứng viên đầu (theo cascade.score_key) cần rerank cho từng query
+        policy = cascade if cascade is not None else self.cascade
+        plans = []      # (n, quyết định, vị trí các ứng viên được rerank)
+        for results in results_list:
+            results = results or []
+            scores = policy.scores_of(results) if policy is not None and policy.enabled and results else None
+            if scores is not None:
+                # Cascade xét theo thứ tự policy.score_key (faiss_score khi dense, fused_score khi hybrid);
+                # ứng viên thiếu score_key = -inf → không rerank, xếp sau
+                order = sorted(range(len(results)), key=lambda i: -scores[i])
+                n, decision = policy.decide(scores[order])
+                plans.append((n, decision, set(order[:n])))
+            else:
+                plans.append((len(results), "full", set(range(len(results)))))
+
+        # Cache score chỉ dùng khi có context (cần hash nội dung index để khoá theo index passage)
+        use_cache = self.rerank_cache.enabled and context is not None
+        # Reranker nhận PassageKey (TokenizedCrossEncoder) + context có token passage → không tokenize lại passage
+        use_tokens = (context is not None and context.passages is not None
+                      and getattr(self.reranker, "accepts_passage_keys", False))
         pairs = []
-        valid_indices = []
-        for i, r in enumerate(results):
-            text = r.get("text")
-            if isinstance(text, str) and text.strip():
-                pairs.append([query, text])
-                valid_indices.append(i)
-
-        if not pairs:
-            return []
+        owners = []     # (vị trí query, vị trí kết quả, khoá cache) của từng cặp cần chạy CrossEncoder
+        per_query = [{"candidates": len(r or []), "decision": d, "n_rerank": n, "reranked_pairs": 0, "cached_pairs": 0}
+                     for r, (n, d, _) in zip(results_list, plans)]
+        for qi, (query, results) in enumerate(zip(queries, results_list)):
+            qhash = Faiss_Cache.query_hash(query) if use_cache else None
+            for i, r in enumerate(results or []):
+                text = r.get("text")
+                if text is None and context is not None and "index" in r:
+                    text = r["text"] = context.store.text(int(r["index"]))
+                if i not in plans[qi][2] or not (isinstance(text, str) and text.strip()):
+                    continue
+                key = (qhash, int(r["index"]), context.content_hash) if use_cache and "index" in r else None
+                score = self.rerank_cache.get(key) if key is not None else None
+                if score is not None:
+                    r["rerank_score"] = score
+                    per_query[qi]["cached_pairs"] += 1
+                    continue
+                passage = text
+                if use_tokens and "index" in r:
+                    passage = Faiss_PassageTokens.PassageKey(context.passages, int(r["index"]), text)
+                pairs.append([query, passage])
+                owners.append((qi, i, key))
+                per_query[qi]["reranked_pairs"] += 1
 
-        scores = self.reranker.predict(
-            pairs, batch_size=self.rerank_batch_size, show_progress_bar=show_progress
-        )
+        if pairs:
+            scores = self.reranker.predict(
+                pairs, batch_size=self.rerank_batch_size, show_progress_bar=show_progress
+            )
+            for (qi, i, key), s in zip(owners, scores):
+                results_list[qi][i]["rerank_score"] = float(s)
+                if key is not None:
+                    self.rerank_cache.put(key, float(s))
 
-        for i, s in zip(valid_indices, scores):
-            results[i]["rerank_score"] = float(s)
+        out = []
+        for results, (_, _, head_pos) in zip(results_list, plans):
+            has_text = [r for r in (results or []) if isinstance(r.get("text"), str) and r["text"].strip()]
+            head = [r for i, r in enumerate(results or []) if i in head_pos and "rerank_score" in r]
+            head.sort(key=lambda x: x["rerank_score"], reverse=True)
+            in_head = {id(r) for r in head}
+            tail = [r for r in has_text if id(r) not in in_head]   # ngoài n ứng viên: giữ thứ tự search
+            out.append((head + tail)[:k])
 
-        reranked = [r for r in results if "rerank_score" in r]
-        reranked.sort(key=lambda x: x["rerank_score"], reverse=True)
-        return reranked[:k]
+        with self._rerank_lock:
+            self._rerank_stats["requests"] += len(per_query)
+            for st in per_query:
+                self._rerank_stats["candidates"] += st["candidates"]
+                self._rerank_stats["reranked_pairs"] += st["reranked_pairs"]
+                self._rerank_stats["cached_pairs"] += st["cached_pairs"]
+                self._rerank_stats[st["decision"]] += 1
+        if stats is not None:
+            stats.extend(per_query)
+        return out
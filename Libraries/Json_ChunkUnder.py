@@ -62,16 +62,21 @@ class ChunkUndertheseaBuilder:
     # ============================================================
     # 3️⃣ Lọc ý chính trước (EXTRACTIVE)
     # ============================================================
+    @staticmethod
+    def centrality(embeddings):
+        """Cosine của từng câu với vector trung bình (độ trọng tâm)."""
+        mean_vec = np.mean(embeddings, axis=0)
+        return np.dot(embeddings, mean_vec) / (
+            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(mean_vec)
+        )
+
     def _extractive_filter(self, sentences):
         """Chọn ra top-k câu đại diện nội dung nhất."""
         if len(sentences) <= 3:
             return sentences
 
         embeddings = self._encode(sentences)
-        mean_vec = np.mean(embeddings, axis=0)
-        sims = np.dot(embeddings, mean_vec) / (
-            np.linalg.norm(embeddings, axis=1) * np.linalg.norm(mean_vec)
-        )
+        sims = self.centrality(embeddings)
 
         # Chọn top-k câu có similarity cao nhất
         k = max(1, int(len(sentences) * self.key_sent_ratio))
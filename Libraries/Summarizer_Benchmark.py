@@ -0,0 +1,239 @@
+import time
+import torch
+import evaluate
+
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from . import Common_MyUtils as MyUtils
+
+
+@contextmanager
+def _count_forward(model) -> Iterator[Dict[str, int]]:
+    """Đếm số lần gọi forward (mỗi bước decode = 1 lần) của model."""
+    counter = {"calls": 0}
+
+    def _hook(module, args, output):
+        counter["calls"] += 1
+
+    handle = model.register_forward_hook(_hook)
+    try:
+        yield counter
+    finally:
+        handle.remove()
+
+
+class SummarizerBenchmark:
+    """
+    Đo chất lượng (ROUGE) và tốc độ (tokens/sec) của các biến thể summarizer
+    trên tập held-out JSONL (mỗi dòng: {input_column, target_column}).
+    """
+
+    def __init__(
+        self,
+        tokenizer,
+        DataPath: str,
+        input_column: str = "article",
+        target_column: str = "summary",
+        limit: Optional[int] = 50,
+        max_input_length: int = 1024,
+        max_length: int = 200,
+        min_length: int = 100,
+        num_beams: int = 4,
+    ):
+        self.tokenizer = tokenizer
+        self.DataPath = DataPath
+        self.input_column = input_column
+        self.target_column = target_column
+        self.limit = limit
+        self.max_input_length = max_input_length
+        self.max_length = max_length
+        self.min_length = min_length
+        self.num_beams = num_beams
+
+        self._rouge = evaluate.load("rouge")
+        self._records: Optional[List[Dict[str, Any]]] = None
+
+    # =========================================================
+    # 1️⃣  Đọc dữ liệu held-out
+    # =========================================================
+    def records(self) -> List[Dict[str, Any]]:
+        if self._records is None:
+            rows = MyUtils.read_jsonl(self.DataPath)
+            rows = [
+                r for r in rows
+                if isinstance(r.get(self.input_column), str) and isinstance(r.get(self.target_column), str)
+            ]
+            self._records = rows[: self.limit] if self.limit else rows
+        return self._records
+
+    # =========================================================
+    # 2️⃣  Sinh tóm tắt có đo thời gian
+    # =========================================================
+    def _generate_timed(self, model, device: Any, texts: List[str], **gen_kwargs) -> Dict[str, Any]:
+        kwargs = {
+            "max_length": self.max_length,
+            "min_length": self.min_length,
+            "num_beams": self.num_beams,
+            "no_repeat_ngram_size": 3,
+            "early_stopping": True,
+        }
+        kwargs.update(gen_kwargs)
+
+        preds: List[str] = []
+        new_tokens = 0
+        elapsed = 0.0
+        for text in texts:
+            inputs = self.tokenizer(
+                text, return_tensors="pt", truncation=True, max_length=self.max_input_length
+            ).to(device)
+            start = time.perf_counter()
+            with torch.no_grad():
+                out = model.generate(**inputs, **kwargs)
+            elapsed += time.perf_counter() - start
+            new_tokens += int(out.shape[-1]) - 1  # bỏ decoder_start_token
+            preds.append(self.tokenizer.decode(out[0], skip_special_tokens=True).strip())
+
+        return {
+            "predictions": preds,
+            "new_tokens": new_tokens,
+            "seconds": round(elapsed, 4),
+            "tokens_per_sec": round(new_tokens / elapsed, 2) if elapsed else 0.0,
+        }
+
+    def _rouge_scores(self, preds: List[str], refs: List[str]) -> Dict[str, float]:
+        result = self._rouge.compute(predictions=preds, references=refs, use_stemmer=True)
+        return {k: round(v * 100, 4) for k, v in result.items()}
+
+    def evaluate_model(self, model, device: Any = "cpu", **gen_kwargs) -> Dict[str, Any]:
+        """ROUGE + tokens/sec cho một model trên toàn bộ tập held-out."""
+        rows = self.records()
+        texts = [r[self.input_column] for r in rows]
+        refs = [r[self.target_column] for r in rows]
+        timed = self._generate_timed(model, device, texts, **gen_kwargs)
+        return {
+            "samples": len(rows),
+            "rouge": self._rouge_scores(timed["predictions"], refs),
+            "new_tokens": timed["new_tokens"],
+            "seconds": timed["seconds"],
+            "tokens_per_sec": timed["tokens_per_sec"],
+        }
+
+    # =========================================================
+    # 3️⃣  So sánh fp32 ↔ int8-dynamic
+    # =========================================================
+    def compare_quantization(
+        self,
+        fp32_model,
+        int8_model,
+        fp32_device: Any = "cpu",
+        ReportPath: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Báo cáo ROUGE và tokens/sec giữa bản fp32 và bản int8-dynamic.
+        Ghi JSON ra ReportPath nếu có.
+        """
+        fp32 = self.evaluate_model(fp32_model, fp32_device)
+        int8 = self.evaluate_model(int8_model, "cpu")
+
+        report = {
+            "data": self.DataPath,
+            "fp32": fp32,
+            "int8-dynamic": int8,
+            "speedup": round(int8["tokens_per_sec"] / fp32["tokens_per_sec"], 3) if fp32["tokens_per_sec"] else None,
+            "rouge_delta": {
+                k: round(int8["rouge"].get(k, 0.0) - v, 4) for k, v in fp32["rouge"].items()
+            },
+        }
+        if ReportPath:
+            MyUtils.write_json(report, ReportPath, indent=2)
+        return report
+
+    # =========================================================
+    # 4️⃣  Assisted (draft-model) decoding
+    # =========================================================
+    def benchmark_assisted(
+        self,
+        model,
+        draft_model,
+        device: Any = "cpu",
+        texts: Optional[List[str]] = None,
+        ReportPath: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        So sánh greedy ↔ assisted (cùng no_repeat_ngram/min/max length):
+          - tokens/sec của từng chế độ
+          - số mẫu có output khác nhau (kỳ vọng 0)
+          - acceptance rate = token draft được chấp nhận / token draft đề xuất
+        texts=None → dùng cột input của tập held-out (ví dụ merged_text từ tài liệu của ta).
+        """
+        texts = texts if texts is not None else [r[self.input_column] for r in self.records()]
+        greedy_kwargs = {"num_beams": 1, "do_sample": False, "early_stopping": False}
+
+        greedy = self._generate_timed(model, device, texts, **greedy_kwargs)
+        with _count_forward(model) as main_calls, _count_forward(draft_model) as draft_calls:
+            assisted = self._generate_timed(model, device, texts, assistant_model=draft_model, **greedy_kwargs)
+
+        # Mỗi bước verify của model chính sinh (số token chấp nhận + 1) token
+        accepted = max(0, assisted["new_tokens"] - main_calls["calls"])
+        proposed = draft_calls["calls"]
+        mismatches = sum(1 for a, b in zip(greedy["predictions"], assisted["predictions"]) if a != b)
+
+        report = {
+            "samples": len(texts),
+            "greedy_tokens_per_sec": greedy["tokens_per_sec"],
+            "assisted_tokens_per_sec": assisted["tokens_per_sec"],
+            "speedup": round(assisted["tokens_per_sec"] / greedy["tokens_per_sec"], 3) if greedy["tokens_per_sec"] else None,
+            "main_forward_calls": main_calls["calls"],
+            "draft_forward_calls": proposed,
+            "acceptance_rate": round(accepted / proposed, 4) if proposed else None,
+            "output_mismatches": mismatches,
+        }
+        if ReportPath:
+            MyUtils.write_json(report, ReportPath, indent=2)
+        return report
+
+    # =========================================================
+    # 5️⃣  Extractive ↔ Abstractive (độ trễ end-to-end)
+    # =========================================================
+    def benchmark_extractive(
+        self,
+        abstractive_engine,
+        extractive_engine,
+        texts: Optional[List[str]] = None,
+        ReportPath: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Độ trễ (giây/văn bản) của RecursiveSummarizer.summarize ↔ ExtractiveSummarizer.summarize
+        trên cùng tập văn bản; kèm ROUGE nếu dùng tập held-out.
+        """
+        rows = None if texts is not None else self.records()
+        texts = texts if texts is not None else [r[self.input_column] for r in rows]
+
+        def _run(engine) -> Dict[str, Any]:
+            preds, times = [], []
+            for text in texts:
+                start = time.perf_counter()
+                preds.append(engine.summarize(text).get("summary_text", ""))
+                times.append(time.perf_counter() - start)
+            times.sort()
+            out = {
+                "p50_sec": round(times[len(times) // 2], 4) if times else 0.0,
+                "max_sec": round(times[-1], 4) if times else 0.0,
+                "total_sec": round(sum(times), 4),
+            }
+            if rows is not None:
+                out["rouge"] = self._rouge_scores(preds, [r[self.target_column] for r in rows])
+            return out
+
+        abstractive = _run(abstractive_engine)
+        extractive = _run(extractive_engine)
+        report = {
+            "samples": len(texts),
+            "abstractive": abstractive,
+            "extractive": extractive,
+            "speedup_p50": round(abstractive["p50_sec"] / extractive["p50_sec"], 2) if extractive["p50_sec"] else None,
+        }
+        if ReportPath:
+            MyUtils.write_json(report, ReportPath, indent=2)
+        return report
@@ -0,0 +1,169 @@
+import numpy as np
+
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import Json_ChunkUnder
+
+
+class ExtractiveSummarizer:
+    """
+    Tóm tắt trích xuất (không cần seq2seq) — đường nhanh cho CPU:
+      1️⃣ Tách câu + encode bằng ChunkUndertheseaBuilder (dùng chung embedder)
+      2️⃣ Đồ thị cosine thưa (top-k láng giềng / ngưỡng) tính bằng NumPy
+      3️⃣ LexRank (PageRank có trọng số), teleport theo độ trọng tâm (centrality)
+      4️⃣ Chọn câu theo thứ hạng tới khi đủ ngân sách từ / token, giữ thứ tự gốc
+    """
+
+    def __init__(
+        self,
+        chunk_builder: Json_ChunkUnder.ChunkUndertheseaBuilder,
+        word_budget: int = 200,
+        tokenizer: Any = None,
+        token_budget: Optional[int] = None,
+        sim_threshold: float = 0.1,
+        knn: int = 20,
+        damping: float = 0.85,
+        max_iter: int = 100,
+        tol: float = 1e-6,
+        redundancy: float = 0.9,
+        block_size: int = 1024,
+    ):
+        """
+        chunk_builder: ChunkUndertheseaBuilder đã khởi tạo (tách câu + embedder).
+        word_budget: số từ tối đa của bản tóm tắt.
+        tokenizer / token_budget: nếu có cả hai → đo ngân sách theo token thay vì từ.
+        sim_threshold, knn: chỉ giữ cạnh có cosine >= ngưỡng và thuộc top-knn mỗi câu.
+        redundancy: bỏ câu có cosine > ngưỡng với câu đã chọn.
+        """
+        self.chunk_builder = chunk_builder
+        self.word_budget = int(word_budget)
+        self.tokenizer = tokenizer
+        self.token_budget = token_budget
+        self.sim_threshold = float(sim_threshold)
+        self.knn = int(knn)
+        self.damping = float(damping)
+        self.max_iter = int(max_iter)
+        self.tol = float(tol)
+        self.redundancy = float(redundancy)
+        self.block_size = int(block_size)
+
+    # ============================================================
+    # 1️⃣ Đồ thị cosine thưa
+    # ============================================================
+    @staticmethod
+    def _l2_normalize(mat: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(mat, axis=1, keepdims=True)
+        norms[norms == 0.0] = 1.0
+        return mat / norms
+
+    def _sparse_graph(self, emb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Trả về cạnh (rows, cols, weights) — tính theo block để không giữ ma trận N×N.
+        """
+        n = emb.shape[0]
+        k = min(self.knn, n - 1)
+        rows, cols, weights = [], [], []
+        for start in range(0, n, self.block_size):
+            stop = min(start + self.block_size, n)
+            sims = emb[start:stop] @ emb.T
+            sims[np.arange(stop - start), np.arange(start, stop)] = -1.0  # bỏ self-loop
+
+            nbr = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+            w = np.take_along_axis(sims, nbr, axis=1)
+            keep = w >= self.sim_threshold
+
+            r = np.repeat(np.arange(start, stop), k).reshape(-1, k)
+            rows.append(r[keep])
+            cols.append(nbr[keep])
+            weights.append(w[keep])
+
+        return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights).astype("float64")
+
+    # ============================================================
+    # 2️⃣ LexRank (power iteration trên cạnh thưa)
+    # ============================================================
+    def _lexrank(self, emb: np.ndarray, prior: np.ndarray) -> np.ndarray:
+        n = emb.shape[0]
+        if n == 1:
+            return np.ones(1)
+
+        p = np.clip(prior, 0.0, None)
+        p = p / p.sum() if p.sum() > 0 else np.full(n, 1.0 / n)
+
+        rows, cols, w = self._sparse_graph(emb)
+        if rows.size == 0:
+            # Không cặp câu nào đạt sim_threshold → mọi nút dangling, nghiệm dừng chính là prior
+            return p
+
+        # bincount với weights rỗng trả về int64 → ép float64 cho chắc
+        out_deg = np.bincount(rows, weights=w, minlength=n).astype("float64")
+        w_norm = w / np.where(out_deg[rows] > 0, out_deg[rows], 1.0)
+        dangling = out_deg == 0
+
+        r = np.full(n, 1.0 / n)
+        for _ in range(self.max_iter):
+            spread = np.bincount(cols, weights=w_norm * r[rows], minlength=n).astype("float64")
+            spread += r[dangling].sum() * p
+            r_new = (1.0 - self.damping) * p + self.damping * spread
+            if np.abs(r_new - r).sum() < self.tol:
+                r = r_new
+                break
+            r = r_new
+        return r
+
+    # ============================================================
+    # 3️⃣ Chọn câu theo ngân sách
+    # ============================================================
+    def _length(self, sentence: str) -> int:
+        if self.tokenizer is not None and self.token_budget:
+            return len(self.tokenizer.encode(sentence, add_special_tokens=False))
+        return len(sentence.split())
+
+    def _select(self, sentences: List[str], emb: np.ndarray, scores: np.ndarray, budget: int) -> List[int]:
+        chosen: List[int] = []
+        used = 0
+        for i in np.argsort(-scores):
+            length = self._length(sentences[i])
+            if used + length > budget:
+                if chosen:
+                    continue
+                # Câu đầu dài hơn ngân sách → vẫn lấy để không trả rỗng
+            if chosen and float(np.max(emb[chosen] @ emb[i])) > self.redundancy:
+                continue
+            chosen.append(int(i))
+            used += length
+            if used >= budget:
+                break
+        return sorted(chosen)
+
+    # ============================================================
+    # 4️⃣ Hàm chính cho người dùng
+    # ============================================================
+    def summarize(self, full_text: str, word_budget: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Cùng dạng kết quả với RecursiveSummarizer.summarize():
+        {summary_text, original_words, summary_words, compression_ratio}
+        """
+        if self.tokenizer is not None and self.token_budget:
+            budget = int(self.token_budget)
+        else:
+            budget = int(word_budget or self.word_budget)
+
+        original_len = len(full_text.split())
+        sentences = self.chunk_builder._split_sentences(full_text)
+        if not sentences:
+            summary = ""
+        else:
+            emb = self._l2_normalize(np.asarray(self.chunk_builder._encode(sentences), dtype="float32"))
+            prior = self.chunk_builder.centrality(emb)
+            scores = self._lexrank(emb, prior)
+            summary = " ".join(sentences[i] for i in self._select(sentences, emb, scores, budget))
+
+        summary_len = len(summary.split())
+        ratio = round(summary_len / original_len, 3) if original_len else 0
+        return {
+            "summary_text": summary,
+            "original_words": original_len,
+            "summary_words": summary_len,
+            "compression_ratio": ratio
+        }
@@ -1,10 +1,27 @@
 import torch
 
-from typing import Dict
+from typing import Any, Callable, Dict, Optional
+from transformers import TextStreamer
 
 from . import Json_ChunkUnder
 
 
+EventCallback = Callable[[Dict[str, Any]], None]
+DECODINGS = ("beam", "greedy", "assisted")
+
+
+class _CallbackStreamer(TextStreamer):
+    """TextStreamer đẩy từng đoạn text đã decode vào callback thay vì print."""
+
+    def __init__(self, tokenizer, on_text: Callable[[str], None]):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self._on_text = on_text
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self._on_text(text)
+
+
 class RecursiveSummarizer:
     """
     Bộ tóm tắt học thuật tiếng Việt theo hướng:
@@ -19,14 +36,21 @@ class RecursiveSummarizer:
         chunk_builder: Json_ChunkUnder.ChunkUndertheseaBuilder,
         max_length: int = 256,
         min_length: int = 64,
-        max_depth: int = 5
+        max_depth: int = 5,
+        decoding: str = "beam",
+        assistant_model: Optional[Any] = None,
     ):
         """
         tokenizer: AutoTokenizer đã load sẵn.
         summarizer: AutoModelForSeq2SeqLM (ViT5 / BartPho / mT5)
         sum_device: 'cuda' hoặc 'cpu'
         chunk_builder: ChunkUndertheseaBuilder instance.
+        decoding: "beam" (num_beams=4) | "greedy" | "assisted"
+        assistant_model: draft model (cùng tokenizer) cho decoding="assisted";
+            output giữ nguyên như greedy của model chính.
         """
+        self.assistant_model = assistant_model
+        self._check_decoding(decoding)
         self.tokenizer = tokenizer
         self.model = summarizer
         self.device = sum_device
@@ -34,14 +58,54 @@ class RecursiveSummarizer:
         self.max_length = max_length
         self.min_length = min_length
         self.max_depth = max_depth
+        self.decoding = decoding
+
+    def _check_decoding(self, decoding: str) -> None:
+        if decoding not in DECODINGS:
+            raise ValueError("decoding phải là 'beam', 'greedy' hoặc 'assisted'")
+        if decoding == "assisted" and self.assistant_model is None:
+            raise ValueError("decoding='assisted' cần truyền assistant_model")
+
+    @property
+    def stream_decoding(self) -> str:
+        """Decoding dùng khi stream token: beam search không chạy streamer → greedy."""
+        return "greedy" if self.decoding == "beam" else self.decoding
+
+    def _generation_kwargs(self, decoding: Optional[str] = None) -> Dict[str, Any]:
+        """Tham số generate theo chế độ decoding (mặc định self.decoding)."""
+        decoding = decoding or self.decoding
+        kwargs: Dict[str, Any] = {
+            "max_length": self.max_length,
+            "min_length": self.min_length,
+            "no_repeat_ngram_size": 3,
+        }
+        if decoding == "beam":
+            kwargs.update(num_beams=4, early_stopping=True)
+        else:
+            kwargs.update(num_beams=1, do_sample=False)
+            if decoding == "assisted":
+                kwargs["assistant_model"] = self.assistant_model
+        return kwargs
 
     # ============================================================
     # 1️⃣ Hàm tóm tắt 1 đoạn
     # ============================================================
-    def summarize_single(self, text: str) -> str:
+    def summarize_single(
+        self,
+        text: str,
+        on_token: Optional[Callable[[str], None]] = None,
+        decoding: Optional[str] = None,
+    ) -> str:
         """
         Tóm tắt 1 đoạn đơn bằng mô hình abstractive (ViT5/BartPho).
+        on_token: nhận từng đoạn text khi sinh; cần decoding greedy/assisted
+            (beam search không hỗ trợ streamer → ValueError).
+        decoding: ghi đè self.decoding cho lần gọi này.
         """
+        decoding = decoding or self.decoding
+        self._check_decoding(decoding)
+        if on_token is not None and decoding == "beam":
+            raise ValueError("Beam search không stream được token; dùng decoding='greedy' hoặc 'assisted'.")
         if not text or len(text.strip()) == 0:
             return ""
 
@@ -58,15 +122,12 @@ class RecursiveSummarizer:
                 max_length=1024
             ).to(self.device)
 
+            gen_kwargs = self._generation_kwargs(decoding)
+            if on_token is not None:
+                gen_kwargs["streamer"] = _CallbackStreamer(self.tokenizer, on_token)
+
             with torch.no_grad():
-                summary_ids = self.model.generate(
-                    **inputs,
-                    max_length=self.max_length,
-                    min_length=self.min_length,
-                    num_beams=4,
-                    no_repeat_ngram_size=3,
-                    early_stopping=True
-                )
+                summary_ids = self.model.generate(**inputs, **gen_kwargs)
 
             summary = self.tokenizer.decode(summary_ids[0], skip_special_tokens=True)
             return summary.strip()
@@ -93,24 +154,51 @@ class RecursiveSummarizer:
     # ============================================================
     # 2️⃣ Đệ quy tóm tắt văn bản dài
     # ============================================================
-    def summarize_recursive(self, text: str, depth: int = 0, minInput: int = 256, maxInput: int = 1024) -> str:
+    @staticmethod
+    def _token_callback(on_event: Optional[EventCallback], level: int, index: Any) -> Optional[Callable[[str], None]]:
+        if on_event is None:
+            return None
+        return lambda t: on_event({"event": "token", "level": level, "index": index, "text": t})
+
+    def summarize_recursive(
+        self,
+        text: str,
+        depth: int = 0,
+        minInput: int = 256,
+        maxInput: int = 1024,
+        on_event: Optional[EventCallback] = None,
+        decoding: Optional[str] = None,
+    ) -> str:
         """
         Đệ quy tóm tắt văn bản dài:
         - <256 từ: giữ nguyên
         - <1024 từ: tóm tắt trực tiếp
         - >=1024 từ: chia chunk + tóm tắt từng phần → gộp → đệ quy
+        on_event: nhận các sự kiện tiến độ
+            {"event": "level", "level", "words"}
+            {"event": "chunk", "level", "index", "summary"}
+            {"event": "token", "level", "index", "text"} — chỉ cho chunk chắc chắn thuộc kết quả cuối
+              (bản gộp không thể vượt 1024 từ → không đệ quy nữa); chunk trung gian chỉ có "chunk".
+        decoding: ghi đè self.decoding; có on_event thì không được là "beam".
         """
+        decoding = decoding or self.decoding
+        if on_event is not None and decoding == "beam":
+            raise ValueError("Stream tóm tắt cần decoding 'greedy' hoặc 'assisted' (beam search không stream được token).")
         word_count = len(text.split())
         indent = "  " * depth
         print(f"{indent}🔹 Level {depth}: {word_count} từ")
+        if on_event:
+            on_event({"event": "level", "level": depth, "words": word_count})
 
         # 1️⃣ Văn bản ngắn
         if word_count < minInput:
-            return self.summarize_single(text)
+            return self.summarize_single(text, on_token=self._token_callback(on_event, depth, 0), decoding=decoding)
 
         else:
             chunks = self.chunk_builder.build(text)
             summaries = []
+            remaining = sum(1 for item in chunks if len(item.get("Content", "").split()) >= 20)
+            done_words = 0
 
             for item in chunks:
                 content = item.get("Content", "")
@@ -123,9 +211,18 @@ class RecursiveSummarizer:
                     continue
 
                 print(f"{indent}🔸 Chunk {idx}: {wc} từ")
-                sub_summary = self.summarize_single(content)
+                # Chắc chắn là level cuối: hết độ sâu, hoặc số từ đã có + mỗi chunk còn lại tối đa
+                # max_length token (≥ số từ) vẫn ≤ 1024 → chỉ khi đó mới stream token
+                final = depth >= self.max_depth or done_words + remaining * self.max_length <= 1024
+                sub_summary = self.summarize_single(
+                    content, on_token=self._token_callback(on_event if final else None, depth, idx), decoding=decoding
+                )
+                remaining -= 1
+                done_words += len(sub_summary.split())
                 if sub_summary:
                     summaries.append(sub_summary)
+                if on_event:
+                    on_event({"event": "chunk", "level": depth, "index": idx, "summary": sub_summary})
 
             merged_summary = "\n".join(summaries)
             merged_len = len(merged_summary.split())
@@ -133,22 +230,31 @@ class RecursiveSummarizer:
 
             # Đệ quy nếu vẫn dài
             if merged_len > 1024 and depth < self.max_depth:
-                return self.summarize_recursive(merged_summary, depth + 1)
+                return self.summarize_recursive(merged_summary, depth + 1, on_event=on_event, decoding=decoding)
             else:
                 return merged_summary
 
     # ============================================================
     # 3️⃣ Hàm chính cho người dùng
     # ============================================================
-    def summarize(self, full_text: str, minInput: int = 256, maxInput: int = 1024) -> Dict[str, str]:
+    def summarize(
+        self,
+        full_text: str,
+        minInput: int = 256,
+        maxInput: int = 1024,
+        on_event: Optional[EventCallback] = None,
+        decoding: Optional[str] = None,
+    ) -> Dict[str, str]:
         """
         Giao diện chính:
         - Nhận text dài
         - Tự động chia chunk, tóm tắt, gộp
         - Trả về dict gồm summary và thống kê
+        - on_event (tùy chọn): stream tiến độ theo level/chunk/token (xem summarize_recursive);
+          cần decoding greedy/assisted, vd. decoding=self.stream_decoding
         """
         original_len = len(full_text.split())
-        summary = self.summarize_recursive(full_text, depth = 0, minInput = minInput, maxInput = maxInput)
+        summary = self.summarize_recursive(full_text, depth = 0, minInput = minInput, maxInput = maxInput, on_event = on_event, decoding = decoding)
 
         summary_len = len(summary.split())
         ratio = round(summary_len / original_len, 3) if original_len else 0
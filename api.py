@@ -3,11 +3,14 @@ FastAPI gateway cho appFinal.py.
 """
 
 import os
+import json
 import time
-from typing import Optional, List
+import asyncio
+from typing import Any, Callable, Dict, Optional, List
 
 from fastapi import FastAPI, UploadFile, File, HTTPException, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
 # -------------------------
@@ -58,6 +61,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Micro-batching encode / rerank giữa các request đồng thời (MICRO_BATCHING=0 để tắt)
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "1").strip() != "0"
+if APP_CALLED and MICRO_BATCHING:
+    APP_CALLED.enableMicroBatching(
+        max_wait_ms=float(os.getenv("BATCH_WAIT_MS", APP_CALLED.BATCH_WAIT_MS)),
+        max_encode=int(os.getenv("BATCH_MAX_ENCODE", APP_CALLED.BATCH_MAX_ENCODE)),
+        max_rerank=int(os.getenv("BATCH_MAX_RERANK", APP_CALLED.BATCH_MAX_RERANK)),
+    )
+
+# -------------------------
+# 📡 Server-Sent Events helpers
+# -------------------------
+def _sse(event: Dict[str, Any]) -> str:
+    """Định dạng 1 sự kiện SSE: `event: <tên>` + `data: <json>`."""
+    name = event.get("event", "message")
+    return f"event: {name}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _sse_response(job: Callable[[Callable[[Dict[str, Any]], None]], Dict[str, Any]]) -> StreamingResponse:
+    """
+    Chạy job(emit) trong thread pool; mỗi emit(event) được đẩy ngay ra client.
+    Sự kiện "start" gửi trước khi job chạy → time-to-first-byte gần như tức thì.
+    Kết thúc bằng "result" (payload job trả về) hoặc "error".
+    """
+    async def _stream():
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+
+        def emit(event: Optional[Dict[str, Any]]) -> None:
+            loop.call_soon_threadsafe(queue.put_nowait, event)
+
+        def runner() -> None:
+            try:
+                result = job(emit)
+                emit({"event": "result", **(result or {})})
+            except Exception as e:
+                print(f"Lỗi stream: {e}")
+                emit({"event": "error", "detail": str(e)})
+            finally:
+                emit(None)
+
+        yield _sse({"event": "start", "time": time.time()})
+        worker = loop.run_in_executor(None, runner)
+        while True:
+            event = await queue.get()
+            if event is None:
+                break
+            yield _sse(event)
+        await worker
+
+    return StreamingResponse(
+        _stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # -------------------------
 # 🏠 Root endpoint
 # -------------------------
@@ -82,8 +141,33 @@ def health(_=Depends(require_bearer)):
         "status": "ok",
         "time": time.time(),
         "appFinal_loaded": app_ok,
-        "main_index_loaded": bool(APP_CALLED.g_FaissIndex) if app_ok else False,
-        "service_index_loaded": bool(APP_CALLED.g_serviceFaissIndex) if app_ok else False,
+        "main_index_loaded": bool(APP_CALLED.currentIndex(APP_CALLED.g_mainRegistry)) if app_ok else False,
+        "service_index_loaded": bool(APP_CALLED.currentIndex(APP_CALLED.g_serviceRegistry)) if app_ok else False,
+    }
+
+# -------------------------
+# 🗂️ /index_versions
+# -------------------------
+@app.get("/index_versions")
+def index_versions(_=Depends(require_bearer)):
+    """Phiên bản index đang phục vụ + thời gian nạp / RSS của từng phiên bản."""
+    if not APP_CALLED:
+        raise HTTPException(status_code=500, detail="appFinal chưa được tải.")
+    return APP_CALLED.indexVersions()
+
+# -------------------------
+# 📊 /metrics
+# -------------------------
+@app.get("/metrics")
+def metrics(_=Depends(require_bearer)):
+    """Thống kê phục vụ: micro-batching (queue depth, kích thước lô, thời gian chờ / chạy), hit ratio cache, cascade rerank."""
+    if not APP_CALLED:
+        raise HTTPException(status_code=500, detail="appFinal chưa được tải.")
+    return {
+        "time": time.time(),
+        "batching": APP_CALLED.batchingMetrics(),
+        "cache": APP_CALLED.cacheMetrics(),
+        "rerank": APP_CALLED.rerankMetrics(),
     }
 
 # -------------------------
@@ -113,12 +197,47 @@ async def process_pdf(file: UploadFile = File(...), _=Depends(require_bearer)):
         print(f"Lỗi /process_pdf: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi xử lý PDF: {str(e)}")
 
+# -------------------------
+# 📡 /process_pdf_stream (SSE)
+# -------------------------
+@app.post("/process_pdf_stream")
+async def process_pdf_stream(file: UploadFile = File(...), _=Depends(require_bearer)):
+    """Như /process_pdf nhưng stream tiến độ (stage, level, chunk, token) qua SSE."""
+    if not file.filename.lower().endswith(".pdf"):
+        raise HTTPException(status_code=400, detail="Chỉ chấp nhận file PDF.")
+
+    pdf_bytes = await file.read()
+
+    if not APP_CALLED or not hasattr(APP_CALLED, "process_pdf_pipeline"):
+        raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.process_pdf_pipeline().")
+
+    def job(emit):
+        result = APP_CALLED.process_pdf_pipeline(pdf_bytes, on_event=emit)
+        return {
+            "status": "success",
+            "checkstatus": result.get("checkstatus"),
+            "summary": result.get("summary"),
+            "category": result.get("category"),
+        }
+
+    return _sse_response(job)
+
 # -------------------------
 # 🔍 /search
 # -------------------------
 class SearchIn(BaseModel):
     query: str
     k: int = 1
+    filters: Optional[Dict[str, Any]] = None   # {"base_keys": [...], "chunk_range": [lo, hi], "chunk_ids": [...], "ids": [...]}
+
+def _parse_filters(filters: Optional[Dict[str, Any]]):
+    """Kiểm tra điều kiện lọc trước khi search (sai định dạng → 400 thay vì 500)."""
+    if not filters:
+        return None
+    try:
+        return APP_CALLED.parseSearchFilter(filters)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"filters không hợp lệ: {e}")
 
 @app.post("/search", response_model=List[dict])
 def search(body: SearchIn, _=Depends(require_bearer)):
@@ -129,24 +248,52 @@ def search(body: SearchIn, _=Depends(require_bearer)):
 
     if not APP_CALLED or not hasattr(APP_CALLED, "search_pipeline"):
         raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.search_pipeline().")
+    filters = _parse_filters(body.filters)
 
     try:
         # Gọi hàm pipeline (hàm này giờ trả về List[dict])
-        results = APP_CALLED.search_pipeline(q, k=body.k)
+        results = APP_CALLED.search_pipeline(q, k=body.k, filters=filters)
         return results # Trả về list các đối tượng chunk
     except Exception as e:
         print(f"Lỗi /search: {e}")
         raise HTTPException(status_code=500, detail=f"Lỗi tìm kiếm: {str(e)}")
 
+# -------------------------
+# 🔍 /search_batch
+# -------------------------
+class SearchBatchIn(BaseModel):
+    queries: List[str]
+    k: int = 1
+    filters: Optional[Dict[str, Any]] = None   # áp dụng chung cho mọi query
+
+@app.post("/search_batch", response_model=List[List[dict]])
+def search_batch(body: SearchBatchIn, _=Depends(require_bearer)):
+    """Tìm kiếm nhiều query 1 lần (encode theo batch, 1 lần FAISS search, rerank chung batch)."""
+    queries = [(q or "").strip() for q in body.queries]
+    if not queries or not all(queries):
+        raise HTTPException(status_code=400, detail="queries không được rỗng hoặc chứa query trống")
+
+    if not APP_CALLED or not hasattr(APP_CALLED, "search_batch_pipeline"):
+        raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.search_batch_pipeline().")
+    filters = _parse_filters(body.filters)
+
+    try:
+        return APP_CALLED.search_batch_pipeline(queries, k=body.k, filters=filters)
+    except Exception as e:
+        print(f"Lỗi /search_batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Lỗi tìm kiếm: {str(e)}")
+
 # -------------------------
 # 🧠 /summarize
 # -------------------------
 class SummIn(BaseModel):
     text: str
+    mode: str = "abstractive"  # "abstractive" | "extractive"
     minInput: int = 256
     maxInput: int = 1024
     minLength: int = 100
     maxLength: int = 200
+    wordBudget: int = 200      # chỉ dùng cho mode="extractive"
 
 @app.post("/summarize")
 def summarize_text(body: SummIn, _=Depends(require_bearer)):
@@ -159,6 +306,19 @@ def summarize_text(body: SummIn, _=Depends(require_bearer)):
     if not APP_CALLED or not hasattr(APP_CALLED, "summaryEngine"):
         raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.summaryEngine.")
 
+    if body.mode not in ("abstractive", "extractive"):
+        raise HTTPException(status_code=400, detail="mode phải là 'abstractive' hoặc 'extractive'")
+
+    if body.mode == "extractive":
+        if not hasattr(APP_CALLED, "extractiveEngine"):
+            raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.extractiveEngine.")
+        try:
+            summarized = APP_CALLED.extractiveEngine.summarize(text, word_budget=body.wordBudget)
+            return {"status": "success", "mode": "extractive", "summary": summarized.get("summary_text", "")}
+        except Exception as e:
+            print(f"Lỗi /summarize (extractive): {e}")
+            raise HTTPException(status_code=500, detail=f"Lỗi tóm tắt: {str(e)}")
+
     try:
         # Gọi thẳng vào đối tượng summaryEngine
         summarized = APP_CALLED.summaryEngine.summarize(
@@ -171,4 +331,45 @@ def summarize_text(body: SummIn, _=Depends(require_bearer)):
         return {"status": "success", "summary": summarized.get("summary_text", "")}
     except Exception as e:
         print(f"Lỗi /summarize: {e}")
-        raise HTTPException(status_code=500, detail=f"Lỗi tóm tắt: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Lỗi tóm tắt: {str(e)}")
+
+# -------------------------
+# 📡 /summarize_stream (SSE)
+# -------------------------
+@app.post("/summarize_stream")
+def summarize_stream(body: SummIn, _=Depends(require_bearer)):
+    """
+    Như /summarize nhưng stream qua SSE. abstractive: level/chunk + token của level cuối
+    (decoding greedy / assisted thay cho beam); extractive: không sinh token → chỉ có "result".
+    """
+    text = (body.text or "").strip()
+    if not text:
+        raise HTTPException(status_code=400, detail="text không được để trống")
+
+    if not APP_CALLED or not hasattr(APP_CALLED, "summaryEngine"):
+        raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.summaryEngine.")
+
+    if body.mode not in ("abstractive", "extractive"):
+        raise HTTPException(status_code=400, detail="mode phải là 'abstractive' hoặc 'extractive'")
+
+    if body.mode == "extractive":
+        if not hasattr(APP_CALLED, "extractiveEngine"):
+            raise HTTPException(status_code=500, detail="Không tìm thấy appFinal.extractiveEngine.")
+
+        def job(emit):
+            summarized = APP_CALLED.extractiveEngine.summarize(text, word_budget=body.wordBudget)
+            return {"status": "success", "mode": "extractive", "summary": summarized.get("summary_text", "")}
+
+        return _sse_response(job)
+
+    def job(emit):
+        summarized = APP_CALLED.summaryEngine.summarize(
+            text,
+            minInput=body.minInput,
+            maxInput=body.maxInput,
+            on_event=emit,
+            decoding=APP_CALLED.summaryEngine.stream_decoding
+        )
+        return {"status": "success", "mode": "abstractive", "summary": summarized.get("summary_text", "")}
+
+    return _sse_response(job)
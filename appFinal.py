@@ -1,15 +1,13 @@
 import faiss
 import fitz
 
-from sentence_transformers import CrossEncoder
-
 from Config import Configs
 from Config import ModelLoader as ML
 from Libraries import Common_MyUtils as MU, Common_TextProcess as TP, Common_PdfProcess as PP
 from Libraries import PDF_QualityCheck as QualityCheck, PDF_ExtractData as ExtractData, PDF_MergeData as MergeData
 from Libraries import Json_ChunkUnder as ChunkUnder, Json_GetStructures as GetStructures, Json_ChunkMaster as ChunkMaster, Json_SchemaExt as SchemaExt
-from Libraries import Faiss_Embedding as F_Embedding, Faiss_Searching as F_Searching, Faiss_ChunkMapping as ChunkMapper
-from Libraries import Summarizer_Runner as SummaryRun
+from Libraries import Faiss_Embedding as F_Embedding, Faiss_Searching as F_Searching, Faiss_ChunkMapping as ChunkMapper, Faiss_MapStore as F_MapStore, Faiss_Registry as F_Registry, Faiss_MicroBatch as F_MicroBatch, Faiss_Cascade as F_Cascade, Faiss_Lexical as F_Lexical, Faiss_Filter as F_Filter, Faiss_PassageTokens as F_PassageTokens
+from Libraries import Summarizer_Runner as SummaryRun, Summarizer_Extractive as SummaryExt
 
 
 ## ==============================
@@ -25,6 +23,19 @@ JsonField = "Text"
 MODEL_DIR = "Models"
 MODEL_SUMARY = "Summarizer"
 MODEL_ENCODE = "Sentence_Transformer"
+MODEL_RERANK = "Cross_Encoder"
+MODEL_BACKEND = "torch"     # "torch" | "onnx" (ONNX Runtime on CPU)
+SUMARY_QUANTIZE = None      # None | "int8-dynamic" (CPU-only nodes, torch backend)
+INDEX_WORKERS = 1           # >1 → encode đa tiến trình khi build index (CPU)
+INDEX_WATCH_SEC = 10.0      # chu kỳ kiểm tra phiên bản index mới (*_Versions)
+BATCH_WAIT_MS = 5.0         # micro-batching (api.py): thời gian gom request tối đa
+BATCH_MAX_ENCODE = 64       # số query tối đa / lô encode
+BATCH_MAX_RERANK = 256      # số cặp (query, passage) tối đa / lô CrossEncoder
+QUERY_CACHE_SIZE = 4096     # cache query → embedding (0 = tắt)
+RERANK_CACHE_SIZE = 65536   # cache (query, passage, index) → rerank score (0 = tắt)
+CACHE_TTL_SEC = 3600.0
+RERANK_PRETOKENIZED = True  # CrossEncoder dùng token passage dựng sẵn (*_Passages), chỉ tokenize query
+CHUNK_AGG = "max"           # xếp hạng chunk theo điểm gộp các hit: None (thứ tự xuất hiện) | "max" | "sum" | "softmax"
 
 
 #### LOAD CONFIG
@@ -45,6 +56,11 @@ MappingPath = config["MappingPath"]
 MapDataPath = config["MapDataPath"]
 MapChunkPath = config["MapChunkPath"]
 MetaPath = config["MetaPath"]
+MapStorePath = config["MapStorePath"]
+VersionsPath = config["VersionsPath"]
+LexicalPath = config["LexicalPath"]
+PassagesPath = config["PassagesPath"]
+CascadePath = config["CascadePath"]
 
 serviceSegmentPath = config["serviceSegmentPath"]
 serviceFaissPath = config["serviceFaissPath"]
@@ -52,20 +68,31 @@ serviceMappingPath = config["serviceMappingPath"]
 serviceMapDataPath = config["serviceMapDataPath"]
 serviceMapChunkPath = config["serviceMapChunkPath"]
 serviceMetaPath = config["serviceMetaPath"]
+serviceMapStorePath = config["serviceMapStorePath"]
+serviceVersionsPath = config["serviceVersionsPath"]
+serviceLexicalPath = config["serviceLexicalPath"]
+servicePassagesPath = config["servicePassagesPath"]
 
 DATA_KEY = config["DATA_KEY"]
 EMBE_KEY = config["EMBE_KEY"]
 SEARCH_EGINE = config["SEARCH_EGINE"]
+SEARCH_STORE = config["SEARCH_STORE"]
+SEARCH_REDUCE = config["SEARCH_REDUCE"]
+SEARCH_REDUCE_DIM = config["SEARCH_REDUCE_DIM"]
+SEARCH_HYBRID = config["SEARCH_HYBRID"]
 RERANK_MODEL = config["RERANK_MODEL"]
 RESPON_MODEL = config["RESPON_MODEL"]
 EMBEDD_MODEL = config["EMBEDD_MODEL"]
 CHUNKS_MODEL = config["CHUNKS_MODEL"]
 SUMARY_MODEL = config["SUMARY_MODEL"]
+SUMARY_DRAFT = config["SUMARY_DRAFT"]
 WORD_LIMIT = config["WORD_LIMIT"]
 
 EMBEDD_CACHED_MODEL = f"{MODEL_DIR}/{MODEL_ENCODE}/{EMBEDD_MODEL}"
 CHUNKS_CACHED_MODEL = F"{MODEL_DIR}/{MODEL_ENCODE}/{CHUNKS_MODEL}"
 SUMARY_CACHED_MODEL = f"{MODEL_DIR}/{MODEL_SUMARY}/{SUMARY_MODEL}"
+RERANK_CACHED_MODEL = f"{MODEL_DIR}/{MODEL_RERANK}/{RERANK_MODEL}"
+DRAFT_CACHED_MODEL = f"{MODEL_DIR}/{MODEL_SUMARY}/{SUMARY_DRAFT}" if SUMARY_DRAFT else None
 
 MAX_INPUT = 1024
 MAX_TARGET = 256
@@ -112,10 +139,26 @@ Loader = ML.ModelLoader()
 
 
 #### LOAD MODELS
-indexer, embeddDevice = Loader.load_encoder(EMBEDD_MODEL, EMBEDD_CACHED_MODEL)
-chunker, chunksDevice = Loader.load_encoder(CHUNKS_MODEL, CHUNKS_CACHED_MODEL)
-
-tokenizer, summarizer, summaryDevice = Loader.load_summarizer(SUMARY_MODEL, SUMARY_CACHED_MODEL)
+indexer, embeddDevice = Loader.load_encoder(EMBEDD_MODEL, EMBEDD_CACHED_MODEL, backend=MODEL_BACKEND)
+chunker, chunksDevice = Loader.load_encoder(CHUNKS_MODEL, CHUNKS_CACHED_MODEL, backend=MODEL_BACKEND)
+reranker, rerankDevice = Loader.load_reranker(RERANK_MODEL, RERANK_CACHED_MODEL, backend=MODEL_BACKEND)
+
+# Reranker ghép cặp từ token passage dựng sẵn; tokenizer không ghép cặp kiểu nối chuỗi → giữ model gốc
+rerankTokens = None
+if RERANK_PRETOKENIZED:
+    try:
+        rerankTokens = F_PassageTokens.TokenizedCrossEncoder(reranker, batch_size=16)
+    except Exception as e:
+        print(f"⚠️ Không bật được token passage dựng sẵn cho reranker: {e}")
+
+tokenizer, summarizer, summaryDevice = Loader.load_summarizer(
+    SUMARY_MODEL, SUMARY_CACHED_MODEL,
+    quantize=SUMARY_QUANTIZE if MODEL_BACKEND == "torch" else None,
+    backend=MODEL_BACKEND
+)
+draftSummarizer = None
+if SUMARY_DRAFT and MODEL_BACKEND == "torch" and not SUMARY_QUANTIZE:
+    draftSummarizer, _ = Loader.load_draft_summarizer(SUMARY_DRAFT, DRAFT_CACHED_MODEL)
 
 
 
@@ -156,12 +199,21 @@ faissIndexer = F_Embedding.DirectFaissIndexer(
     device=str(embeddDevice),
     batch_size=32,
     show_progress=True,
+    num_workers=INDEX_WORKERS,
+    worker_threads=1,
+    encoder_path=EMBEDD_CACHED_MODEL,
+    encoder_backend=MODEL_BACKEND,
     flatten_mode="split",
     join_sep="\n",
     allowed_schema_types=("string", "array", "dict"),
     max_chars_per_text=2000,
     normalize=True,
-    verbose=False
+    verbose=False,
+    id_map=True,
+    index_type=SEARCH_EGINE,
+    storage=SEARCH_STORE,
+    reduce=SEARCH_REDUCE,
+    reduce_dim=SEARCH_REDUCE_DIM
 )
 
 
@@ -184,22 +236,88 @@ summaryEngine = SummaryRun.RecursiveSummarizer(
     chunk_builder=chunkUnder,
     max_length=200,
     min_length=100,
-    max_depth=4
+    max_depth=4,
+    decoding="assisted" if draftSummarizer is not None else "beam",
+    assistant_model=draftSummarizer
+)
+
+extractiveEngine = SummaryExt.ExtractiveSummarizer(
+    chunk_builder=chunkUnder,
+    word_budget=200,
+    sim_threshold=0.1,
+    knn=20
 )
 
 
 #### SEARCHER
-reranker = CrossEncoder(RERANK_MODEL, device=str(embeddDevice))
 searchEngine = F_Searching.SemanticSearchEngine(
     indexer=indexer,
-    reranker=reranker,
+    reranker=rerankTokens or reranker,
     device=str(embeddDevice),
     normalize=True,
     top_k=20,
     rerank_k=10,
-    rerank_batch_size=16
+    rerank_batch_size=16,
+    query_cache_size=QUERY_CACHE_SIZE,
+    rerank_cache_size=RERANK_CACHE_SIZE,
+    cache_ttl_sec=CACHE_TTL_SEC,
+    hybrid=SEARCH_HYBRID,
+    rrf_k=60
 )
 
+# Cascade rerank cho index chính (ngưỡng hiệu chỉnh bằng: python -m Libraries.Faiss_Cascade --queries ...);
+# chưa có file → luôn rerank toàn bộ. Không áp cho index 'Categories' (phân bố score khác).
+searchCascade = F_Cascade.CascadePolicy.load(CascadePath)
+if searchCascade.enabled and searchCascade.score_key != ("faiss_score" if SEARCH_HYBRID in (None, "dense") else "fused_score"):
+    print(f"⚠️ Cascade hiệu chỉnh theo {searchCascade.score_key}, khác chế độ SEARCH_HYBRID={SEARCH_HYBRID} "
+          f"→ chạy lại python -m Libraries.Faiss_Cascade để ngưỡng khớp tập ứng viên đang phục vụ.")
+
+
+def enableMicroBatching(max_wait_ms=BATCH_WAIT_MS, max_encode=BATCH_MAX_ENCODE, max_rerank=BATCH_MAX_RERANK):
+    """
+    Gom encode / rerank của các request đồng thời thành lô chung (gọi 1 lần khi khởi động server).
+    Chỉ bọc model của searchEngine; indexer / chunker dùng model gốc.
+    """
+    if not isinstance(searchEngine._indexer, F_MicroBatch.BatchedEncoder):
+        searchEngine._indexer = F_MicroBatch.BatchedEncoder(
+            searchEngine._indexer, max_batch=max_encode, max_wait_ms=max_wait_ms, device=str(embeddDevice),
+            batch_size=min(max_encode, searchEngine.encode_batch_size)
+        )
+    if searchEngine.reranker is not None and not isinstance(searchEngine.reranker, F_MicroBatch.BatchedReranker):
+        searchEngine.reranker = F_MicroBatch.BatchedReranker(
+            searchEngine.reranker, max_batch=max_rerank, max_wait_ms=max_wait_ms, batch_size=32
+        )
+
+
+def onIndexSwap(old, new):
+    """Registry swap phiên bản → bỏ cache của nội dung cũ (nội dung không đổi thì giữ)."""
+    if old is None or old.context is None:
+        return
+    if new.context is None or new.context.content_hash != old.context.content_hash:
+        searchEngine.invalidate_caches(old.context.content_hash)
+
+
+def rerankMetrics():
+    """Thống kê cascade rerank: số request full / shrink / skip, số cặp CrossEncoder thực chạy (+ cache token passage)."""
+    metrics = searchEngine.rerank_metrics()
+    if rerankTokens is not None:
+        metrics["passage_tokens"] = rerankTokens.metrics()
+    return metrics
+
+
+def cacheMetrics():
+    """Hit ratio / kích thước cache embedding query và score rerank."""
+    return searchEngine.cache_metrics()
+
+
+def batchingMetrics():
+    """Thống kê micro-batching (độ sâu hàng đợi, kích thước lô, thời gian chờ / chạy)."""
+    return {
+        name: model.batcher.metrics()
+        for name, model in (("encoder", searchEngine._indexer), ("reranker", searchEngine.reranker))
+        if isinstance(model, (F_MicroBatch.BatchedEncoder, F_MicroBatch.BatchedReranker))
+    }
+
 
 
 
@@ -301,8 +419,12 @@ def mergebyText(RawDataDict):
 
 
 #### SUMMARIZER
-def summaryRun(merged_text):
-    summarized = summaryEngine.summarize(merged_text, minInput = 256, maxInput = 1024)
+def summaryRun(merged_text, mode="abstractive", on_event=None):
+    if mode == "extractive":
+        return extractiveEngine.summarize(merged_text)
+    # Stream (SSE) → decoding có streamer (greedy / assisted), beam search không stream được token
+    decoding = summaryEngine.stream_decoding if on_event else None
+    summarized = summaryEngine.summarize(merged_text, minInput = 256, maxInput = 1024, on_event = on_event, decoding = decoding)
     return summarized
 
 
@@ -310,28 +432,55 @@ def summaryRun(merged_text):
 ### FINAL PROCESS
 
 #### SEARCHER
-def runSearch(query, faissIndex, Mapping, MapData, MapChunk):
+def runSearch(query, context, filters=None):
     results = searchEngine.search(
         query=query,
-        faissIndex=faissIndex,
-        Mapping=Mapping,
-        MapData=MapData,
-        MapChunk=MapChunk,
-        top_k=20
+        context=context,
+        top_k=20,
+        filters=filters
     )
     return results
 
 
+def parseSearchFilter(filters):
+    """dict điều kiện lọc (base_keys / chunk_range / chunk_ids / ids) → SearchFilter; ValueError nếu sai."""
+    return F_Filter.SearchFilter.coerce(filters)
+
+
 #### RERANKER
-def runRerank(query, results):
+def runRerank(query, results, context=None, cascade=None, stats=None):
     reranked = searchEngine.rerank(
         query=query,
         results=results,
-        top_k=10
+        top_k=10,
+        context=context,
+        cascade=cascade,
+        stats=stats
     )
     return reranked
 
 
+#### BATCH SEARCH / RERANK (nhiều query: 1 lần FAISS search, chung batch CrossEncoder)
+def runSearchMany(queries, context, filters=None):
+    return searchEngine.search_many(
+        queries=queries,
+        context=context,
+        top_k=20,
+        filters=filters
+    )
+
+
+def runRerankMany(queries, resultsList, context=None, cascade=None, stats=None):
+    return searchEngine.rerank_many(
+        queries=queries,
+        results_list=resultsList,
+        top_k=10,
+        context=context,
+        cascade=cascade,
+        stats=stats
+    )
+
+
 
 
 ## ==============================
@@ -339,18 +488,36 @@ def runRerank(query, results):
 ## ==============================
 
 #### READ DATA
-def ReadData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath):
+def ReadData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath, MapStorePath=None, LexicalPath=None, PassagesPath=None):
+    """
+    Có MapStore (memmap) → không nạp Mapping / MapData / MapChunk JSON.
+    Có LexicalPath → nạp BM25 đã lưu; chưa có thì dựng trong RAM từ cùng text.
+    Có PassagesPath → nạp token passage (memmap) cho reranker; chưa có thì rerank tokenize text như cũ.
+    """
     SegmentDict = MU.read_json(SegmentPath)
     FaissIndex = faiss.read_index(FaissPath)
-    Mapping = MU.read_json(MappingPath)
-    MapData = MU.read_json(MapDataPath)
-    MapChunk = MU.read_json(MapChunkPath)
+    if MapStorePath and MU.file_exists(MapStorePath):
+        Store = F_MapStore.MapStore.load(MapStorePath)
+        Mapping = MapData = MapChunk = None
+    else:
+        Store = None
+        Mapping = MU.read_json(MappingPath)
+        MapData = MU.read_json(MapDataPath)
+        MapChunk = MU.read_json(MapChunkPath)
+    if LexicalPath and MU.file_exists(LexicalPath):
+        Lexical = F_Lexical.BM25Index.load(LexicalPath)
+    else:
+        Lexical = F_Lexical.BM25Index.from_store(Store) if Store is not None else F_Lexical.BM25Index.from_mapdata(MapData or {})
+    Passages = F_PassageTokens.PassageTokens.load(PassagesPath) if PassagesPath and MU.file_exists(PassagesPath) else None
     return {
         "SegmentDict": SegmentDict,
         "FaissIndex": FaissIndex,
         "Mapping": Mapping,
         "MapData": MapData,
-        "MapChunk": MapChunk
+        "MapChunk": MapChunk,
+        "MapStore": Store,
+        "Lexical": Lexical,
+        "Passages": Passages
     }
     
 
@@ -381,7 +548,7 @@ def preReadPDF(PdfPath=None, PdfBytes=None):
 
 
 #### PREPARE DATA
-def PrepareData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath, RawDataDict=None):            
+def PrepareData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath, RawDataDict=None, VersionsPath=None):            
     if RawDataDict is not None:
         RawLvlsDict = structRun(RawDataDict)
         MU.write_json(RawLvlsDict, RawLvlsPath, indent=2)
@@ -408,6 +575,15 @@ def PrepareData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath,
     faiss.write_index(FaissIndex, FaissPath)
     MU.write_chunkmap(MapChunkPath, SegmentPath, chunk_groups)
     MapChunk = MU.read_json(MapChunkPath)
+    MU.write_json(faissIndexer.build_manifest(SegmentDict, chunk_groups), MetaPath, indent=2)
+    Store = F_MapStore.write_mapstore(MapStorePath, Mapping, MapData, MapChunk)
+    F_Lexical.BM25Index.from_store(Store).save(LexicalPath)
+    buildPassages = rerankTokens.build_passages if rerankTokens is not None else None
+    if buildPassages:
+        buildPassages(Store).save(PassagesPath)
+    if VersionsPath:
+        # Server đang chạy sẽ tự hot swap sang phiên bản này
+        F_Registry.publish_version(VersionsPath, FaissIndex, SegmentDict, Mapping, MapData, MapChunk, build_passages=buildPassages)
     
     print("\nCompleted!")
     
@@ -420,26 +596,86 @@ def PrepareData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath,
     }
     
 
+#### UPDATE DATA (incremental)
+def UpdateData(NewSegments=None, RemoveChunkIds=None,
+               SegmentPath=SegmentPath, SchemaPath=SchemaPath, FaissPath=FaissPath, MappingPath=MappingPath,
+               MapDataPath=MapDataPath, MapChunkPath=MapChunkPath, MetaPath=MetaPath, MapStorePath=MapStorePath,
+               VersionsPath=VersionsPath, LexicalPath=LexicalPath, PassagesPath=PassagesPath):
+    """
+    Cập nhật index sẵn có thay vì build lại:
+    - NewSegments: append vào cuối Segment, chỉ encode cặp (key, text) mới.
+    - RemoveChunkIds: gỡ chunk khỏi index (Segment giữ nguyên vị trí, chunk_id không dùng lại).
+    """
+    SegmentDict = MU.read_json(SegmentPath)
+    SchemaDict = MU.read_json(SchemaPath) or None
+    FaissIndex = faiss.read_index(FaissPath)
+    Mapping = MU.read_json(MappingPath)
+    MapData = MU.read_json(MapDataPath)
+    index_to_chunk = MU.read_json(MapChunkPath).get("index_to_chunk", {})
+    chunk_groups = [index_to_chunk.get(str(i), []) for i in range(max(map(int, index_to_chunk), default=-1) + 1)]
+
+    Manifest = MU.read_json(MetaPath)
+    if not Manifest:
+        Manifest = faissIndexer.build_manifest(SegmentDict, chunk_groups)
+
+    stats = {}
+    if RemoveChunkIds:
+        stats["removed"] = faissIndexer.remove_chunks(RemoveChunkIds, FaissIndex, Mapping, MapData, chunk_groups, Manifest)
+
+    if NewSegments:
+        start = len(SegmentDict) + 1
+        chunk_ids = list(range(start, start + len(NewSegments)))
+        for cid, item in zip(chunk_ids, NewSegments):
+            item["Index"] = cid
+        SegmentDict.extend(NewSegments)
+        stats["added"] = faissIndexer.add_segments(
+            NewSegments, FaissIndex, Mapping, MapData, chunk_groups, Manifest,
+            SchemaDict=SchemaDict, chunk_ids=chunk_ids
+        )
+        MU.write_json(SegmentDict, SegmentPath, indent=2)
+
+    MU.write_json(Mapping, MappingPath, indent=2)
+    MU.write_json(MapData, MapDataPath, indent=2)
+    faiss.write_index(FaissIndex, FaissPath)
+    MU.write_chunkmap(MapChunkPath, SegmentPath, chunk_groups)
+    MU.write_json(Manifest, MetaPath, indent=2)
+    MapChunk = MU.read_json(MapChunkPath)
+    Store = F_MapStore.write_mapstore(MapStorePath, Mapping, MapData, MapChunk)
+    F_Lexical.BM25Index.from_store(Store).save(LexicalPath)
+    buildPassages = rerankTokens.build_passages if rerankTokens is not None else None
+    if buildPassages:
+        buildPassages(Store).save(PassagesPath)
+    if VersionsPath:
+        F_Registry.publish_version(VersionsPath, FaissIndex, SegmentDict, Mapping, MapData, MapChunk, build_passages=buildPassages)
+    print(f"✅ Incremental update: {stats}")
+
+    return {
+        "SegmentDict": SegmentDict,
+        "FaissIndex": FaissIndex,
+        "Mapping": Mapping,
+        "MapData": MapData,
+        "MapChunk": MapChunk
+    }
+
+
 #### SUMMARIZE
-def summarizeDcmt(RawDataDict):
+def summarizeDcmt(RawDataDict, mode="abstractive", on_event=None):
     merged_text = mergebyText(RawDataDict)
-    summarized = summaryRun(merged_text)
+    summarized = summaryRun(merged_text, mode=mode, on_event=on_event)
     return summarized["summary_text"]
 
 
 #### CLASSIFY
 def classifyDocument(summaryText):
-    readedData = ReadData(serviceSegmentPath, serviceFaissPath, serviceMappingPath, serviceMapDataPath, serviceMapChunkPath)
-    serviceSegmentDict = readedData.get("SegmentDict")
-    serviceFaissIndex = readedData.get("FaissIndex")
-    serviceMapping = readedData.get("Mapping")
-    serviceMapData = readedData.get("MapData")
-    serviceMapChunk = readedData.get("MapChunk")
+    # Dùng SearchContext đã dựng sẵn lúc nạp thay vì đọc lại index + JSON mỗi lần
+    serviceBundle = currentIndex(g_serviceRegistry)
+    if serviceBundle is None:
+        return None
     
-    searchRes = runSearch(summaryText, serviceFaissIndex, serviceMapping, serviceMapData, serviceMapChunk)
-    reranked = runRerank(summaryText, searchRes)
+    searchRes = runSearch(summaryText, serviceBundle.context)
+    reranked = runRerank(summaryText, searchRes, serviceBundle.context)
     
-    bestCategory = ChunkMapper.process_chunks_pipeline(reranked_results=reranked, SegmentDict=serviceSegmentDict, drop_fields=["Index"], fields=["Article"], n_chunks=1)
+    bestCategory = ChunkMapper.process_chunks_pipeline(reranked_results=reranked, SegmentDict=serviceBundle.Segments, drop_fields=["Index"], fields=["Article"], n_chunks=1)
     bestArticles = [item["fields"].get("Article") for item in bestCategory["extracted_fields"]]
     bestArticle = bestArticles[0] if len(bestArticles) == 1 else ", ".join(bestArticles)
     return bestArticle
@@ -451,42 +687,54 @@ def classifyDocument(summaryText):
 ## SERVER DATA LOAD
 ## ==============================
 print("Server is starting, loading main search index...")
+# Registry: nạp phiên bản mới nhất trong *_Versions (mmap nếu được) và tự hot swap khi có bản mới;
+# chưa có phiên bản nào → dùng bộ file hiện có làm bản "base".
+g_mainRegistry = F_Registry.IndexRegistry(VersionsPath, name=infilename, poll_sec=INDEX_WATCH_SEC, on_swap=onIndexSwap)
 try:
-    # Tải dữ liệu chính (HNMU) để tìm kiếm
-    g_readedData = ReadData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath)
-    g_SegmentDict = g_readedData.get("SegmentDict")
-    g_FaissIndex = g_readedData.get("FaissIndex")
-    g_Mapping = g_readedData.get("Mapping")
-    g_MapData = g_readedData.get("MapData")
-    g_MapChunk = g_readedData.get("MapChunk")
+    if not g_mainRegistry.refresh():
+        g_mainRegistry.seed("base", ReadData(SegmentPath, FaissPath, MappingPath, MapDataPath, MapChunkPath, MapStorePath, LexicalPath, PassagesPath))
     
-    if g_FaissIndex:
-        print(f"✅ Main search index '{infilename}' loaded successfully.")
+    if g_mainRegistry.current().FaissIndex:
+        print(f"✅ Main search index '{infilename}' loaded successfully ({g_mainRegistry.current().version}).")
     else:
         print(f"⚠️ Could not load main search index from {FaissPath}.")
         
 except Exception as e:
     print(f"❌ CRITICAL: Failed to load main search index: {e}")
-    g_FaissIndex = None
+g_mainRegistry.start_watch()
 
 # Tải dữ liệu 'service' (Categories) để phân loại
 print("Loading 'Categories' index for classification...")
+g_serviceRegistry = F_Registry.IndexRegistry(serviceVersionsPath, name="Categories", poll_sec=INDEX_WATCH_SEC, on_swap=onIndexSwap)
 try:
-    g_serviceData = ReadData(serviceSegmentPath, serviceFaissPath, serviceMappingPath, serviceMapDataPath, serviceMapChunkPath)
-    g_serviceSegmentDict = g_serviceData.get("SegmentDict")
-    g_serviceFaissIndex = g_serviceData.get("FaissIndex")
-    g_serviceMapping = g_serviceData.get("Mapping")
-    g_serviceMapData = g_serviceData.get("MapData")
-    g_serviceMapChunk = g_serviceData.get("MapChunk")
+    if not g_serviceRegistry.refresh():
+        g_serviceRegistry.seed("base", ReadData(serviceSegmentPath, serviceFaissPath, serviceMappingPath, serviceMapDataPath, serviceMapChunkPath, serviceMapStorePath, serviceLexicalPath, servicePassagesPath))
     
-    if g_serviceFaissIndex:
+    if g_serviceRegistry.current().FaissIndex:
         print("✅ 'Categories' index loaded successfully.")
     else:
         print("⚠️ Could not load 'Categories' index.")
 
 except Exception as e:
     print(f"❌ CRITICAL: Failed to load 'Categories' index: {e}")
-    g_serviceFaissIndex = None
+g_serviceRegistry.start_watch()
+
+
+def currentIndex(registry):
+    """Bundle hiện hành (hoặc None). Lấy 1 lần / request để cả request dùng cùng 1 phiên bản."""
+    bundle = registry.current()
+    return bundle if bundle is not None and bundle.FaissIndex else None
+
+
+def indexVersions():
+    """Phiên bản đang phục vụ + thời gian nạp / RSS của từng phiên bản đã nạp."""
+    return {
+        registry.name: {
+            "current": registry.current().version if registry.current() else None,
+            "history": registry.history(),
+        }
+        for registry in (g_mainRegistry, g_serviceRegistry)
+    }
 
 
 
@@ -495,13 +743,19 @@ except Exception as e:
 ## API PIPELINE FUNCTIONS
 ## ==============================
 
-def process_pdf_pipeline(pdf_bytes):
+def process_pdf_pipeline(pdf_bytes, on_event=None):
     """
     Pipeline cho endpoint /process_pdf.
     Nhận PDF bytes -> tóm tắt -> phân loại.
+    on_event (tùy chọn): nhận sự kiện {"event": "stage", "stage": ...} và tiến độ tóm tắt (SSE).
     """
+    def emit_stage(stage):
+        if on_event:
+            on_event({"event": "stage", "stage": stage})
+
     print("Processing new PDF...")
     # 1. Trích xuất
+    emit_stage("extract")
     RawDataDict = preReadPDF(PdfPath=None, PdfBytes=pdf_bytes)
     if RawDataDict is None:
         print("PDF quality check failed or extraction failed.")
@@ -513,21 +767,24 @@ def process_pdf_pipeline(pdf_bytes):
 
     # 2. Tóm tắt
     print("Summarizing PDF...")
-    summaryText = summarizeDcmt(RawDataDict)
+    emit_stage("summarize")
+    summaryText = summarizeDcmt(RawDataDict, on_event=on_event)
     
     # 3. Phân loại (sử dụng global index 'service')
     print("Classifying PDF...")
-    if not g_serviceFaissIndex:
+    emit_stage("classify")
+    serviceBundle = currentIndex(g_serviceRegistry)
+    if serviceBundle is None:
         print("Cannot classify: 'Categories' index not loaded.")
         bestArticle = "Không thể phân loại (chưa tải index)"
     else:
         # Tái sử dụng hàm classifyDocument nhưng truyền index vào
-        searchRes = runSearch(summaryText, g_serviceFaissIndex, g_serviceMapping, g_serviceMapData, g_serviceMapChunk)
-        reranked = runRerank(summaryText, searchRes)
+        searchRes = runSearch(summaryText, serviceBundle.context)
+        reranked = runRerank(summaryText, searchRes, serviceBundle.context)
         
         bestCategory = ChunkMapper.process_chunks_pipeline(
             reranked_results=reranked, 
-            SegmentDict=g_serviceSegmentDict, 
+            SegmentDict=serviceBundle.Segments, 
             drop_fields=["Index"], 
             fields=["Article"], 
             n_chunks=1
@@ -543,27 +800,71 @@ def process_pdf_pipeline(pdf_bytes):
     }
 
 
-def search_pipeline(query_text, k=10):
+def search_pipeline(query_text, k=10, filters=None):
     """
     Pipeline cho endpoint /search.
     Nhận query -> tìm kiếm trên index chính (HNMU).
+    filters: SearchFilter / dict (base_keys, chunk_range, chunk_ids, ids) → lọc ngay trong FAISS.
     """
     print(f"Searching for: '{query_text}'")
-    if not g_FaissIndex:
+    bundle = currentIndex(g_mainRegistry)
+    if bundle is None:
         print("Cannot search: Main index not loaded.")
         raise Exception("Không thể tìm kiếm (chưa tải index chính)")
 
     # 1. Search và Rerank
-    searchRes = runSearch(query_text, g_FaissIndex, g_Mapping, g_MapData, g_MapChunk)
-    reranked = runRerank(query_text, searchRes)
+    searchRes = runSearch(query_text, bundle.context, filters)
+    rerankStats = {}
+    reranked = runRerank(query_text, searchRes, bundle.context, cascade=searchCascade, stats=rerankStats)
+    print(f"Rerank: {rerankStats.get('decision')} → {rerankStats.get('reranked_pairs')}/{rerankStats.get('candidates')} pairs "
+          f"({rerankStats.get('cached_pairs')} cached)")
 
-    # 2. Map chunks và trích xuất
+    # 2. Map chunks (xếp theo điểm gộp của chunk) và trích xuất
     chunkReturn = ChunkMapper.process_chunks_pipeline(
         reranked_results=reranked,
-        SegmentDict=g_SegmentDict,
+        SegmentDict=bundle.Segments,
         drop_fields=["Index"],
         fields=None,
         n_chunks=k,
+        chunk_agg=CHUNK_AGG,
+        chunk_index=ChunkMapper.ChunkIndex.from_store(bundle.context.store),
     )
     
-    return chunkReturn.get("extracted_fields", [])
\ No newline at end of file
+    return chunkReturn.get("extracted_fields", [])
+
+
+def search_batch_pipeline(queries, k=10, filters=None):
+    """
+    Pipeline cho endpoint /search_batch.
+    Như search_pipeline cho nhiều query: encode theo batch, 1 lần FAISS search, rerank chung batch.
+    filters: áp dụng chung cho cả lô.
+    Trả về: danh sách kết quả theo đúng thứ tự queries.
+    """
+    print(f"Batch searching {len(queries)} queries")
+    bundle = currentIndex(g_mainRegistry)
+    if bundle is None:
+        print("Cannot search: Main index not loaded.")
+        raise Exception("Không thể tìm kiếm (chưa tải index chính)")
+
+    # 1. Search và Rerank (cả lô trên cùng 1 phiên bản index)
+    searchRes = runSearchMany(queries, bundle.context, filters)
+    rerankStats = []
+    rerankedList = runRerankMany(queries, searchRes, bundle.context, cascade=searchCascade, stats=rerankStats)
+    print(f"Rerank: {sum(st['reranked_pairs'] for st in rerankStats)}/{sum(st['candidates'] for st in rerankStats)} pairs, "
+          f"{sum(st['decision'] == 'skip' for st in rerankStats)} skipped")
+
+    # 2. Map chunks (xếp theo điểm gộp của chunk) và trích xuất
+    chunkIndex = ChunkMapper.ChunkIndex.from_store(bundle.context.store)
+    outputs = []
+    for reranked in rerankedList:
+        chunkReturn = ChunkMapper.process_chunks_pipeline(
+            reranked_results=reranked,
+            SegmentDict=bundle.Segments,
+            drop_fields=["Index"],
+            fields=None,
+            n_chunks=k,
+            chunk_agg=CHUNK_AGG,
+            chunk_index=chunkIndex,
+        )
+        outputs.append(chunkReturn.get("extracted_fields", []))
+    return outputs